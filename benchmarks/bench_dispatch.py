@@ -0,0 +1,75 @@
+"""
+Micro-benchmark of the client side cost of a Stubo api call: method 
+dispatch and url building, with the http post replaced by a no-op.
+
+LegacyStubo reproduces the dispatch of stubolib 0.1 (a new partial per 
+attribute lookup and a url formatted on every call) for comparison.
+
+    $ python -m benchmarks.bench_dispatch -n 100000
+"""
+import timeit
+from argparse import ArgumentParser
+from functools import partial
+from urllib import urlencode
+from stubolib.api import Stubo
+
+class NoPostStubo(Stubo):
+    
+    def _post(self, url, data=None, json=None):
+        return url
+    
+
+class LegacyStubo(NoPostStubo):
+    
+    def __getattr__(self, name):
+        return partial(self, method=name)
+    
+    def __call__(self, **kwargs):
+        method = self._method_to_path(kwargs.pop('method'))
+        data = kwargs.pop('data', None)
+        json = kwargs.pop('json', None)
+        if self.ssl:
+            protocol = 'https'
+        else:
+            protocol = 'http'
+        if kwargs:   
+            params = urlencode(kwargs, True)
+            url = "{protocol}://{dc}/{api_version}/{method}?{params}".format(
+              protocol=protocol, dc=self.dc, api_version=self.api_version,
+              method=method, params=params)
+        else:
+            url = "{protocol}://{dc}/{api_version}/{method}".format(
+              protocol=protocol, dc=self.dc, api_version=self.api_version,
+              method=method)
+        return self._post(url, data=data, json=json)
+    
+CASES = [
+    ('no params', lambda s: s.get_status()),
+    ('one param', lambda s: s.get_response(session='first_1', data='x')),
+    ('two params', lambda s: s.get_status(scenario='first', 
+                                          session='first_1')),
+]    
+
+def run(number, repeat):
+    results = []
+    for case, call in CASES:
+        row = [case]
+        for cls in (LegacyStubo, NoPostStubo):
+            stubo = cls('localhost:8001')
+            best = min(timeit.repeat(partial(call, stubo), number=number, 
+                                     repeat=repeat))
+            row.append(best / number * 1e6)
+        results.append(row)
+    return results
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Stubo api dispatch benchmark")  
+    parser.add_argument('-n', '--number', dest='number', type=int,
+                        default=100000, help="calls per timing")
+    parser.add_argument('-r', '--repeat', dest='repeat', type=int,
+                        default=3, help="timings, the best is reported")
+    args = parser.parse_args()
+    print '{0:<12} {1:>12} {2:>12}'.format('case', 'before (us)', 
+                                            'after (us)')
+    for case, before, after in run(args.number, args.repeat):
+        print '{0:<12} {1:>12.2f} {2:>12.2f}'.format(case, before, after)
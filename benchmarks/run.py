@@ -0,0 +1,248 @@
+"""
+Client throughput and latency benchmarks against a local stand-in stubo 
+server (see stubo_server.py).
+
+Suites:
+
+- api: Stubo call throughput and latency, serial and from threads
+- adapter: StuboAdapter interception overhead per call, with the network 
+  send replaced by a no-op
+- upload: Session.stop() upload time by call count, body size and upload
+  concurrency
+- memory: resident memory per recorded call by body size
+
+Results are written as JSON so runs of different versions can be compared:
+
+    $ python -m benchmarks.run -o after.json
+    $ python -m benchmarks.run --quick --compare before.json
+"""
+import gc
+import os
+import sys
+import json
+import time
+import platform
+import threading
+import resource
+from argparse import ArgumentParser
+import mock
+import requests
+from requests.models import Response
+import stubolib
+from stubolib.api import Stubo
+from stubolib.session import Session, HTTPCall
+from benchmarks.stubo_server import StuboServer
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+def latency_stats(latencies, elapsed):
+    return dict(calls=len(latencies), 
+                calls_per_sec=len(latencies) / elapsed,
+                mean_ms=sum(latencies) / len(latencies) * 1000,
+                p50_ms=percentile(latencies, 50) * 1000,
+                p95_ms=percentile(latencies, 95) * 1000,
+                p99_ms=percentile(latencies, 99) * 1000)
+
+def timed_calls(func, calls):
+    latencies = []
+    for _ in xrange(calls):
+        start = time.time()
+        func()
+        latencies.append(time.time() - start)
+    return latencies    
+
+def bench_api(server, quick):
+    calls = 200 if quick else 2000
+    results = []
+    for threads in (1, 4):
+        stubo = Stubo(server.dc, pool_maxsize=threads)
+        stubo.get_status()
+        latencies = []
+        lock = threading.Lock()
+        def worker():
+            mine = timed_calls(lambda: stubo.get_status(scenario='bench'), 
+                               calls // threads)
+            with lock:
+                latencies.extend(mine)
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        start = time.time()
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        row = latency_stats(latencies, time.time() - start)
+        row.update(name='get_status', threads=threads)
+        results.append(row)
+        stubo.close()
+    return results
+
+def bench_adapter(server, quick):
+    calls = 2000 if quick else 20000
+    results = []
+    canned = Response()
+    canned.status_code = 200
+    canned._content = 'ok'
+    for mode in ('playback', 'record'):
+        session = Session(server.dc, 'bench', 'bench_1', mode=mode)
+        session._start_local()
+        http = session.get_requests_session()
+        prepared = requests.Request('POST', 'http://foo.com/x?a=b', 
+                                    data='hello', 
+                                    headers={'X-Foo': 'bar'}).prepare()
+        adapter = http.get_adapter(prepared.url)
+        def send(self, request, **kwargs):
+            if session.mode == 'record':
+                session.record_response(canned)
+            return canned
+        with mock.patch('requests.adapters.HTTPAdapter.send', send):
+            start = time.time()
+            for _ in xrange(calls):
+                adapter.send(prepared.copy())
+            elapsed = time.time() - start
+        results.append(dict(name='send', mode=mode, calls=calls, 
+                            us_per_call=elapsed / calls * 1e6))
+    return results
+
+def _calls(count, body_size):
+    body = 'x' * body_size
+    calls = []
+    for i in xrange(count):
+        call = HTTPCall('foo.com')
+        call.request_method = 'POST'
+        call.request_url = 'http://foo.com/x?n={0}'.format(i)
+        call.request_body = 'request {0}'.format(i)
+        call.response_status = 200
+        call.response_body = body
+        call.call_number = i
+        calls.append(call)
+    return calls    
+
+def bench_upload(server, quick):
+    counts = (10, 100) if quick else (10, 100, 1000)
+    results = []
+    for count in counts:
+        for body_size in (100, 10000):
+            for concurrency in (1, 8):
+                session = Session(server.dc, 'bench', 'bench_1',
+                                  upload_concurrency=concurrency)
+                session.mode = 'record'
+                session.start()
+                session._calls = _calls(count, body_size)
+                start = time.time()
+                session.stop()
+                elapsed = time.time() - start
+                results.append(dict(name='stop', calls=count, 
+                                    body_size=body_size, 
+                                    concurrency=concurrency,
+                                    seconds=elapsed, 
+                                    calls_per_sec=count / elapsed))
+                session.stubo.close()
+    return results
+
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        # peak, not current, resident size elsewhere
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+def bench_memory(server, quick):
+    count = 200 if quick else 1000
+    results = []
+    url = 'http://{0}/echo'.format(server.dc)
+    for body_size in (1000, 100000):
+        session = Session(server.dc, 'bench', 'bench_1', mode='record')
+        session._start_local()
+        http = session.get_requests_session()
+        body = 'x' * body_size
+        http.post(url, data=body)
+        gc.collect()
+        before = rss_bytes()
+        for _ in xrange(count):
+            http.post(url, data=body)
+        gc.collect()
+        after = rss_bytes()
+        results.append(dict(name='record', calls=count, body_size=body_size,
+                            bytes_per_call=(after - before) / float(count)))
+        del session._calls[:]
+        http.close()
+    return results
+
+SUITES = [
+    ('api', bench_api),
+    ('adapter', bench_adapter),
+    ('upload', bench_upload),
+    ('memory', bench_memory),
+]
+
+# the metric compared between runs and whether higher is better
+METRICS = {
+    'api': ('calls_per_sec', True),
+    'adapter': ('us_per_call', False),
+    'upload': ('seconds', False),
+    'memory': ('bytes_per_call', False),
+}
+
+def run(suites, quick=False):
+    results = dict(stubolib=stubolib.version, 
+                   python=platform.python_version(), 
+                   platform=platform.platform(), 
+                   quick=quick, suites={})
+    with StuboServer() as server:
+        for name, bench in SUITES:
+            if name in suites:
+                results['suites'][name] = bench(server, quick)
+    return results
+
+# the fields identifying a result row
+PARAMS = ('name', 'mode', 'threads', 'calls', 'body_size', 'concurrency')
+
+def _key(row):
+    return tuple((k, row[k]) for k in PARAMS if k in row)
+
+def compare(baseline, results):
+    """Yields (suite, row key, metric, before, after, change %)."""
+    for suite, rows in sorted(results['suites'].items()):
+        metric, _ = METRICS[suite]
+        before = dict((_key(r), r) for r in 
+                      baseline['suites'].get(suite, []))
+        for row in rows:
+            old = before.get(_key(row))
+            if old is None or not old.get(metric):
+                continue
+            change = (row[metric] - old[metric]) / old[metric] * 100
+            yield suite, _key(row), metric, old[metric], row[metric], change
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Stubo client benchmarks")  
+    parser.add_argument('-s', '--suite', dest='suites', action='append',
+                        choices=[name for name, _ in SUITES], 
+                        help="suite to run, default all")
+    parser.add_argument('-q', '--quick', dest='quick', action='store_true',
+                        help="fewer calls and sizes")
+    parser.add_argument('-o', '--output', dest='output',
+                        help="write the JSON results to this file")
+    parser.add_argument('-c', '--compare', dest='compare',
+                        help="JSON results of a previous run to compare with")
+    args = parser.parse_args()
+    results = run(args.suites or [name for name, _ in SUITES], args.quick)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        print json.dumps(results, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        for suite, key, metric, before, after, change in compare(baseline,
+                                                                 results):
+            print '{0:<8} {1:<60} {2:<14} {3:>12.4g} {4:>12.4g} {5:>+7.1f}%'\
+                .format(suite, ', '.join('{0}={1}'.format(*kv) for kv in key),
+                        metric, before, after, change)
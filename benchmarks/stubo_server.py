@@ -0,0 +1,113 @@
+"""
+A minimal in-process stand-in for a stubo server, enough of the api for the
+client benchmarks: get/status, begin/session, end/session, delete/stubs, 
+put/stub and get/response (first stub whose matchers are all in the body).
+``/echo`` answers with the request body for recording.
+"""
+import json
+import threading
+import urlparse
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+class StuboState(object):
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stubs = {}
+        
+    def put_stub(self, session, stub):
+        with self.lock:
+            self.stubs.setdefault(session, []).append(stub)
+            
+    def find(self, session, body):
+        for stub in self.stubs.get(session, []):
+            matchers = stub['request']['bodyPatterns'][0]['contains']
+            if all(m in body for m in matchers):
+                return stub
+        return None        
+        
+    def clear(self):
+        with self.lock:
+            self.stubs.clear()
+
+
+class StuboHandler(BaseHTTPRequestHandler):
+    
+    protocol_version = 'HTTP/1.1'
+    # write each response in one segment, avoiding delayed ack stalls
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    
+    def log_message(self, *args):
+        pass
+    
+    def _send(self, status, body, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-Stubo-Version', 'bench')
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _json(self, status=200, **payload):
+        payload['version'] = 'bench'
+        self._send(status, json.dumps(payload))
+        
+    def do_GET(self):
+        self.do_POST()
+    
+    def do_POST(self):
+        parts = urlparse.urlsplit(self.path)
+        args = dict(urlparse.parse_qsl(parts.query))
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else ''
+        state = self.server.state
+        path = parts.path
+        if path == '/echo':
+            self._send(200, body, 'text/plain')
+        elif path == '/stubo/api/put/stub':
+            state.put_stub(args.get('session'), json.loads(body))
+            self._json(data=dict(message='put stub ok'))
+        elif path == '/stubo/api/get/response':
+            stub = state.find(args.get('session'), body)
+            if stub is None:
+                self._json(400, error=dict(code=400, 
+                           message='E017:No matching response found'))
+            else:
+                self._send(200, stub['response']['body'] or '', 
+                           'text/plain')
+        elif path == '/stubo/api/delete/stubs':
+            state.clear()
+            self._json(data=dict(message='stubs deleted'))
+        elif path in ('/stubo/api/get/status', '/stubo/api/begin/session', 
+                      '/stubo/api/end/session'):
+            self._json(data=dict(cache_server=dict(status='ok'), 
+                                 database_server=dict(status='ok')))
+        else:
+            self._send(404, 'HTTP 404: Not Found', 'text/plain')
+    
+
+class StuboServer(ThreadingMixIn, HTTPServer):
+    """Serves the stand-in api on localhost in a daemon thread."""
+    
+    daemon_threads = True
+    
+    def __init__(self, port=0):
+        HTTPServer.__init__(self, ('localhost', port), StuboHandler)
+        self.state = StuboState()
+        self._thread = None
+        
+    @property
+    def dc(self):
+        return 'localhost:{0}'.format(self.server_port)
+        
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+        self.server_close()
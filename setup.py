@@ -26,14 +26,20 @@ setup(name='stubolib',
         ],
       url='',
       keywords='stubo testing library',
-      packages=find_packages(),
+      packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
       include_package_data=True,
       zip_safe=False,
       install_requires = requires,
+      extras_require = {
+        'async': ['tornado>=4.0'],
+        'fast': ['ujson>=1.34'],
+      },
       tests_require= requires,
       test_suite="stubolib",
       entry_points = """\
       [console_scripts]
+      stubo-loadgen = stubolib.loadgen:main
+      stubo-migrate = stubolib.migrate:main
       """      
       )
 
@@ -1,7 +1,17 @@
-from urllib import urlencode
+from urllib import urlencode, quote_plus
 from functools import partial
+import time
+import zlib
 import logging
+import threading
 import requests
+from requests.adapters import HTTPAdapter, DEFAULT_POOLSIZE
+from requests.exceptions import RequestException
+from cache import ResponseCache, CachedResponse
+from codec import json_response
+import codec
+from balancer import Balancer
+from breaker import CircuitBreaker
 
 log = logging.getLogger(__name__)
 
@@ -11,44 +21,442 @@ class StuboApiVersion(object):
 class StuboError(Exception):
     pass
 
+class CircuitOpenError(StuboError):
+    """Raised without calling the server while its circuit is open."""
+    
+class EncodedBody(str):
+    """A request body encoded ahead of the call."""
+    
+    content_type = None
+    content_encoding = None
+    
+    def headers(self):
+        headers = {}
+        if self.content_type:
+            headers['Content-Type'] = self.content_type
+        if self.content_encoding:
+            headers['Content-Encoding'] = self.content_encoding
+        return headers
+    
+class GzipBody(EncodedBody):
+    """A gzip compressed request body."""
+    
+    content_encoding = 'gzip'
+    
+def json_body(encoded):
+    """Returns JSON bytes as an :class:`EncodedBody <EncodedBody>`."""
+    body = EncodedBody(encoded)
+    body.content_type = 'application/json'
+    return body
+    
+def gzip_body(body, level=6, content_type=None):
+    """Returns body gzip compressed as a :class:`GzipBody <GzipBody>`."""
+    if isinstance(body, unicode):
+        body = body.encode('utf-8')
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    compressed = GzipBody(compressor.compress(body) + compressor.flush())
+    compressed.content_type = content_type
+    return compressed
+
+# http sessions shared between Stubo instances talking to the same dc,
+# keyed by (protocol, servers) => [requests.Session, reference count]
+_shared_pools = {}
+_shared_pools_lock = threading.Lock()
+
+def _new_http_session(pool_connections, pool_maxsize):
+    """Returns a requests session with a keep-alive connection pool."""
+    http_session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections,
+                          pool_maxsize=pool_maxsize)
+    http_session.mount('http://', adapter)
+    http_session.mount('https://', adapter)
+    return http_session
+
+def _acquire_shared_session(key, pool_connections, pool_maxsize):
+    with _shared_pools_lock:
+        entry = _shared_pools.get(key)
+        if not entry:
+            entry = _shared_pools[key] = [_new_http_session(pool_connections,
+                                                            pool_maxsize), 0]
+        entry[1] += 1
+        return entry[0]
+
+def _release_shared_session(key):
+    with _shared_pools_lock:
+        entry = _shared_pools.get(key)
+        if not entry:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del _shared_pools[key]
+            entry[0].close()
+
+# api methods with request bodies worth compressing
+COMPRESSED_METHODS = frozenset(['put_stub', 'exec_cmds'])
+
 class Stubo(object):
+    """Weakly typed client for the stubo HTTP JSON API.
+
+    Calls are made over a long lived keep-alive connection pool which is
+    created on first use and released by ``close()``. 
+
+    :param pool_connections: number of host pools to cache.
+    :param pool_maxsize: maximum number of connections kept per host.
+    :param share_pool: share one connection pool between all instances 
+                       pointing at the same ``dc``.
+    :param cache_size: cache up to this many get/response responses, 0 
+                       disables the cache.
+    :param cache_ttl: seconds a cached response stays valid.
+    :param metrics: a :class:`Metrics <Metrics>` to instrument calls with.
+    :param balance: 'round_robin' or 'least_outstanding', how calls are 
+                    spread when ``dc`` is a list of servers.
+    :param health_interval: seconds between get/status probes of each 
+                            server when ``dc`` is a list, None to only 
+                            eject servers that fail to connect.
+    :param health_retry: seconds after which a server ejected when ``dc`` 
+                         is a list is given a trial call, a success brings 
+                         it back.
+    :param health_timeout: seconds a health probe waits for a server.
+    :param connect_timeout: seconds to wait for a connection to stubo.
+    :param read_timeout: seconds to wait for a stubo response.
+    :param breaker_failures: consecutive failed calls to a server after 
+                             which its circuit opens and calls fail fast 
+                             with :class:`CircuitOpenError`, None disables 
+                             the circuit breaker.
+    :param breaker_reset: seconds before an open circuit probes the server
+                          with get/status and closes if it is healthy.
+    :param breaker_slow_call: calls slower than this many seconds count as 
+                              failures.
+    :param compress_threshold: gzip put/stub and exec/cmds request bodies of
+                               at least this many bytes, None sends them 
+                               uncompressed. The stubo server must accept 
+                               gzip request bodies.
+    :param compress_level: zlib compression level, 1 (fastest) to 9.
+    
+    Responses are negotiated with ``Accept-Encoding: gzip, deflate`` and 
+    decompressed transparently.
+    
+    When ``dc`` is a list of 'host:port' servers each call goes to a healthy
+    server chosen by the ``balance`` policy, calls for a session go to the 
+    server it was begun on until it is ended.
+    
+    Api methods are looked up once per class, later calls use the cached
+    method and a prebuilt base url for the method.
+    """
        
-    def __init__(self, dc=None, api_version=None, ssl=False, **kwargs): 
+    def __init__(self, dc=None, api_version=None, ssl=False, 
+                 pool_connections=DEFAULT_POOLSIZE, 
+                 pool_maxsize=DEFAULT_POOLSIZE, share_pool=False, 
+                 cache_size=0, cache_ttl=None, metrics=None, 
+                 balance=Balancer.ROUND_ROBIN, health_interval=None,
+                 health_timeout=2, health_retry=30, connect_timeout=None, 
+                 read_timeout=None, breaker_failures=None, breaker_reset=30, 
+                 breaker_slow_call=None, compress_threshold=None, 
+                 compress_level=6, **kwargs): 
+        self._base_urls = {}
+        self.balancer = None
+        self.health_timeout = health_timeout
+        if isinstance(dc, (list, tuple)):
+            self.balancer = Balancer(dc, policy=balance, 
+                                     probe=self.check_server,
+                                     health_interval=health_interval,
+                                     retry_after=health_retry)
+            dc = dc[0]
         self.dc = dc or 'localhost:8001'
         self.ssl = ssl
         self.api_version = api_version or StuboApiVersion.V1
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.share_pool = share_pool
         self.defaults = kwargs or {}
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+        if connect_timeout is not None or read_timeout is not None:
+            self.defaults['timeout'] = (connect_timeout, read_timeout)
+        self.breakers = None
+        if breaker_failures:
+            self.breakers = {}
+            self.breaker_failures = breaker_failures
+            self.breaker_reset = breaker_reset
+            self.breaker_slow_call = breaker_slow_call
+        self._http_session = None
+        self._http_session_lock = threading.Lock()
+        self.metrics = metrics
+        self.response_cache = None
+        if cache_size:
+            self.response_cache = ResponseCache(maxsize=cache_size, 
+                                                ttl=cache_ttl)
         
     def get_auth(self):
         return self.defaults.get('auth')    
 
     def __getattr__(self, name):
-        return partial(self, method=name)
+        if name.startswith('_'):
+            return partial(self, method=name)
+        # kept on the class, a function held by the instance would keep it
+        # (and its pool) alive in a reference cycle
+        def method(self, **kwargs):
+            return self._call(name, kwargs)
+        method.__name__ = name
+        setattr(type(self), name, method)
+        return getattr(self, name)
+    
+    def _set_base(name):
+        attr = '_' + name
+        def get(self):
+            return self.__dict__[attr]
+        def set(self, value):
+            self.__dict__[attr] = value
+            self._base_urls.clear()
+        return property(get, set)
+    
+    dc = _set_base('dc')
+    ssl = _set_base('ssl')
+    api_version = _set_base('api_version')
+    del _set_base
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        
+    @property
+    def protocol(self):
+        return 'https' if self.ssl else 'http'
+    
+    @property
+    def servers(self):
+        if self.balancer is not None:
+            return self.balancer.servers
+        return [self.dc]
+    
+    def server_for(self, session):
+        """Returns the server calls for a session go to."""
+        if self.balancer is not None:
+            return self.balancer.server_for(session) or self.dc
+        return self.dc
+    
+    def get_breaker(self, server):
+        """Returns the circuit breaker of a server, None if disabled."""
+        if self.breakers is None:
+            return None
+        breaker = self.breakers.get(server)
+        if breaker is None:
+            breaker = self.breakers.setdefault(server, 
+                                               self._new_breaker(server))
+        return breaker
+    
+    def _new_breaker(self, server):
+        return CircuitBreaker(server, failure_threshold=self.breaker_failures,
+                              reset_timeout=self.breaker_reset,
+                              slow_call=self.breaker_slow_call,
+                              probe=partial(self.check_server, server))
+    
+    def _pool_key(self):
+        return (self.protocol, tuple(self.servers))
+    
+    def get_http_session(self):
+        """Returns the pooled requests session used for api calls."""
+        http_session = self._http_session
+        if http_session is not None:
+            return http_session
+        with self._http_session_lock:
+            # first calls from several threads create a single session
+            if self._http_session is None:
+                if self.share_pool:
+                    self._http_session = _acquire_shared_session(
+                        self._pool_key(), self.pool_connections, 
+                        self.pool_maxsize)
+                else:
+                    self._http_session = _new_http_session(
+                        self.pool_connections, self.pool_maxsize)
+            return self._http_session
+    
+    def close(self):
+        """Releases the connection pool, a new one is created on next call."""
+        if self.balancer is not None:
+            self.balancer.stop()
+        with self._http_session_lock:
+            if self._http_session is None:
+                return
+            if self.share_pool:
+                _release_shared_session(self._pool_key())
+            else:
+                self._http_session.close()
+            self._http_session = None
     
     def _method_to_path(self, method):
         parts = method.partition('_')
         return '{0}/{1}'.format(parts[0], parts[-1])  
     
+    def _base_url(self, name, server=None):
+        key = (server, name)
+        base = self._base_urls.get(key)
+        if base is None:
+            base = self._base_urls[key] = \
+                "{protocol}://{dc}/{api_version}/{method}".format(
+                protocol=self.protocol, dc=server or self.dc, 
+                api_version=self.api_version, 
+                method=self._method_to_path(name))
+        return base
+    
+    def _url(self, name, params, server=None):
+        base = self._base_url(name, server)
+        if not params:
+            return base
+        if len(params) == 1:
+            key, value = params.items()[0]
+            if type(key) is str and type(value) is str:
+                return base + '?' + quote_plus(key) + '=' + quote_plus(value)
+        # single param values only 
+        return base + '?' + urlencode(params, True)
+    
     def __call__(self, **kwargs):
-        method = self._method_to_path(kwargs.pop('method'))
-        data = kwargs.pop('data', None)
-        json = kwargs.pop('json', None)
-        if self.ssl:
-            protocol = 'https'
+        return self._call(kwargs.pop('method'), kwargs)
+    
+    def _call(self, name, kwargs):
+        self._invalidate_cache(name, kwargs)
+        data, json = self._encode(name, kwargs.pop('data', None), 
+                                  kwargs.pop('json', None))
+        if self.balancer is not None:
+            return self._balanced_call(name, kwargs, data, json)
+        return self._send(name, kwargs, None, data, json)
+    
+    def _invalidate_cache(self, name, kwargs):
+        """Drops the cached responses an end_session or delete_stubs call
+        makes stale."""
+        if self.response_cache is not None:
+            if name == 'end_session':
+                self.response_cache.invalidate(kwargs.get('session'))
+            elif name == 'delete_stubs':
+                self.response_cache.invalidate()
+    
+    def _encode(self, name, data, json):
+        """Returns the (data, json) to post. A json value is encoded with the
+        codec, one with a to_json method (a :class:`StubData <StubData>`) 
+        is sent as the JSON it returns."""
+        if json is not None:
+            to_json = getattr(json, 'to_json', None)
+            data = json_body(to_json() if to_json is not None else 
+                             codec.dumps(json))
+            json = None
+        if self.compress_threshold is not None and name in COMPRESSED_METHODS:
+            data = self._compress(data)
+        return data, json
+    
+    def _compress(self, data):
+        """Returns the data to post, gzipped if large enough."""
+        if not isinstance(data, basestring) or \
+            len(data) < self.compress_threshold:
+            return data
+        return gzip_body(data, self.compress_level, 
+                         getattr(data, 'content_type', None))
+    
+    def _post_options(self, data):
+        if not isinstance(data, EncodedBody):
+            return self.defaults
+        options = dict(self.defaults)
+        options['headers'] = dict(options.get('headers') or {}, 
+                                  **data.headers())
+        return options
+    
+    def _send(self, name, kwargs, server, data, json):
+        url = self._url(name, kwargs, server)
+        if name == 'get_response' and self.response_cache is not None:
+            return self._cached_post(kwargs.get('session'), url, data, 
+                                     server)                  
+        return self._guarded_post(server, url, data=data, json=json)      
+    
+    def _guarded_post(self, server, url, data=None, json=None):
+        breaker = self.get_breaker(server or self.dc)
+        if breaker is None:
+            return self._post(url, data=data, json=json)
+        if not breaker.allow():
+            if self.metrics is not None:
+                self.metrics.incr('api.errors.circuit_open')
+            raise CircuitOpenError(503, 'circuit open for stubo server '
+                                   '{0}'.format(breaker.name))
+        start = time.time()
+        try:
+            response = self._post(url, data=data, json=json)
+        except StuboError as e:
+            self._record_error(breaker, e)
+            raise
+        except RequestException:
+            breaker.failed()
+            raise
+        if response.status_code >= 500:
+            breaker.failed()
         else:
-            protocol = 'http'
-        if kwargs:   
-            # single param values only 
-            params = urlencode(kwargs, True)
-            url = "{protocol}://{dc}/{api_version}/{method}?{params}".format(
-              protocol=protocol, dc=self.dc, api_version=self.api_version,
-              method=method, params=params)
+            breaker.succeeded(time.time() - start)
+        return response
+    
+    def _record_error(self, breaker, error):
+        code = error.args[0] if error.args else None
+        if isinstance(code, int) and code >= 500:
+            breaker.failed()
         else:
-            url = "{protocol}://{dc}/{api_version}/{method}".format(
-              protocol=protocol, dc=self.dc, api_version=self.api_version,
-              method=method)
-                          
-        return self._post(url, data=data, json=json)      
+            # the server answered
+            breaker.succeeded()
+    
+    def _balanced_call(self, name, kwargs, data, json):
+        balancer = self.balancer
+        session = kwargs.get('session')
+        bound = balancer.server_for(session) if session else None
+        tried = []
+        while True:
+            server = bound or balancer.choose(exclude=tried)
+            balancer.acquire(server)
+            try:
+                response = self._send(name, kwargs, server, data, json)
+                if server in balancer.down:
+                    # a trial call got through
+                    balancer.mark_up(server)
+                break
+            except (RequestException, CircuitOpenError) as e:
+                if not isinstance(e, CircuitOpenError):
+                    balancer.mark_down(server)
+                tried.append(server)
+                # a session's calls must stay on its server
+                if bound or len(tried) >= len(balancer.servers):
+                    raise
+            finally:
+                balancer.release(server)
+        if session:
+            if name == 'begin_session':
+                balancer.bind(session, server)
+            elif name == 'end_session':
+                balancer.unbind(session)
+        return response
+    
+    def check_server(self, server):
+        """Returns True if a get/status call to the server succeeds and 
+        reports its cache and database servers ok."""
+        defaults = dict(self.defaults, timeout=self.health_timeout)
+        try:
+            response = json_response(self.get_http_session().post(
+                self._url('get_status', None, server), **defaults))
+            if response.status_code != 200:
+                return False
+            data = response.json().get('data') or {}
+        except Exception:
+            log.debug('health probe of %s failed', server, exc_info=True)
+            return False
+        return all(data[key].get('status', 'ok') == 'ok' for key in 
+                   ('cache_server', 'database_server') 
+                   if isinstance(data.get(key), dict))
+    
+    def _cached_post(self, session, url, data, server=None):
+        key = self.response_cache.key(session, 'POST', url, data)
+        cached = self.response_cache.get(key)
+        if cached is not None:
+            return cached.to_response(url=url)
+        response = self._guarded_post(server, url, data=data)
+        if response.status_code == 200:
+            self.response_cache.put(key, 
+                                    CachedResponse.from_response(response))
+        return response
             
     def _raise_on_error(self, response, url):
         status = response.status_code
@@ -59,8 +467,39 @@ class Stubo(object):
                 # it's one of ours, reconstruct the error 
                 raise StuboError(error.get('code'), error.get('message')) 
 
+    def _metric_name(self, url):
+        return 'api.' + '_'.join(url.partition('?')[0].rsplit('/', 2)[1:])
+
+    def _measured_post(self, url, data=None, json=None):
+        metrics = self.metrics
+        name = self._metric_name(url)
+        start = time.time()
+        try:
+            response = json_response(self.get_http_session().post(url, 
+                                        data=data, json=json, 
+                                        **self._post_options(data)))
+        except RequestException:
+            metrics.incr('api.errors.connection')
+            raise
+        finally:
+            metrics.timing(name + '.latency', time.time() - start)
+        request = getattr(response, 'request', None)
+        if request is not None:
+            metrics.incr(name + '.request_bytes', len(request.body or ''))
+        metrics.incr(name + '.response_bytes', len(response.content))
+        try:
+            self._raise_on_error(response, url)
+        except StuboError as e:
+            metrics.incr('api.errors.{0}'.format(e.args[0] if e.args else 
+                                                 'unknown'))
+            raise
+        return response
+
     def _post(self, url, data=None, json=None):
-        log.debug(u'post url: {0}'.format(url))
-        response = requests.post(url, data=data, json=json, **self.defaults)
+        log.debug(u'post url: %s', url)
+        if self.metrics is not None:
+            return self._measured_post(url, data=data, json=json)
+        response = json_response(self.get_http_session().post(url, data=data,
+                                        json=json, **self._post_options(data)))
         self._raise_on_error(response, url)  
-        return response 
\ No newline at end of file
+        return response
@@ -0,0 +1,227 @@
+"""
+async_api.py
+~~~~~~~~~~
+
+A non-blocking stubo api client for event loop based applications.
+
+AsyncStubo has the same dynamic api methods as :class:`Stubo <Stubo>` but 
+each call returns a Future resolving to the response, so many calls can be 
+in flight at once from one thread. It runs on the tornado async HTTP 
+client (``pip install stubolib[async]``), using the keep-alive curl client 
+when pycurl is installed. The response cache (``cache_size``), balancing 
+over several servers and circuit breakers work as for Stubo, but a failed 
+call is not retried on another server. The futures are yielded from 
+tornado coroutines:
+
+    stubo = AsyncStubo('localhost:8001', max_clients=100)
+    
+    @gen.coroutine
+    def status():
+        response = yield stubo.get_status(scenario='first')
+        raise gen.Return(response.json())
+"""
+import time
+import logging
+from functools import partial
+from urllib import urlencode
+from api import Stubo, StuboError, CircuitOpenError, EncodedBody
+from cache import CachedResponse
+import codec
+
+try:
+    from tornado import gen
+    from tornado.concurrent import Future
+    from tornado.httpclient import AsyncHTTPClient, HTTPRequest, HTTPError
+except ImportError:
+    gen = Future = AsyncHTTPClient = HTTPRequest = HTTPError = None
+
+try:
+    import pycurl
+except ImportError:
+    pycurl = None
+    
+log = logging.getLogger(__name__)
+
+def _coroutine(func):
+    if gen is None:
+        return func
+    return gen.coroutine(func)
+
+class AsyncStubo(Stubo):
+    """Weakly typed non-blocking client for the stubo HTTP JSON API.
+    
+    :param max_clients: maximum number of concurrent requests, further 
+                        requests are queued.
+    :param use_curl: use the curl based client (keeps connections alive),
+                     defaults to True when pycurl is installed.
+    """
+    
+    def __init__(self, dc=None, api_version=None, ssl=False, max_clients=10,
+                 use_curl=None, **kwargs):
+        if AsyncHTTPClient is None:
+            raise ImportError('AsyncStubo requires tornado, install it with '
+                              '"pip install stubolib[async]"')
+        super(AsyncStubo, self).__init__(dc, api_version=api_version, 
+                                         ssl=ssl, **kwargs)
+        self.max_clients = max_clients
+        self.use_curl = pycurl is not None if use_curl is None else use_curl
+        self._http_client = None
+        
+    def get_http_client(self):
+        """Returns the async http client used for api calls."""
+        if self._http_client is None:
+            client_class = AsyncHTTPClient
+            if self.use_curl:
+                from tornado.curl_httpclient import CurlAsyncHTTPClient
+                client_class = CurlAsyncHTTPClient
+            self._http_client = client_class(force_instance=True,
+                                             max_clients=self.max_clients)
+        return self._http_client
+    
+    def close(self):
+        if self._http_client is not None:
+            self._http_client.close()
+            self._http_client = None
+        super(AsyncStubo, self).close()    
+    
+    def _call(self, name, kwargs):
+        self._invalidate_cache(name, kwargs)
+        data, json = self._encode(name, kwargs.pop('data', None), 
+                                  kwargs.pop('json', None))
+        server = None
+        if self.balancer is not None:
+            # no failover here, a failed call is left to the caller
+            session = kwargs.get('session')
+            server = session and self.balancer.server_for(session) or \
+                self.balancer.choose()
+            if name == 'begin_session' and session:
+                self.balancer.bind(session, server)
+            elif name == 'end_session' and session:
+                self.balancer.unbind(session)
+        url = self._url(name, kwargs, server)
+        cache_key = None
+        if name == 'get_response' and self.response_cache is not None:
+            cache_key = self.response_cache.key(kwargs.get('session'), 
+                                                'POST', url, data)
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                future = Future()
+                future.set_result(cached.to_response(url=url))
+                return future
+        if server is not None:
+            self.balancer.acquire(server)
+        future = self._guarded_post(server, url, data=data, json=json)
+        if server is not None:
+            future.add_done_callback(lambda _: self.balancer.release(server))
+        if cache_key is not None:
+            future.add_done_callback(partial(self._cache_response, 
+                                             cache_key))
+        return future
+    
+    def _guarded_post(self, server, url, data=None, json=None):
+        breaker = self.get_breaker(server or self.dc)
+        if breaker is None:
+            return self._post(url, data=data, json=json)
+        if not breaker.allow():
+            if self.metrics is not None:
+                self.metrics.incr('api.errors.circuit_open')
+            future = Future()
+            future.set_exception(CircuitOpenError(503, 
+                'circuit open for stubo server {0}'.format(breaker.name)))
+            return future
+        future = self._post(url, data=data, json=json)
+        future.add_done_callback(partial(self._record_outcome, breaker, 
+                                         time.time()))
+        return future
+    
+    def _cache_response(self, key, future):
+        if future.exception() is None and future.result().status_code == 200:
+            self.response_cache.put(key, CachedResponse.from_response(
+                                                            future.result()))
+    
+    def _new_breaker(self, server):
+        # a blocking get/status probe would stall the IOLoop, let a trial 
+        # call through instead
+        breaker = super(AsyncStubo, self)._new_breaker(server)
+        breaker.probe = None
+        return breaker
+    
+    def _record_outcome(self, breaker, start, future):
+        error = future.exception()
+        if error is None:
+            if future.result().status_code >= 500:
+                breaker.failed()
+            else:
+                breaker.succeeded(time.time() - start)
+        elif isinstance(error, StuboError):
+            self._record_error(breaker, error)
+        else:
+            breaker.failed()
+    
+    def _request(self, url, data=None, json=None):
+        """Maps the requests style defaults onto a tornado request."""
+        headers = dict(self.defaults.get('headers') or {})
+        if json is not None:
+            body = codec.dumps(json)
+            headers['Content-Type'] = 'application/json'
+        elif isinstance(data, dict):
+            body = urlencode(data, True)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        else:
+            body = data or ''
+        if isinstance(data, EncodedBody):
+            headers.update(data.headers())
+        options = {}
+        auth = self.get_auth()
+        if auth:
+            options.update(auth_username=auth[0], auth_password=auth[1])
+        timeout = self.defaults.get('timeout')
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            if connect is not None:
+                options['connect_timeout'] = connect
+            if read is not None:
+                options['request_timeout'] = (connect or 0) + read
+        elif timeout:
+            options.update(connect_timeout=timeout, request_timeout=timeout)
+        if 'verify' in self.defaults:
+            options['validate_cert'] = bool(self.defaults['verify'])
+        return HTTPRequest(url, method='POST', body=body, headers=headers, 
+                           **options)    
+    
+    @_coroutine
+    def _post(self, url, data=None, json=None):
+        log.debug(u'post url: %s', url)
+        metrics = self.metrics
+        start = time.time()
+        try:
+            http_response = yield self.get_http_client().fetch(
+                                        self._request(url, data, json))
+        except HTTPError as e:
+            if e.response is None:
+                if metrics is not None:
+                    metrics.incr('api.errors.connection')
+                raise
+            http_response = e.response
+        except Exception:
+            if metrics is not None:
+                metrics.incr('api.errors.connection')
+            raise
+        if metrics is not None:
+            name = self._metric_name(url)
+            metrics.timing(name + '.latency', time.time() - start)
+            metrics.incr(name + '.request_bytes', 
+                         len(http_response.request.body or ''))
+            metrics.incr(name + '.response_bytes', 
+                         len(http_response.body or ''))
+        response = CachedResponse(http_response.code, http_response.reason,
+                                  dict(http_response.headers.get_all()),
+                                  http_response.body or '').to_response(
+                                                                    url=url)
+        try:
+            self._raise_on_error(response, url)
+        except StuboError as e:
+            if metrics is not None:
+                metrics.incr('api.errors.{0}'.format(e.args[0]))
+            raise
+        raise gen.Return(response)
@@ -0,0 +1,266 @@
+"""
+async_session.py
+~~~~~~~~~~
+
+Record and playback for applications making http calls with the tornado 
+async http client.
+
+AsyncSession works like :class:`Session <Session>` but talks to stubo with
+:class:`AsyncStubo <AsyncStubo>`, intercepts calls made through the client 
+returned by ``get_http_client()`` and puts the recorded stubs to stubo 
+concurrently at exit. It is run from tornado coroutines, ``record()``, 
+``play()`` and ``record_or_play()`` set the mode and return the session 
+and ``begin()`` starts it, discovering the mode from stubo if none is set:
+
+    yield session.record().begin()
+    try:
+        response = yield session.get_http_client().fetch(url)
+    finally:
+        yield session.stop()
+"""
+import time
+import httplib
+from io import BytesIO
+from api import StuboError
+from async_api import AsyncStubo, _coroutine, gen, HTTPRequest, HTTPError
+from session import Session, HTTPCall, session_mode
+from stubo_adapter import StuboInterceptor
+from store import RecordingStore
+from uploader import UploadError, stub_key
+
+try:
+    from tornado.httpclient import HTTPResponse
+    from tornado.httputil import HTTPHeaders
+except ImportError:
+    HTTPResponse = HTTPHeaders = None
+
+
+class StuboAsyncHTTPClient(StuboInterceptor):
+    """
+    A Stubo-aware wrapper of a tornado AsyncHTTPClient, the async 
+    counterpart of :class:`StuboAdapter <StuboAdapter>`.
+
+    :param session: The Stubo AsyncSession to use for requests.
+    :param http_client: The tornado client making the actual calls.
+    """
+    
+    def __init__(self, session, http_client, auth_token=None, 
+                 request_headers=True):
+        self.session = session
+        self.http_client = http_client
+        self.auth_token = auth_token
+        self.request_headers = request_headers
+        
+    @_coroutine    
+    def _fetch(self, request):
+        try:
+            response = yield self.http_client.fetch(request)
+        except HTTPError as e:
+            if e.response is None:
+                raise
+            response = e.response
+        raise gen.Return(response)    
+        
+    @_coroutine
+    def fetch(self, request, raise_error=True, **kwargs):
+        """Fetches a url or HTTPRequest like AsyncHTTPClient.fetch."""
+        if not isinstance(request, HTTPRequest):
+            request = HTTPRequest(request, **kwargs)
+        metrics = self.session.stubo.metrics
+        start = time.time()
+        session = self.session
+        offline, match = False, None
+        if session.mode != 'record' and session.matcher is not None:
+            match = session.match(request)
+            offline = match is not None or session.is_local()
+        if offline:
+            status, headers, body = self.offline_response(match)
+            response = HTTPResponse(request, status, 
+                                    headers=HTTPHeaders(headers),
+                                    buffer=BytesIO(body), 
+                                    reason=httplib.responses.get(status))
+        else:
+            headers = self.get_stubo_headers(request)
+            if session.mode == 'record':
+                response = yield self._fetch(request)
+                session.record_call(request, response, 
+                                    headers['Stubo-Request-Host'])
+            else:
+                request.headers.update(headers)
+                request.url = self.proxify(request.url)
+                if self.auth_token:
+                    # just basic auth at the moment
+                    request.auth_username, request.auth_password = \
+                        self.auth_token
+                response = yield self._fetch(request)
+        if metrics is not None:
+            self.measure_call(metrics, start)
+        if raise_error and response.error:
+            raise response.error
+        raise gen.Return(response)
+    
+
+class AsyncSession(Session):
+    """Creates an async Session for record or playback, see 
+    :class:`Session <Session>` for the options. Stubs are put to stubo 
+    concurrently at exit, up to ``max_clients`` at a time, so 
+    ``incremental_upload`` is not used. Offline and preloaded playback need
+    a ``store`` or stubs loaded with ``load_stubs()``.
+    """
+    
+    def make_stubo(self, dc, **kwargs):
+        kwargs.setdefault('max_clients', max(10, self.upload_concurrency))
+        return AsyncStubo(dc, **kwargs)
+        
+    def get_offline_stubs(self):
+        if not self.store:
+            raise StuboError(400, 'offline playback of an AsyncSession '
+                             'needs a store or load_stubs()')
+        return super(AsyncSession, self).get_offline_stubs()
+    
+    def get_http_client(self):
+        """Returns the intercepting http client to make calls with."""
+        return StuboAsyncHTTPClient(self, self.stubo.get_http_client(),
+                                    auth_token=self.stubo.get_auth(),
+                                    request_headers=self.request_headers)
+    
+    def record_or_play(self, mode=None):
+        self.mode = mode
+        return self
+       
+    def record(self):
+        self.mode = 'record'
+        return self
+    
+    def play(self, preload=None):
+        self.mode = 'playback'
+        self._play_preload = preload
+        return self
+    
+    @_coroutine
+    def begin(self):
+        """Starts the session, in the mode discovered from stubo if none is
+        set."""
+        if not self.mode:
+            self.mode = yield self.discover_mode()
+        yield self.start()
+    
+    @_coroutine
+    def get_session_mode(self):
+        response = yield self.stubo.get_status(session=self.session_name)
+        payload = response.json().get('data')
+        status = payload.get('session', {}).get('status', None)
+        raise gen.Return(status if status else 'notfound')
+    
+    @_coroutine
+    def discover_mode(self):
+        status = yield self.get_session_mode()
+        raise gen.Return(session_mode(self.session_name, status))
+        
+    @_coroutine
+    def start(self):
+        assert(self.mode)
+        if not self._start_local():
+            if self.mode == 'record' and self.delete_stubs:
+                yield self.stubo.delete_stubs(scenario=self.scenario, 
+                                              force=self.delete_stubs_force)
+            yield self.stubo.begin_session(scenario=self.scenario,
+                                           session=self.session_name,
+                                           mode=self.mode)
+        self.started_ok = True
+        
+    @_coroutine
+    def stop(self):
+        """Called to stop recording an interaction"""
+        if not self.started_ok:
+            self.close_store()
+            self.close_stubo()
+            return
+        try:
+            if not self.is_local():
+                try:
+                    if self.mode == 'record':
+                        yield self.flush()
+                finally:
+                    yield self.stubo.end_session(scenario=self.scenario,
+                                                 session=self.session_name,
+                                                 mode=self.mode)
+        finally:
+            self.close_store()
+            self.close_stubo()
+            
+    def record_call(self, request, response, host):
+        new_call = HTTPCall(host=host)
+        new_call.request_method = request.method
+        new_call.request_url = request.url
+        new_call.request_body = request.body
+        new_call.request_headers = request.headers
+        new_call.response_status = response.code
+        new_call.response_reason = response.reason
+        new_call.response_headers = response.headers
+        new_call.response_body = response.body
+        self.add_call(new_call)
+            
+    @_coroutine
+    def _put(self, call_number, stub, query_args):
+        try:
+            yield self.stubo.put_stub(session=self.session_name, 
+                                      json=stub, **query_args)
+        except Exception as e:
+            raise gen.Return((call_number, e))
+        
+    @_coroutine
+    def _put_in_turn(self, items):
+        failures = []
+        for item in items:
+            failure = yield self._put(*item)
+            if failure:
+                failures.append(failure)
+        raise gen.Return(failures)
+        
+    @_coroutine
+    def _put_all(self, items):
+        # stubs with the same matchers are put in turn, in call order
+        groups = {}
+        for item in sorted(items, key=lambda item: item[0]):
+            groups.setdefault(stub_key(item), []).append(item)
+        results = yield [self._put_in_turn(group) for group in 
+                         groups.itervalues()]
+        failures = sorted(f for group in results for f in group)
+        if failures:
+            raise UploadError(failures)    
+        
+    def flush(self):
+        """Puts a stub for each recorded call concurrently.
+        
+        :raises UploadError: listing the call numbers that failed.
+        """
+        return self._put_all([(call.call_number, self.make_stub(call),
+                               call.request_query_args) for call in 
+                              self._calls])
+        
+    @_coroutine
+    def upload_store(self, store=None):
+        """Records the stubs saved in a local store into the stubo session.
+        
+        :param store: a path or :class:`RecordingStore <RecordingStore>`, 
+                      defaults to the session's store.
+        """
+        store = store or self.store
+        if not isinstance(store, RecordingStore):
+            with RecordingStore(store) as opened:
+                yield self.upload_store(opened)
+            return
+        if self.delete_stubs:
+            yield self.stubo.delete_stubs(scenario=self.scenario, 
+                                          force=self.delete_stubs_force)
+        yield self.stubo.begin_session(scenario=self.scenario,
+                                       session=self.session_name, 
+                                       mode='record')
+        try:
+            yield self._put_all([(r.call_number, r.stub, r.query_args) for
+                                 r in store])
+        finally:
+            yield self.stubo.end_session(scenario=self.scenario,
+                                         session=self.session_name, 
+                                         mode='record')
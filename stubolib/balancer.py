@@ -0,0 +1,158 @@
+"""
+balancer.py
+~~~~~~~~~~
+
+Client side load balancing over several stubo servers.
+
+Calls are spread over the healthy servers round robin or to the server 
+with the fewest calls in flight. Servers are ejected when a call to them 
+fails to connect or a health probe fails, and return when a later probe 
+or call succeeds. An ejected server is given one trial call every 
+``retry_after`` seconds so it comes back without health probes. Calls for 
+a stubo session go to the server the session was begun on.
+"""
+import time
+import logging
+import threading
+import itertools
+
+log = logging.getLogger(__name__)
+
+class Balancer(object):
+    """Chooses the server for each call.
+    
+    :param servers: list of 'host:port' stubo servers.
+    :param policy: 'round_robin' or 'least_outstanding'.
+    :param probe: callable(server) returning True if the server is healthy.
+    :param health_interval: seconds between health probes of all servers, 
+                            None to probe only on ``check_health()``.
+    :param retry_after: seconds before a down server is chosen for a trial
+                        call, None to wait for a health probe.
+    """
+    
+    ROUND_ROBIN = 'round_robin'
+    LEAST_OUTSTANDING = 'least_outstanding'
+    
+    def __init__(self, servers, policy=ROUND_ROBIN, probe=None, 
+                 health_interval=None, retry_after=30, clock=time.time):
+        if not servers:
+            raise ValueError('at least one server is required')
+        if policy not in (self.ROUND_ROBIN, self.LEAST_OUTSTANDING):
+            raise ValueError('unknown balancing policy: {0}'.format(policy))
+        self.servers = list(servers)
+        self.policy = policy
+        self.probe = probe
+        self.health_interval = health_interval
+        self.retry_after = retry_after
+        self.clock = clock
+        self.down = set()
+        # down server => time it was last marked down or given a trial call
+        self._down_since = {}
+        self.outstanding = dict((server, 0) for server in self.servers)
+        self._sessions = {}
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._checker = None
+        
+    def healthy(self):
+        with self._lock:
+            return [s for s in self.servers if s not in self.down]
+        
+    def choose(self, exclude=()):
+        """Returns the server for a call not bound to a session. When no
+        server is healthy all are tried."""
+        self._start_checker()
+        with self._lock:
+            retry = self._retry_candidate(exclude)
+            if retry is not None:
+                return retry
+            candidates = [s for s in self.servers if s not in self.down and 
+                          s not in exclude] or \
+                         [s for s in self.servers if s not in exclude] or \
+                         self.servers
+            if self.policy == self.LEAST_OUTSTANDING:
+                return min(candidates, key=lambda s: self.outstanding[s])
+            return candidates[next(self._next) % len(candidates)]
+        
+    def _retry_candidate(self, exclude):
+        if self.retry_after is None or not self.down:
+            return None
+        now = self.clock()
+        for server in self.servers:
+            if server in self.down and server not in exclude and \
+                now - self._down_since[server] >= self.retry_after:
+                # one trial call, the next waits another retry_after
+                self._down_since[server] = now
+                return server
+        return None
+        
+    def acquire(self, server):
+        with self._lock:
+            self.outstanding[server] += 1
+            
+    def release(self, server):
+        with self._lock:
+            self.outstanding[server] -= 1
+            
+    def mark_down(self, server):
+        with self._lock:
+            if server not in self.down:
+                log.warn('stubo server {0} is down'.format(server))
+                self.down.add(server)
+            self._down_since[server] = self.clock()
+            
+    def mark_up(self, server):
+        with self._lock:
+            if server in self.down:
+                log.info('stubo server {0} is up'.format(server))
+                self.down.discard(server)
+                self._down_since.pop(server, None)
+            
+    def bind(self, session, server):
+        with self._lock:
+            self._sessions[session] = server
+            
+    def unbind(self, session):
+        with self._lock:
+            self._sessions.pop(session, None)
+            
+    def server_for(self, session):
+        """Returns the server a session is bound to or None."""
+        with self._lock:
+            return self._sessions.get(session)
+        
+    def check_health(self):
+        """Probes every server, marking it up or down."""
+        for server in self.servers:
+            if self.probe(server):
+                self.mark_up(server)
+            else:
+                self.mark_down(server)
+                
+    def _start_checker(self):
+        if self.health_interval is None or self.probe is None or \
+            self._checker is not None:
+            return
+        with self._lock:
+            if self._checker is not None:
+                return
+            self._checker = threading.Thread(target=self._check_forever,
+                                             name='stubo-health-check')
+            self._checker.daemon = True
+            self._checker.start()
+                
+    def _check_forever(self):
+        while not self._stopped.wait(self.health_interval):
+            try:
+                self.check_health()
+            except Exception:
+                log.exception('stubo health check failed')
+                
+    def stop(self):
+        """Stops the periodic health checks."""
+        self._stopped.set()
+        checker, self._checker = self._checker, None
+        if checker is not None:
+            checker.join()
+        self._stopped.clear()    
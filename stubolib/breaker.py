@@ -0,0 +1,93 @@
+"""
+breaker.py
+~~~~~~~~~~
+
+A circuit breaker per stubo server.
+
+The circuit opens after a number of consecutive failed (or slow) calls, 
+while it is open calls fail fast without going to the server. Once the 
+reset timeout has passed the circuit is half open: the server is probed 
+(or, without a probe, one trial call is let through) and the circuit closes 
+again if that succeeds.
+"""
+import time
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+class CircuitBreaker(object):
+    """
+    :param name: the server the breaker guards, used in log messages.
+    :param failure_threshold: consecutive failures that open the circuit.
+    :param reset_timeout: seconds the circuit stays open before it is 
+                          half open.
+    :param slow_call: calls taking longer than this many seconds count as 
+                      failures, None to ignore latency.
+    :param probe: callable returning True if the server is healthy again.
+    """
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    
+    def __init__(self, name, failure_threshold=5, reset_timeout=30, 
+                 slow_call=None, probe=None, clock=time.time):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.slow_call = slow_call
+        self.probe = probe
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+        
+    def allow(self):
+        """Returns True if a call may go to the server."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN or \
+                self.clock() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            if self.probe is None:
+                # this call is the trial
+                return True
+        healthy = self.probe()
+        with self._lock:
+            if healthy:
+                self._close()
+            else:
+                self._open()
+        return healthy
+        
+    def succeeded(self, latency=None):
+        if self.slow_call is not None and latency is not None and \
+            latency > self.slow_call:
+            self.failed()
+            return
+        with self._lock:
+            if self.state != self.CLOSED:
+                self._close()
+            self.failures = 0
+            
+    def failed(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and 
+                self.failures >= self.failure_threshold):
+                self._open()
+                
+    def _open(self):
+        log.warn('circuit open for stubo server {0}'.format(self.name))
+        self.state = self.OPEN
+        self.opened_at = self.clock()
+        
+    def _close(self):
+        log.info('circuit closed for stubo server {0}'.format(self.name))
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
@@ -0,0 +1,112 @@
+"""
+cache.py
+~~~~~~~~~~
+
+A client side cache of stubo playback responses.
+
+Entries are keyed by the stubo session name and a fingerprint of the 
+request method, url and body. The cache is bounded (least recently used 
+entries are evicted first), entries can expire after a time to live and all
+entries of a session are dropped when the session is ended or stubs are
+deleted through the caching client. Stubs that play back a sequence of 
+responses for the same request should not be used with the cache.
+"""
+import time
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from codec import JSONResponse
+
+def _to_bytes(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+class CachedResponse(namedtuple('CachedResponse', 
+                                'status_code reason headers content')):
+    """The parts of a response kept in the cache."""
+    
+    @classmethod
+    def from_response(cls, response):
+        return cls(response.status_code, response.reason, 
+                   dict(response.headers), response.content)
+        
+    def to_response(self, request=None, url=None):
+        """Returns a new :class:`JSONResponse <JSONResponse>`."""
+        resp = JSONResponse()
+        resp.status_code = self.status_code
+        resp.reason = self.reason
+        resp.headers = CaseInsensitiveDict(self.headers)
+        resp.encoding = get_encoding_from_headers(resp.headers)
+        resp._content = self.content
+        resp.request = request
+        resp.url = url or (request.url if request else None)
+        return resp
+        
+
+class ResponseCache(object):
+    """LRU cache of playback responses.
+    
+    :param maxsize: maximum number of responses kept.
+    :param ttl: seconds an entry stays valid, None for no expiry.
+    """
+    
+    def __init__(self, maxsize=1000, ttl=None, clock=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = self.misses = self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        
+    def __len__(self):
+        return len(self._entries)    
+        
+    @staticmethod
+    def key(session, method, url, body):
+        fingerprint = hashlib.sha1(_to_bytes(method))
+        fingerprint.update('\0')
+        fingerprint.update(_to_bytes(url))
+        fingerprint.update('\0')
+        fingerprint.update(_to_bytes(body))
+        return session, fingerprint.digest()
+    
+    def get(self, key):
+        """Returns the cached value or None."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                expires, value = entry
+                if expires is None or expires > self.clock():
+                    self._entries[key] = entry
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return None
+        
+    def put(self, key, value):
+        expires = self.clock() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (expires, value)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+                
+    def invalidate(self, session=None):
+        """Drops the entries of a session, or all entries."""
+        with self._lock:
+            if session is None:
+                self._entries.clear()
+                return
+            for key in [k for k in self._entries if k[0] == session]:
+                del self._entries[key]
+                
+    def stats(self):
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses, 
+                        evictions=self.evictions, size=len(self._entries))
@@ -0,0 +1,52 @@
+"""
+codec.py
+~~~~~~~~~~
+
+The JSON codec used for stubo payloads and responses.
+
+The fastest installed library is used: ujson, then simplejson, then the 
+standard library json module. Responses from stubo are 
+:class:`JSONResponse <JSONResponse>` objects whose ``json()`` decodes the 
+body with the codec once and returns the same value on later calls.
+"""
+from requests.models import Response
+
+try:
+    import ujson as _impl
+except ImportError:
+    try:
+        import simplejson as _impl
+    except ImportError:
+        import json as _impl
+        
+name = _impl.__name__
+
+if name == 'ujson':
+    def dumps(value):
+        """Returns value encoded as compact JSON bytes."""
+        return _impl.dumps(value, escape_forward_slashes=False)
+else:
+    def dumps(value):
+        """Returns value encoded as compact JSON bytes."""
+        return _impl.dumps(value, separators=(',', ':'))
+    
+loads = _impl.loads
+
+class JSONResponse(Response):
+    """A requests :class:`Response <Response>` decoding its JSON body once."""
+    
+    _decoded = None
+    
+    def json(self, **kwargs):
+        if kwargs:
+            return super(JSONResponse, self).json(**kwargs)
+        if self._decoded is None:
+            self._decoded = (loads(self.content),)
+        return self._decoded[0]
+    
+def json_response(response):
+    """Makes a requests response a :class:`JSONResponse <JSONResponse>`, 
+    other objects are returned unchanged."""
+    if type(response) is Response:
+        response.__class__ = JSONResponse
+    return response
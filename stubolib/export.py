@@ -0,0 +1,71 @@
+"""
+export.py
+~~~~~~~~~~
+
+Reads the stubs of a scenario exported by stubo get/export, or downloads 
+the exported files.
+"""
+import os
+import logging
+import codec
+from stub import StubData
+
+log = logging.getLogger(__name__)
+
+def _is_stub(payload):
+    return isinstance(payload, dict) and 'request' in payload and \
+        'response' in payload
+
+def iter_export_stubs(stubo, scenario):
+    """Yields the :class:`StubData <StubData>` of a scenario, fetching the 
+    json stub files linked from the get/export response one at a time.
+    """
+    data = stubo.get_export(scenario=scenario).json().get('data', {})
+    for payload in data.get('stubs', []):
+        if _is_stub(payload):
+            yield StubData.from_payload(payload)
+    http_session = stubo.get_http_session()
+    for name, url in data.get('links', []):
+        if not name.endswith('.json'):
+            continue
+        log.debug(u'get export file: {0}'.format(url))
+        response = http_session.get(url, **stubo.defaults)
+        response.raise_for_status()
+        # decoded with the codec, export files can be large
+        payload = codec.loads(response.content)
+        if _is_stub(payload):
+            yield StubData.from_payload(payload)
+
+def export_stubs(stubo, scenario):
+    """Returns the :class:`StubData <StubData>` list of a scenario. 
+    
+    The stubs are read from the json stub files linked from the get/export 
+    response.
+    """
+    return list(iter_export_stubs(stubo, scenario))
+
+def download_export(stubo, scenario, directory, chunk_size=64 * 1024):
+    """Downloads the files of a scenario export into directory, returns 
+    their paths. 
+    
+    Files are streamed to disk in chunks of ``chunk_size`` bytes rather than
+    read into memory.
+    """
+    data = stubo.get_export(scenario=scenario).json().get('data', {})
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    http_session = stubo.get_http_session()
+    paths = []
+    for name, url in data.get('links', []):
+        path = os.path.join(directory, os.path.basename(name))
+        log.debug(u'download export file: {0} to {1}'.format(url, path))
+        response = http_session.get(url, stream=True, **stubo.defaults)
+        try:
+            response.raise_for_status()
+            with open(path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size):
+                    f.write(chunk)
+        finally:
+            response.close()
+        paths.append(path)
+    return paths
@@ -0,0 +1,269 @@
+"""
+loadgen.py
+~~~~~~~~~~
+
+Replays recorded requests through stubo get/response to measure how many
+playback calls per second a stubo deployment sustains.
+
+The request bodies are built from the contains matchers of the stubs of a
+local :class:`RecordingStore <RecordingStore>` or of the scenario export,
+and sent from worker threads (optionally in several processes) at full
+speed or at a target rate. The run reports throughput, latency percentiles
+and errors by stubo error code:
+
+    $ stubo-loadgen --dc stubo:8001 --scenario first -c 16 --duration 30
+    $ stubo-loadgen --dc stubo:8001 --scenario first --store first.stubo \\
+          --rps 500 --processes 4 --json
+"""
+import os
+import sys
+import json
+import time
+import logging
+import itertools
+import multiprocessing
+from argparse import ArgumentParser
+from requests.exceptions import RequestException
+from api import Stubo, StuboError
+from store import RecordingStore
+from export import export_stubs
+from workers import map_concurrently
+
+log = logging.getLogger(__name__)
+
+def request_bodies(stubs):
+    """Returns a request body matching each stub, its contains matchers
+    joined."""
+    return [''.join(m for m in stub.contains_matchers() if m) for stub in
+            stubs]
+
+def percentile(values, pct):
+    """Returns the pct percentile of sorted values (nearest rank)."""
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+class LoadResult(object):
+    """The latencies and errors of a load run."""
+
+    def __init__(self, latencies=None, errors=None, elapsed=0.0):
+        self.latencies = latencies or []
+        self.errors = errors or {}
+        self.elapsed = elapsed
+
+    def merge(self, other):
+        """Adds the calls of a run made at the same time."""
+        self.latencies.extend(other.latencies)
+        for code, count in other.errors.iteritems():
+            self.errors[code] = self.errors.get(code, 0) + count
+        self.elapsed = max(self.elapsed, other.elapsed)
+
+    def report(self):
+        """Returns the run statistics as a dict, latencies in ms."""
+        latencies = sorted(self.latencies)
+        calls = len(latencies)
+        errors = sum(self.errors.itervalues())
+        report = dict(calls=calls, errors=errors,
+                      errors_by_code=dict((str(k), v) for k, v in
+                                          self.errors.iteritems()),
+                      error_rate=float(errors) / calls if calls else 0.0,
+                      elapsed=self.elapsed,
+                      calls_per_sec=calls / self.elapsed if self.elapsed
+                                    else 0.0)
+        if latencies:
+            report.update(mean_ms=sum(latencies) / calls * 1000,
+                          max_ms=latencies[-1] * 1000)
+            for pct in (50, 90, 95, 99):
+                report['p{0}_ms'.format(pct)] = percentile(latencies,
+                                                           pct) * 1000
+        return report
+
+
+class LoadGenerator(object):
+    """Sends request bodies to get/response of a stubo session.
+
+    :param stubo: the :class:`Stubo <Stubo>` api client to use.
+    :param session_name: a stubo session in playback mode.
+    :param bodies: the request bodies, replayed in turn.
+    :param concurrency: number of worker threads.
+    :param rps: target calls per second over all threads, None for as fast
+                as the threads go.
+    :param duration: seconds to run for.
+    :param requests: number of calls to make, the run ends at whichever of
+                     ``duration`` and ``requests`` comes first.
+    """
+
+    def __init__(self, stubo, session_name, bodies, concurrency=1, rps=None,
+                 duration=None, requests=None):
+        if not bodies:
+            raise ValueError('no requests to replay')
+        if duration is None and requests is None:
+            raise ValueError('a duration or number of requests is required')
+        self.stubo = stubo
+        self.session_name = session_name
+        self.bodies = bodies
+        self.concurrency = max(1, concurrency)
+        self.rps = rps
+        self.duration = duration
+        self.requests = requests
+
+    def run(self):
+        """Runs the load, returns a :class:`LoadResult <LoadResult>`."""
+        start = time.time()
+        deadline = start + self.duration if self.duration is not None \
+            else None
+
+        def calls():
+            numbers = itertools.count() if self.requests is None else \
+                xrange(self.requests)
+            for i in numbers:
+                if deadline is not None and time.time() >= deadline:
+                    return
+                yield i
+
+        def call(i):
+            if self.rps:
+                delay = start + float(i) / self.rps - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            if deadline is not None and time.time() >= deadline:
+                return None
+            return self._call(self.bodies[i % len(self.bodies)])
+
+        result = LoadResult()
+        for outcome in map_concurrently(call, calls(), self.concurrency):
+            if outcome is None:
+                continue
+            latency, code = outcome
+            result.latencies.append(latency)
+            if code is not None:
+                result.errors[code] = result.errors.get(code, 0) + 1
+        result.elapsed = time.time() - start
+        return result
+
+    def _call(self, body):
+        """Makes one call, returns its latency and error code or None."""
+        code = None
+        call_start = time.time()
+        try:
+            self.stubo.get_response(session=self.session_name, data=body)
+        except StuboError as e:
+            code = e.args[0] if e.args else 'unknown'
+        except RequestException:
+            code = 'connection'
+        return time.time() - call_start, code
+
+
+def _run_process(args):
+    dc, session_name, bodies, concurrency, rps, duration, requests = args
+    stubo = Stubo(dc, pool_maxsize=concurrency)
+    try:
+        result = LoadGenerator(stubo, session_name, bodies, concurrency, rps,
+                               duration, requests).run()
+    finally:
+        stubo.close()
+    return result.latencies, result.errors, result.elapsed
+
+def run_processes(dc, session_name, bodies, processes, concurrency=1,
+                  rps=None, duration=None, requests=None):
+    """Runs a :class:`LoadGenerator <LoadGenerator>` with ``concurrency``
+    threads in each of ``processes`` processes, the rate and number of
+    requests are shared out between them. Returns the merged
+    :class:`LoadResult <LoadResult>`."""
+    shares = []
+    for n in range(processes):
+        share = None
+        if requests is not None:
+            share = requests // processes + (1 if n < requests % processes
+                                             else 0)
+        shares.append((dc, session_name, bodies, concurrency,
+                       rps / float(processes) if rps else None, duration,
+                       share))
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(_run_process, shares)
+    finally:
+        pool.close()
+        pool.join()
+    merged = LoadResult()
+    for latencies, errors, elapsed in results:
+        merged.merge(LoadResult(latencies, errors, elapsed))
+    return merged
+
+def format_report(report):
+    lines = ['calls:       {calls}'.format(**report),
+             'elapsed:     {elapsed:.2f}s'.format(**report),
+             'throughput:  {calls_per_sec:.1f} calls/s'.format(**report),
+             'errors:      {errors} ({rate:.2f}%)'.format(
+                rate=report['error_rate'] * 100, **report)]
+    for code, count in sorted(report['errors_by_code'].items()):
+        lines.append('  {0}: {1}'.format(code, count))
+    if report['calls']:
+        lines.append('latency ms:  mean {mean_ms:.2f}  p50 {p50_ms:.2f}  '
+                     'p90 {p90_ms:.2f}  p95 {p95_ms:.2f}  p99 {p99_ms:.2f}  '
+                     'max {max_ms:.2f}'.format(**report))
+    return '\n'.join(lines)
+
+def main(argv=None):
+    parser = ArgumentParser(description="Replays recorded requests through "
+                            "stubo get/response and reports throughput and "
+                            "latency")
+    parser.add_argument('--dc', default='localhost:8001',
+                        help="stubo server, default localhost:8001")
+    parser.add_argument('--scenario', required=True,
+                        help="scenario to play back")
+    parser.add_argument('--store',
+                        help="recording store to take the requests from, "
+                        "default the scenario export")
+    parser.add_argument('--session',
+                        help="playback session name, default "
+                        "<scenario>_loadgen_<pid>")
+    parser.add_argument('-c', '--concurrency', type=int, default=1,
+                        help="worker threads per process")
+    parser.add_argument('-p', '--processes', type=int, default=1,
+                        help="worker processes")
+    parser.add_argument('--rps', type=float,
+                        help="target calls per second, default unthrottled")
+    parser.add_argument('-d', '--duration', type=float,
+                        help="seconds to run, default 10 unless -n is given")
+    parser.add_argument('-n', '--requests', type=int,
+                        help="number of calls to make")
+    parser.add_argument('--json', action='store_true',
+                        help="print the report as JSON")
+    args = parser.parse_args(argv)
+    if args.duration is None and args.requests is None:
+        args.duration = 10
+    session_name = args.session or '{0}_loadgen_{1}'.format(args.scenario,
+                                                           os.getpid())
+    stubo = Stubo(args.dc, pool_maxsize=args.concurrency)
+    if args.store:
+        with RecordingStore(args.store) as store:
+            bodies = request_bodies(r.stub for r in store)
+    else:
+        bodies = request_bodies(export_stubs(stubo, args.scenario))
+    stubo.begin_session(scenario=args.scenario, session=session_name,
+                        mode='playback')
+    try:
+        if args.processes > 1:
+            result = run_processes(args.dc, session_name, bodies,
+                                   args.processes, args.concurrency,
+                                   args.rps, args.duration, args.requests)
+        else:
+            result = LoadGenerator(stubo, session_name, bodies,
+                                   args.concurrency, args.rps, args.duration,
+                                   args.requests).run()
+    finally:
+        stubo.end_session(scenario=args.scenario, session=session_name,
+                          mode='playback')
+        stubo.close()
+    report = result.report()
+    if args.json:
+        print json.dumps(report, indent=2, sort_keys=True)
+    else:
+        print format_report(report)
+    return 1 if report['errors'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""
+manager.py
+~~~~~~~~~~
+
+Runs many stubo sessions side by side.
+
+A :class:`SessionManager <SessionManager>` creates sessions sharing one 
+:class:`Stubo <Stubo>` client and connection pool, begins and ends them 
+from a pool of worker threads and discovers the mode of every session of a
+scenario with a single get/status call.
+
+    manager = SessionManager('localhost:8001', concurrency=20)
+    sessions = [manager.session('first', 'first_{0}'.format(i)) for i in 
+                range(100)]
+    with manager:
+        manager.start()
+        ...
+"""
+import logging
+from api import Stubo, StuboError, DEFAULT_POOLSIZE
+from session import Session, session_mode
+from workers import run_concurrently
+
+log = logging.getLogger(__name__)
+
+class SessionError(StuboError):
+    """Raised once all sessions have been started or stopped if any failed.
+    
+    ``failures`` is a list of (session_name, exception) tuples.
+    """
+    def __init__(self, action, failures):
+        self.failures = failures
+        message = "{0} session(s) failed to {1}: {2}".format(len(failures),
+            action, ', '.join('{0}: {1}'.format(n, e) for n, e in failures))
+        super(SessionError, self).__init__(400, message)
+        
+
+class SessionManager(object):
+    """Creates and runs :class:`Session <Session>` s over one shared stubo 
+    client.
+    
+    :param dc: the stubo server (or list of servers).
+    :param concurrency: number of sessions begun or ended at once.
+    
+    Other keyword arguments are passed to :class:`Stubo <Stubo>`.
+    """
+    
+    def __init__(self, dc, concurrency=10, **kwargs):
+        kwargs.setdefault('pool_maxsize', max(concurrency, DEFAULT_POOLSIZE))
+        self.dc = dc
+        self.concurrency = max(1, concurrency)
+        self.stubo = Stubo(dc, **kwargs)
+        self.sessions = []
+        
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.stop()
+        finally:
+            self.close()
+        
+    def session(self, scenario, session_name, **kwargs):
+        """Returns a new managed session, see :class:`Session <Session>` for
+        the options."""
+        session = Session(self.dc, scenario, session_name, stubo=self.stubo,
+                          **kwargs)
+        self.sessions.append(session)
+        return session
+    
+    def discover_modes(self, scenario):
+        """Returns the stubo status of each session of a scenario by name."""
+        data = self.stubo.get_status(scenario=scenario).json().get('data', {})
+        return dict((name, status) for name, status in 
+                    data.get('sessions') or [])
+    
+    def resolve_modes(self, sessions=None):
+        """Sets the mode of the sessions without one, with one get/status 
+        call per scenario."""
+        statuses = {}
+        for session in sessions or self.sessions:
+            if session.mode:
+                continue
+            if session.scenario not in statuses:
+                statuses[session.scenario] = self.discover_modes(
+                                                            session.scenario)
+            session.mode = session_mode(session.session_name, 
+                statuses[session.scenario].get(session.session_name, 
+                                               'notfound'))
+            
+    def start(self, sessions=None):
+        """Begins the sessions concurrently.
+        
+        :raises SessionError: after all sessions are tried if any failed.
+        """
+        sessions = list(sessions or self.sessions)
+        self.resolve_modes(sessions)
+        failures = run_concurrently(lambda s: s.start(), sessions, 
+                                    self.concurrency)
+        if failures:
+            raise SessionError('start', [(s.session_name, e) for s, e in 
+                                         failures])
+        
+    def stop(self, sessions=None):
+        """Ends the sessions concurrently, uploading recorded stubs.
+        
+        :raises SessionError: after all sessions are tried if any failed.
+        """
+        sessions = list(sessions or self.sessions)
+        failures = run_concurrently(lambda s: s.stop(), sessions, 
+                                    self.concurrency)
+        for session in sessions:
+            session.started_ok = False
+        if failures:
+            raise SessionError('stop', [(s.session_name, e) for s, e in 
+                                        failures])
+            
+    def close(self):
+        """Releases the shared connection pool."""
+        self.stubo.close()
@@ -0,0 +1,159 @@
+"""
+matcher.py
+~~~~~~~~~~
+
+In-process stub matching for offline playback.
+
+A stub matches a request when every one of its ``contains`` matchers is 
+found in the request body. All matchers of all stubs are indexed in one 
+Aho-Corasick automaton so a request body is scanned once however many 
+stubs are loaded. When several stubs match, the one with the most matchers 
+wins, ties go to the stub loaded first.
+"""
+import threading
+from collections import deque
+
+def _to_bytes(text):
+    if text is None:
+        return ''
+    if isinstance(text, unicode):
+        return text.encode('utf-8')
+    return str(text)
+
+class AhoCorasick(object):
+    """Multi-pattern substring search.
+    
+    Patterns are added with ``add`` which returns the pattern id, ``build``
+    must be called before ``search``.
+    """
+    
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        # patterns ending at each state, and those plus the ones ending at 
+        # its failure states once built
+        self._ends = [[]]
+        self._out = [[]]
+        self._patterns = {}
+        self._built = False
+        
+    def __len__(self):
+        return len(self._patterns)
+        
+    def add(self, pattern):
+        """Adds a pattern (if new), returns its id."""
+        pattern = _to_bytes(pattern)
+        pattern_id = self._patterns.get(pattern)
+        if pattern_id is not None:
+            return pattern_id
+        pattern_id = self._patterns[pattern] = len(self._patterns)
+        state = 0
+        for ch in pattern:
+            next_state = self._goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][ch] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._ends.append([])
+            state = next_state
+        self._ends[state].append(pattern_id)
+        self._built = False
+        return pattern_id
+    
+    def build(self):
+        """Computes the failure links."""
+        goto, fail = self._goto, self._fail
+        out = self._out = [list(ends) for ends in self._ends]
+        queue = deque()
+        for state in goto[0].itervalues():
+            fail[state] = 0
+            queue.append(state)
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in goto[state].iteritems():
+                queue.append(next_state)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[next_state] = goto[f].get(ch, 0)
+                out[next_state].extend(out[fail[next_state]])
+        self._built = True
+        
+    def search(self, text):
+        """Returns the set of pattern ids found in text."""
+        if not self._built:
+            self.build()
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        state = 0
+        for ch in _to_bytes(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+    
+
+class StubMatcher(object):
+    """Finds the stub to play back for a request body.
+    
+    Stubs with several responses return them in turn, repeating the last.
+    """
+    
+    def __init__(self, stubs=None):
+        self._index = AhoCorasick()
+        self._stubs = []
+        # pattern id => stub positions needing it
+        self._stubs_by_pattern = {}
+        # stub position => number of distinct patterns needed
+        self._required = []
+        self._always = []
+        self._hits = []
+        self._positions = {}
+        self._lock = threading.Lock()
+        for stub in stubs or []:
+            self.add(stub)
+            
+    def __len__(self):
+        return len(self._stubs)        
+            
+    def add(self, stub):
+        position = len(self._stubs)
+        patterns = set(self._index.add(m) for m in stub.contains_matchers() 
+                       if m)
+        for pattern_id in patterns:
+            self._stubs_by_pattern.setdefault(pattern_id, []).append(position)
+        self._stubs.append(stub)
+        self._positions[id(stub)] = position
+        self._required.append(len(patterns))
+        self._hits.append(0)
+        if not patterns:
+            self._always.append(position)
+            
+    def find(self, body, method=None):
+        """Returns the best matching stub or None."""
+        counts = {}
+        for pattern_id in self._index.search(body):
+            for position in self._stubs_by_pattern[pattern_id]:
+                counts[position] = counts.get(position, 0) + 1
+        candidates = [p for p, n in counts.iteritems() if 
+                      n == self._required[p]] + self._always
+        if method:
+            method = method.upper()
+            candidates = [p for p in candidates if 
+                (self._stubs[p].request_method() or method).upper() == method]
+        if not candidates:
+            return None
+        return self._stubs[min(candidates, 
+                               key=lambda p: (-self._required[p], p))]
+    
+    def next_response(self, stub):
+        """Returns the response body to play for a matched stub."""
+        bodies = stub.response_body() or ['']
+        position = self._positions[id(stub)]
+        with self._lock:
+            hit = self._hits[position]
+            self._hits[position] += 1
+        return bodies[min(hit, len(bodies) - 1)]      
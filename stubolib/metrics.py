@@ -0,0 +1,136 @@
+"""
+metrics.py
+~~~~~~~~~~
+
+Instrumentation of stubo calls.
+
+A :class:`Metrics <Metrics>` instance given to ``Stubo(metrics=...)`` (and
+so to a Session) receives per api method latencies, request and response 
+byte counts, error counts by stubo error code and record/playback call 
+counts per session, and passes them on to its sinks. Without metrics the 
+instrumented code paths are skipped.
+
+Metric names:
+
+- api.<method>.latency: api call time (timing)
+- api.<method>.request_bytes, api.<method>.response_bytes (counters)
+- api.errors.<code>: stubo errors by code, 'connection' for transport 
+  errors (counter)
+- session.<session>.<mode>.calls: intercepted calls (counter)
+- session.<session>.<mode>.latency: intercepted call time (timing)
+"""
+import bisect
+import socket
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+class Metrics(object):
+    """Sends measurements to one or more sinks."""
+    
+    def __init__(self, *sinks):
+        self.sinks = list(sinks)
+        
+    def timing(self, name, seconds):
+        for sink in self.sinks:
+            sink.timing(name, seconds)
+            
+    def incr(self, name, value=1):
+        for sink in self.sinks:
+            sink.incr(name, value)
+            
+
+class Histogram(object):
+    """Counts timings in fixed millisecond buckets."""
+    
+    BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 
+                 10000)
+    
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = self.max = None
+        self.buckets = [0] * (len(self.BOUNDS_MS) + 1)
+        
+    def add(self, ms):
+        self.count += 1
+        self.total += ms
+        self.min = ms if self.min is None else min(self.min, ms)
+        self.max = ms if self.max is None else max(self.max, ms)
+        self.buckets[bisect.bisect_left(self.BOUNDS_MS, ms)] += 1
+        
+    def snapshot(self):
+        labels = ['le_{0}'.format(b) for b in self.BOUNDS_MS] + ['inf']
+        return dict(count=self.count, sum_ms=self.total, min_ms=self.min,
+                    max_ms=self.max, 
+                    buckets=dict(zip(labels, self.buckets)))
+        
+
+class MemorySink(object):
+    """Keeps counters and latency histograms for ``snapshot()``."""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+        
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+        
+    def timing(self, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(seconds * 1000.0)
+            
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            
+    def snapshot(self):
+        with self._lock:
+            return dict(counters=dict(self.counters), 
+                        timings=dict((name, h.snapshot()) for name, h in 
+                                     self.histograms.iteritems()))
+        
+
+class LoggingSink(object):
+    """Logs every measurement."""
+    
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or log
+        self.level = level
+        
+    def timing(self, name, seconds):
+        self.logger.log(self.level, '%s %.3fms', name, seconds * 1000.0)
+        
+    def incr(self, name, value=1):
+        self.logger.log(self.level, '%s +%s', name, value)
+        
+
+class StatsdSink(object):
+    """Sends measurements as StatsD lines over UDP."""
+    
+    def __init__(self, host='localhost', port=8125, prefix='stubo'):
+        self.address = (host, port)
+        self.prefix = prefix + '.' if prefix else ''
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        
+    def send(self, line):
+        try:
+            self._socket.sendto(line, self.address)
+        except socket.error as e:
+            log.debug('statsd send failed: %s', e)
+        
+    def timing(self, name, seconds):
+        self.send('{0}{1}:{2:.3f}|ms'.format(self.prefix, name, 
+                                              seconds * 1000.0))
+        
+    def incr(self, name, value=1):
+        self.send('{0}{1}:{2}|c'.format(self.prefix, name, value))
+        
+    def close(self):
+        self._socket.close()    
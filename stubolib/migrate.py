@@ -0,0 +1,328 @@
+"""
+migrate.py
+~~~~~~~~~~
+
+Moves scenarios between stubo servers.
+
+``export_scenarios`` exports many scenarios at once, streaming the stubs of
+each into a local :class:`RecordingStore <RecordingStore>` named after the
+scenario. ``import_scenario`` puts the stubs of a store into a scenario from
+a bounded pool of worker threads, checkpointing which stubs are done so an
+interrupted import picks up where it stopped when run again:
+
+    $ stubo-migrate export --dc old:8001 -o scenarios first second
+    $ stubo-migrate import --dc new:8001 -c 8 scenarios/*.stubo
+"""
+import os
+import sys
+import time
+import json
+import logging
+import threading
+from argparse import ArgumentParser
+from requests.exceptions import RequestException
+from api import Stubo, StuboError
+from store import RecordingStore
+from export import iter_export_stubs
+from uploader import StubUploader, UploadError
+from session import session_mode
+from workers import run_concurrently
+
+log = logging.getLogger(__name__)
+
+STORE_SUFFIX = '.stubo'
+
+class ExportError(StuboError):
+    """Raised once all scenarios have been exported if any of them failed.
+
+    ``failures`` is a list of (scenario, exception) tuples.
+    """
+    def __init__(self, failures):
+        self.failures = failures
+        message = "{0} scenario export(s) failed: {1}".format(len(failures),
+            ', '.join('{0}: {1}'.format(n, e) for n, e in failures))
+        super(ExportError, self).__init__(400, message)
+
+
+class TransferStats(object):
+    """Counts the stubs and bytes moved for a scenario."""
+
+    def __init__(self, scenario):
+        self.scenario = scenario
+        self.stubs = 0
+        self.bytes = 0
+        self.skipped = 0
+        self.start = time.time()
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, size):
+        with self._lock:
+            self.stubs += 1
+            self.bytes += size
+
+    def finish(self):
+        self.elapsed = time.time() - self.start
+        return self
+
+    def __str__(self):
+        elapsed = self.elapsed or 1e-9
+        skipped = ', {0} already done'.format(self.skipped) if \
+            self.skipped else ''
+        return '{0}: {1} stubs, {2:.1f} KB in {3:.2f}s ({4:.1f} stubs/s, ' \
+            '{5:.1f} KB/s){6}'.format(self.scenario, self.stubs,
+            self.bytes / 1024.0, self.elapsed, self.stubs / elapsed,
+            self.bytes / 1024.0 / elapsed, skipped)
+
+
+def store_path(directory, scenario):
+    return os.path.join(directory, scenario + STORE_SUFFIX)
+
+def export_scenario(stubo, scenario, path):
+    """Streams the stubs of a scenario into a new store at path, returns
+    the :class:`TransferStats <TransferStats>`. The store only appears at
+    path once the export is complete."""
+    stats = TransferStats(scenario)
+    partial = path + '.part'
+    for stale in (partial, partial + '.idx'):
+        if os.path.exists(stale):
+            os.remove(stale)
+    try:
+        with RecordingStore(partial, mode='a') as store:
+            for call_number, stub in enumerate(iter_export_stubs(stubo,
+                                                                 scenario)):
+                # keep the put/stub args (delay_policy etc) of the export
+                query_args = dict((k, v) for k, v in stub.args().iteritems()
+                                  if k != 'session')
+                store.append(stub, query_args=query_args,
+                             call_number=call_number)
+                stats.add(stub.space_used())
+    except Exception:
+        for stale in (partial, partial + '.idx'):
+            if os.path.exists(stale):
+                os.remove(stale)
+        raise
+    os.rename(partial + '.idx', path + '.idx')
+    os.rename(partial, path)
+    return stats.finish()
+
+def export_scenarios(stubo, scenarios, directory, concurrency=4):
+    """Exports scenarios concurrently into <directory>/<scenario>.stubo
+    stores, returns their :class:`TransferStats <TransferStats>` in order.
+
+    :raises ExportError: listing the scenarios that failed.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    results = {}
+    def export(scenario):
+        results[scenario] = export_scenario(stubo, scenario,
+                                            store_path(directory, scenario))
+        log.info(str(results[scenario]))
+    failures = run_concurrently(export, scenarios, concurrency)
+    if failures:
+        raise ExportError(failures)
+    return [results[scenario] for scenario in scenarios]
+
+
+class Checkpoint(object):
+    """The positions of a store already imported, kept in a JSON file.
+
+    Positions below ``done`` are all imported, ``extra`` holds the ones
+    finished out of order above it.
+    """
+
+    def __init__(self, path, scenario, session_name):
+        self.path = path
+        self.scenario = scenario
+        self.session_name = session_name
+        self.done = 0
+        self.extra = set()
+        self._lock = threading.Lock()
+        # saves share the temporary file, one at a time
+        self._save_lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, scenario, session_name):
+        """Returns the saved checkpoint of an import, a new one if there is
+        none for the same scenario and session."""
+        checkpoint = cls(path, scenario, session_name)
+        if os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            if saved.get('scenario') == scenario and \
+                saved.get('session') == session_name:
+                checkpoint.done = saved.get('done', 0)
+                checkpoint.extra = set(saved.get('extra', []))
+        return checkpoint
+
+    @property
+    def started(self):
+        return bool(self.done or self.extra)
+
+    def __contains__(self, position):
+        with self._lock:
+            return position < self.done or position in self.extra
+
+    def __len__(self):
+        with self._lock:
+            return self.done + len(self.extra)
+
+    def mark(self, position):
+        with self._lock:
+            self.extra.add(position)
+            while self.done in self.extra:
+                self.extra.remove(self.done)
+                self.done += 1
+
+    def save(self):
+        with self._save_lock:
+            with self._lock:
+                state = dict(scenario=self.scenario, 
+                             session=self.session_name, done=self.done, 
+                             extra=sorted(self.extra))
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(state, f)
+            os.rename(tmp, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def import_scenario(stubo, path, scenario=None, session_name=None,
+                    concurrency=4, checkpoint_every=1, delete_stubs=True):
+    """Puts the stubs of a store into a scenario, returns the
+    :class:`TransferStats <TransferStats>`.
+
+    :param path: the store to import.
+    :param scenario: defaults to the store file name without '.stubo'.
+    :param session_name: the record session used, defaults to
+                         <scenario>_import.
+    :param concurrency: number of concurrent put/stub calls, stubs with 
+                        the same matchers are put in turn in store order.
+    :param checkpoint_every: stubs between saves of the checkpoint
+                             (<path>.checkpoint). Stubs put since the last 
+                             save are put again by the next run and stubo
+                             plays them back as extra responses, so the 
+                             default saves after every stub; a stub whose 
+                             put succeeded as the import was killed can 
+                             still be put twice.
+    :param delete_stubs: delete the scenario's stubs before a new import.
+    :raises UploadError: listing the store positions that failed, they are
+                         retried when the import is run again.
+    """
+    if not scenario:
+        scenario = os.path.basename(path)
+        if scenario.endswith(STORE_SUFFIX):
+            scenario = scenario[:-len(STORE_SUFFIX)]
+    session_name = session_name or '{0}_import'.format(scenario)
+    checkpoint = Checkpoint.load(path + '.checkpoint', scenario,
+                                 session_name)
+    stats = TransferStats(scenario)
+    stats.skipped = len(checkpoint)
+    if not checkpoint.started:
+        if delete_stubs:
+            stubo.delete_stubs(scenario=scenario)
+        stubo.begin_session(scenario=scenario, session=session_name,
+                            mode='record')
+    else:
+        log.info('resuming import of {0} after {1} stubs'.format(scenario,
+                                                            len(checkpoint)))
+        status = stubo.get_status(session=session_name).json().get(
+            'data', {}).get('session', {}).get('status') or 'notfound'
+        if status != 'record':
+            # raises if the session is now in playback
+            session_mode(session_name, status)
+            stubo.begin_session(scenario=scenario, session=session_name,
+                                mode='record')
+    uploader = StubUploader(stubo, session_name)
+    # matcher keys of failed stubs, the stubs after them with the same 
+    # matchers are left for the next run so stubo keeps their order
+    failed_keys = set()
+
+    def put(item):
+        position, record = item
+        key = record.stub.matcher_key()
+        if key in failed_keys:
+            raise StuboError(400, 'an earlier stub with the same matchers '
+                             'failed')
+        try:
+            uploader.put(record.stub, record.query_args)
+        except Exception as e:
+            log.warn('put/stub failed for stub {0}: {1}'.format(position, e))
+            failed_keys.add(key)
+            raise
+        stats.add(record.stub.space_used())
+        checkpoint.mark(position)
+        if stats.stubs % checkpoint_every == 0:
+            checkpoint.save()
+
+    try:
+        with RecordingStore(path) as store:
+            failures = run_concurrently(put, ((position, store[position]) 
+                for position in xrange(len(store)) 
+                if position not in checkpoint), concurrency,
+                key=lambda item: item[1].stub.matcher_key())
+    finally:
+        checkpoint.save()
+    if failures:
+        raise UploadError(sorted((position, e) for (position, _), e in 
+                                 failures))
+    stubo.end_session(scenario=scenario, session=session_name,
+                      mode='record')
+    checkpoint.remove()
+    return stats.finish()
+
+def main(argv=None):
+    parser = ArgumentParser(description="Exports scenarios from a stubo "
+                            "server to local stores or imports them")
+    commands = parser.add_subparsers(dest='command')
+    export = commands.add_parser('export', help="export scenarios")
+    export.add_argument('scenarios', nargs='+', help="scenarios to export")
+    export.add_argument('-o', '--output', default='.',
+                        help="directory for the <scenario>.stubo stores")
+    imports = commands.add_parser('import', help="import scenario stores, "
+                                  "resuming interrupted imports")
+    imports.add_argument('stores', nargs='+',
+                         help="<scenario>.stubo stores to import")
+    imports.add_argument('--keep-stubs', action='store_true',
+                         help="do not delete the scenario's stubs first")
+    for command in (export, imports):
+        command.add_argument('--dc', default='localhost:8001',
+                             help="stubo server, default localhost:8001")
+        command.add_argument('-c', '--concurrency', type=int, default=4,
+                             help="concurrent scenarios (export) or "
+                             "put/stub calls (import)")
+    args = parser.parse_args(argv)
+    stubo = Stubo(args.dc, pool_maxsize=args.concurrency)
+    total = TransferStats('total')
+    try:
+        if args.command == 'export':
+            results = export_scenarios(stubo, args.scenarios, args.output,
+                                       concurrency=args.concurrency)
+        else:
+            results = []
+            for path in args.stores:
+                results.append(import_scenario(stubo, path,
+                                   concurrency=args.concurrency,
+                                   delete_stubs=not args.keep_stubs))
+                print results[-1]
+    except (StuboError, RequestException) as e:
+        print >> sys.stderr, e.args[-1] if isinstance(e, StuboError) else e
+        if args.command == 'import':
+            print >> sys.stderr, 'run the import again to resume it'
+        return 1
+    finally:
+        stubo.close()
+    for stats in results:
+        if args.command == 'export':
+            print stats
+        total.stubs += stats.stubs
+        total.bytes += stats.bytes
+    print total.finish()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,34 +4,94 @@ import StringIO
 import json
 from datetime import datetime, date
 import logging
+import hashlib
+import threading
+from functools import partial
 from stubo_adapter import StuboAdapter
 from api import (
-    Stubo, requests, StuboError
+    Stubo, requests, StuboError, DEFAULT_POOLSIZE
 )
 from stub import StubData
+from uploader import StubUploader, BackgroundUploader, UploadError
+from store import RecordingStore
+from spool import BodySpool, SpooledBody, unspool
+from tee import BodyRecorder, TeeRawResponse
+from matcher import StubMatcher
+from export import export_stubs
 
 log = logging.getLogger(__name__)
 
+def session_mode(session_name, status):
+    """Returns the mode to run a session in given its stubo status."""
+    if status == 'notfound':
+        return 'record'
+    elif status == 'dormant':
+        return 'playback'
+    raise StuboError(400, "session '{0}' in '{1}' mode should be " \
+          "dormant".format(session_name, status))
+
+def _digest_body(digest, body):
+    if isinstance(body, SpooledBody):
+        digest.update('{0}:'.format(len(body)))
+        for chunk in body.iter_chunks():
+            digest.update(chunk)
+        return
+    if isinstance(body, unicode):
+        body = body.encode('utf-8')
+    body = body or ''
+    digest.update('{0}:'.format(len(body)))
+    digest.update(body)
+
 class HTTPCall(object):
     """Represents an HTTP request/response used for recording interactions 
-    with an HTTP server"""
+    with an HTTP server. Bodies may be held in a 
+    :class:`BodySpool <BodySpool>`, they are read back on access."""
+    __slots__ = ('host', 'call_number', 'request_method', 'request_url', 
+                 '_request_body', 'request_headers', 'response_status', 
+                 'response_reason', 'response_headers', '_response_body', 
+                 '_url_parts')
+    
     def __init__(self, host=None):
         self.host = host
-        self.request_method = self.request_url = self.request_body = None
+        self.call_number = None
+        self.request_method = self.request_url = self._request_body = None
         self.request_headers = {}
         self.response_status = self.response_reason = None
         self.response_headers = {}
-        self.response_body = None
+        self._response_body = None
         self._url_parts = None
         
     def __str__(self):
-        return "request: {request_method} {request_url} {request_body}, " \
-          "{request_headers}\nresponse: {response_status}, {response_reason},"\
-          "{response_body}, {response_headers}".format(**self.__dict__)
+        return "request: {0} {1} {2}, {3}\nresponse: {4}, {5},{6}, {7}"\
+          .format(self.request_method, self.request_url, self._request_body,
+                  self.request_headers, self.response_status, 
+                  self.response_reason, self._response_body, 
+                  self.response_headers)
     
     def __repr__(self):
         return self.__str__() 
     
+    @property
+    def request_body(self):
+        return unspool(self._request_body)
+    
+    @request_body.setter
+    def request_body(self, body):
+        self._request_body = body
+        
+    @property
+    def response_body(self):
+        return unspool(self._response_body)
+    
+    @response_body.setter
+    def response_body(self, body):
+        self._response_body = body
+        
+    def spool_bodies(self, spool):
+        """Moves large bodies to the spool."""
+        self._request_body = spool.spool(self._request_body)
+        self._response_body = spool.spool(self._response_body)    
+    
     @property
     def url_parts(self):
         if not self._url_parts:
@@ -42,6 +102,15 @@ class HTTPCall(object):
     @property
     def request_query_args(self):
         return urlparse.parse_qs(self.url_parts.query)
+    
+    def content_digest(self):
+        """Returns a hash of the method, query args, bodies and status that
+        make up the stub of this call."""
+        digest = hashlib.sha1('{0}\n{1}\n{2}\n'.format(self.request_method,
+            sorted(self.request_query_args.items()), self.response_status))
+        _digest_body(digest, self._request_body)
+        _digest_body(digest, self._response_body)
+        return digest.hexdigest()
             
 
 class Session(object):
@@ -50,11 +119,56 @@ class Session(object):
     When in 'record' mode an instance records all http remote calls. 
     In 'playback' mode all http calls go to stubo. 
 
+    With ``incremental_upload=True`` recorded calls are put to stubo by 
+    background threads while recording continues instead of at ``stop()``, 
+    ``upload_queue_size`` bounds the calls waiting to be uploaded and 
+    ``upload_backpressure`` ('block' or 'buffer') decides what happens when 
+    the queue is full.
+
+    With ``store=<path>`` recorded calls are also appended to a local 
+    :class:`RecordingStore <RecordingStore>`, add ``store_only=True`` to 
+    record without a stubo server and ``upload_store()`` them later. A new
+    recording replaces the stubs of the store unless ``delete_stubs=False``.
+
+    With ``request_headers=False`` the original request headers are not 
+    sent to stubo on playback.
+
+    With ``spool_threshold=<bytes>`` bodies of at least that size are kept 
+    in a temporary file (in ``spool_dir``) until they are uploaded.
+
+    With ``offline=True`` playback is done in-process by matching requests 
+    against the stubs of the store (if given) or of the scenario export, 
+    without a stubo session.
+
+    With ``preload=True`` (or ``play(preload=True)`` for one run) the stubs
+    of the scenario export are loaded once at start and requests they match
+    are played back in-process, other requests (and stubs with a user exit
+    module) still go to the stubo session.
+
+    With ``dedupe=True`` a recorded call identical to an earlier one (same
+    method, query args, request body, status and response body) is dropped 
+    so each unique stub is uploaded once, ``dedupe_hits=True`` adds the 
+    number of times it was recorded to the stub as 'hits' (exact for stubs 
+    uploaded at ``stop()``, 1 for stubs stored or uploaded incrementally).
+
+    With ``stubo=<Stubo>`` the session uses that api client (and its 
+    connection pool) instead of creating its own, which is closed at 
+    ``stop()``.
+
+    With ``dc`` a list of stubo servers the session is begun on one of them,
+    see :class:`Stubo <Stubo>` for ``balance`` and ``health_interval``.
+
     """
     def __init__(self, dc, scenario, session_name, **kwargs):
         """Create a record for the given caller"""
         self._calls = []
-        self._current_call = None
+        # in flight calls by id of their request
+        self._pending_calls = {}
+        # (call, tee) of streamed responses not read to the end, by call id
+        self._open_calls = {}
+        self._lock = threading.Lock()
+        self._call_count = 0
+        self._background_uploader = None
         self.requests_session = None
         self.scenario = scenario
         self.session_name = session_name 
@@ -62,46 +176,244 @@ class Session(object):
         self.delete_stubs_force = kwargs.pop('delete_stubs_force', False)
         self.mode = kwargs.pop('mode', None)
         self.user_exit = kwargs.pop('user_exit', None)
-        self.stubo = Stubo(dc, **kwargs)
+        self.upload_concurrency = kwargs.pop('upload_concurrency', 1)
+        self.incremental_upload = kwargs.pop('incremental_upload', False)
+        self.upload_queue_size = kwargs.pop('upload_queue_size', 100)
+        self.upload_backpressure = kwargs.pop('upload_backpressure', 
+                                              BackgroundUploader.BLOCK)
+        self.store = kwargs.pop('store', None)
+        self.store_only = kwargs.pop('store_only', False)
+        self._store = None
+        self.offline = kwargs.pop('offline', False)
+        self.preload = kwargs.pop('preload', False)
+        self.spool_threshold = kwargs.pop('spool_threshold', None)
+        self.spool_dir = kwargs.pop('spool_dir', None)
+        self.request_headers = kwargs.pop('request_headers', True)
+        self.dedupe = kwargs.pop('dedupe', False)
+        self.dedupe_hits = kwargs.pop('dedupe_hits', False)
+        # content digest => call number of the call kept
+        self._digests = {}
+        # call number => times the call was recorded
+        self._hits = {}
+        self._spool = None
+        self.matcher = None
+        # stubs given to load_stubs(), played instead of the store or export
+        self._loaded_stubs = None
+        # preload of the next play() run, overrides preload for that run
+        self._play_preload = None
+        kwargs.setdefault('pool_maxsize', max(self.upload_concurrency, 
+                                              DEFAULT_POOLSIZE))
+        stubo = kwargs.pop('stubo', None)
+        # a client the session created is closed when it stops
+        self._own_stubo = stubo is None
+        self.stubo = stubo or self.make_stubo(dc, **kwargs)
         self.extras = kwargs
         self.started_ok = False
     
+    def make_stubo(self, dc, **kwargs):
+        return Stubo(dc, **kwargs)
+    
     def get_requests_session(self):
+        """Returns the requests session intercepted by this session, created
+        on first use."""
+        if self.requests_session is not None:
+            return self.requests_session
         self.requests_session = requests.Session()
         auth = self.stubo.get_auth()
         self.requests_session.mount('http://', StuboAdapter(session=self, 
-                                                auth_token=auth))
+                                auth_token=auth, 
+                                request_headers=self.request_headers))
         self.requests_session.mount('https://', StuboAdapter(session=self, 
-                                                auth_token=auth))
+                                auth_token=auth,
+                                request_headers=self.request_headers))
         return self.requests_session
             
+    def open_store(self):
+        if isinstance(self.store, RecordingStore):
+            return self.store
+        return RecordingStore(self.store, mode='a')
+    
+    def close_store(self):
+        store = self._store
+        self._store = None
+        if store is not None and store is not self.store:
+            store.close()
+        elif store is not None:
+            store.flush()
+            
+    def _start_local(self):
+        """Prepares the session, returns True if it runs without a stubo 
+        session."""
+        preload = self._play_preload
+        self._play_preload = None
+        if preload is None:
+            preload = self.preload
+        if self.mode == 'record':
+            self._calls = []
+            self._call_count = 0
+            self._pending_calls = {}
+            self._open_calls = {}
+            self._digests = {}
+            self._hits = {}
+            if self._spool is not None:
+                self._spool.close()
+                self._spool = None
+            if self.spool_threshold is not None:
+                self._spool = BodySpool(self.spool_threshold, 
+                                        dir=self.spool_dir)
+            if self.store:
+                self._store = self.open_store()
+                if self.delete_stubs:
+                    # stubs of an earlier recording would be played first
+                    self._store.clear()
+        else:
+            self.matcher = None
+            if self.offline or preload or self._loaded_stubs is not None:
+                # a new matcher for each run picks up stubs recorded since 
+                # and starts response sequences again
+                stubs = self._loaded_stubs
+                if stubs is None:
+                    stubs = self.get_offline_stubs()
+                if not self.offline:
+                    # stubo runs the user exit of a stub with a module
+                    stubs = [stub for stub in stubs if not stub.module()]
+                self.matcher = StubMatcher(stubs)
+        return self.is_local()
+    
+    def is_local(self):
+        return self.mode == 'record' and self.store_only or \
+            self.mode != 'record' and self.offline
+            
     def start(self):
-        assert(self.mode)   
+        assert(self.mode)
+        if self._start_local():
+            self.started_ok = True
+            return
         if self.mode == 'record' and self.delete_stubs:
              self.stubo.delete_stubs(scenario=self.scenario, 
                                      force=self.delete_stubs_force)
         self.stubo.begin_session(scenario=self.scenario,
                                  session=self.session_name,
                                  mode=self.mode)  
+        if self.mode == 'record' and self.incremental_upload:
+            self._background_uploader = BackgroundUploader(
+                self.get_uploader(), maxsize=self.upload_queue_size,
+                backpressure=self.upload_backpressure)
         self.started_ok = True               
 
     def stop(self):
         """Called to stop recording an interaction"""
-        if self.started_ok:
+        if not self.started_ok:
+            self.close_store()
+            self.close_stubo()
+            return
+        try:
             if self.mode == 'record':
-                for call_number, call in enumerate(self._calls):
-                    stub = StubData(call.request_body, call.response_body,
-                                    call.request_method, call.response_status)
-                    if self.user_exit:
-                        stub.set_module(self.user_exit)
-                    
-                    self.stubo.put_stub(session=self.session_name,
-                                        json=stub.payload,
-                                        **call.request_query_args)
+                self.finish_open_calls()
+            if self.is_local():
+                return
+            try:
+                if self.mode == 'record':
+                    self.flush()
+            finally:        
+                self.stubo.end_session(scenario=self.scenario,
+                                       session=self.session_name,
+                                       mode=self.mode)
+        finally:
+            self.close_store()
+            self.close_stubo()
+            
+    def close_stubo(self):
+        """Closes the pool and health checks of the api client if the 
+        session created it, they are recreated on its next call."""
+        if self._own_stubo:
+            self.stubo.close()
+            
+    def get_offline_stubs(self):
+        """Returns the stubs to play back offline or preload."""
+        if self.store:
+            if isinstance(self.store, RecordingStore):
+                return [r.stub for r in self.store]
+            with RecordingStore(self.store) as store:
+                return [r.stub for r in store]
+        return export_stubs(self.stubo, self.scenario)
+    
+    def load_stubs(self, stubs):
+        """Loads the stubs to play back in-process instead of the stubs of
+        the store or scenario export."""
+        self._loaded_stubs = list(stubs)
+        self.matcher = StubMatcher(self._loaded_stubs)
+        
+    def match(self, request):
+        """Returns the (status, body) recorded for a request or None."""
+        stub = self.matcher.find(request.body, request.method)
+        if stub is None:
+            return None
+        return stub.response_status(), self.matcher.next_response(stub)
             
+    def upload_store(self, store=None):
+        """Records the stubs saved in a local store into the stubo session.
+        
+        :param store: a path or :class:`RecordingStore <RecordingStore>`, 
+                      defaults to the session's store.
+        """
+        store = store or self.store
+        if not isinstance(store, RecordingStore):
+            with RecordingStore(store) as opened:
+                return self.upload_store(opened)
+        if self.delete_stubs:
+            self.stubo.delete_stubs(scenario=self.scenario, 
+                                    force=self.delete_stubs_force)
+        self.stubo.begin_session(scenario=self.scenario,
+                                 session=self.session_name, mode='record')
+        try:
+            self.get_uploader().upload((r.call_number, r.stub, r.query_args)
+                                       for r in store)
+        finally:
             self.stubo.end_session(scenario=self.scenario,
-                                   session=self.session_name,
-                                   mode=self.mode)    
+                                   session=self.session_name, mode='record')
+                
+    def make_stub(self, call):
+        """Returns the :class:`StubData <StubData>` for a recorded call"""
+        stub = StubData(call.request_body, call.response_body,
+                        call.request_method, call.response_status)
+        if self.user_exit:
+            stub.set_module(self.user_exit)
+        if self.dedupe_hits:
+            stub.set_hits(self._hits.get(call.call_number, 1))
+        return stub 
+    
+    def get_uploader(self):
+        return StubUploader(self.stubo, self.session_name, 
+                            concurrency=self.upload_concurrency)
+                
+    def flush(self):
+        """Waits for background uploads then uploads any remaining calls."""
+        background_uploader = self._background_uploader
+        self._background_uploader = None
+        failures = []
+        if background_uploader:
+            try:
+                background_uploader.join()
+            except UploadError as e:
+                failures.extend(e.failures)
+        try:
+            self.upload_calls()
+        except UploadError as e:
+            failures.extend(e.failures)
+        if failures:
+            raise UploadError(sorted(failures))
+        
+    def upload_calls(self):
+        """Puts a stub for each recorded call, concurrently if 
+        ``upload_concurrency`` > 1. 
+        
+        :raises UploadError: listing the call numbers that failed.
+        """
+        self._calls.sort(key=lambda call: call.call_number)
+        self.get_uploader().upload((call.call_number, self.make_stub(call), 
+                                    call.request_query_args) for 
+                                   call in self._calls)
 
     @contextmanager
     def record_or_play(self, mode=None):
@@ -114,8 +426,9 @@ class Session(object):
         return self._run()
     
     @contextmanager
-    def play(self):
+    def play(self, preload=None):
         self.mode = 'playback'
+        self._play_preload = preload
         return self._run() 
             
     def _run(self):
@@ -134,14 +447,7 @@ class Session(object):
         return status if status else 'notfound'
                                          
     def discover_mode(self):
-        session_mode = self.get_session_mode()
-        if session_mode == 'notfound':
-            return 'record'
-        elif session_mode == 'dormant':
-            return 'playback'
-        else:
-            raise StuboError(400, "session '{0}' in '{1}' mode should be " \
-                  "dormant".format(self.session_name, session_mode))                 
+        return session_mode(self.session_name, self.get_session_mode())
         
     def record_request(self, request, headers):
         new_call = HTTPCall(host=headers["Stubo-Request-Host"])
@@ -149,17 +455,97 @@ class Session(object):
         new_call.request_url = request.url
         new_call.request_body = request.body
         new_call.request_headers = request.headers
-        self._current_call = new_call
+        with self._lock:
+            self._pending_calls[id(request)] = new_call
+            
+    def discard_request(self, request):
+        """Forgets a request that got no response."""
+        with self._lock:
+            self._pending_calls.pop(id(request), None)
 
-    def record_response(self, http_response):
-        new_call = self._current_call
+    def record_response(self, http_response, request=None):
+        new_call = self.record_response_headers(http_response, request)
+        new_call.response_body = http_response.content
+        self.add_call(new_call)
+        
+    def record_response_headers(self, http_response, request=None):
+        """Returns the call of the request (by default the response's 
+        request) with the response status and headers set, its body is 
+        added by ``finish_call``."""
+        if request is None:
+            request = getattr(http_response, 'request', None)
+        with self._lock:
+            new_call = self._pending_calls.pop(id(request), None)
+            if new_call is None and request is None and \
+                len(self._pending_calls) == 1:
+                # a response that does not know its request 
+                new_call = self._pending_calls.popitem()[1]
         if not new_call:
             raise StuboError(400, "Called record response when no request was made.")
         new_call.response_status = http_response.status_code
         new_call.response_reason = http_response.reason
         new_call.response_headers = http_response.headers
-        body = http_response.content
-        new_call.response_body = body
-        self._calls.append(new_call)
-        self._current_call = None
+        return new_call
+    
+    def body_recorder(self):
+        """Returns a recorder for a response body read in chunks."""
+        return BodyRecorder(self.spool_threshold, dir=self.spool_dir)
+    
+    def tee_response(self, raw, new_call):
+        """Returns the raw response of a call wrapped to record its body as
+        it is read, the call is added once the body is done."""
+        tee = TeeRawResponse(raw, self.body_recorder(), 
+                             partial(self.finish_call, new_call))
+        with self._lock:
+            self._open_calls[id(new_call)] = (new_call, tee)
+        return tee
+    
+    def finish_call(self, new_call, recorder):
+        """Adds a call once its response body has been read."""
+        with self._lock:
+            self._open_calls.pop(id(new_call), None)
+        new_call.response_body = recorder.finish(self._spool)
+        self.add_call(new_call)
+        
+    def finish_open_calls(self):
+        """Reads the rest of the streamed responses the application did not
+        read to the end or close, so their calls are recorded."""
+        with self._lock:
+            open_calls = self._open_calls.values()
+        for new_call, tee in open_calls:
+            try:
+                tee.release_conn()
+            except Exception as e:
+                log.warn('call to {0} not recorded, reading the rest of its '
+                         'response failed: {1}'.format(new_call.request_url, 
+                                                      e))
+        
+    def add_call(self, new_call):
+        """Numbers a finished call and stores, queues or keeps it for 
+        upload, a duplicate of an earlier call is only counted."""
+        digest = new_call.content_digest() if self.dedupe else None
+        with self._lock:
+            if digest is not None:
+                kept = self._digests.get(digest)
+                if kept is not None:
+                    self._hits[kept] += 1
+                    return
+            new_call.call_number = self._call_count
+            self._call_count += 1
+            if digest is not None:
+                self._digests[digest] = new_call.call_number
+                self._hits[new_call.call_number] = 1
+        if self._store is not None:
+            self._store.append(self.make_stub(new_call), 
+                               new_call.request_query_args,
+                               call_number=new_call.call_number)
+            if self.store_only:
+                return
+        if not (self._background_uploader and 
+                self._background_uploader.submit(new_call.call_number, 
+                    self.make_stub(new_call), new_call.request_query_args)):
+            if self._spool is not None:
+                new_call.spool_bodies(self._spool)
+            with self._lock:
+                self._calls.append(new_call)
         
\ No newline at end of file
@@ -0,0 +1,106 @@
+"""
+spool.py
+~~~~~~~~~~
+
+Keeps large recorded bodies out of memory.
+
+Bodies over a size threshold are appended to one temporary spool file and 
+replaced by a :class:`SpooledBody <SpooledBody>` that reads them back when
+the stubs are uploaded.
+"""
+import tempfile
+import threading
+
+class SpooledBody(object):
+    """A body held in a :class:`BodySpool <BodySpool>`."""
+    __slots__ = ('spool', 'offset', 'length')
+    
+    def __init__(self, spool, offset, length):
+        self.spool = spool
+        self.offset = offset
+        self.length = length
+        
+    def __len__(self):
+        return self.length
+    
+    def __repr__(self):
+        return '<SpooledBody {0} bytes>'.format(self.length)
+        
+    def read(self):
+        return self.spool.read(self.offset, self.length)
+    
+    def iter_chunks(self, chunk_size=65536):
+        pos = 0
+        while pos < self.length:
+            size = min(chunk_size, self.length - pos)
+            yield self.spool.read(self.offset + pos, size)
+            pos += size
+            
+
+class BodySpool(object):
+    """Append-only temporary file of bodies.
+    
+    :param threshold: bodies of this many bytes or more are spooled.
+    :param dir: directory for the spool file, defaults to the system temp.
+    """
+    
+    def __init__(self, threshold, dir=None):
+        self.threshold = threshold
+        self.dir = dir
+        self.size = 0
+        self._file = None
+        self._lock = threading.Lock()
+        
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        
+    def spool(self, body):
+        """Returns a SpooledBody for a large str body, else the body."""
+        if not isinstance(body, str) or len(body) < self.threshold:
+            return body
+        with self._lock:
+            if self._file is None:
+                self._file = tempfile.TemporaryFile(prefix='stubo-spool-',
+                                                    dir=self.dir)
+            offset = self.size
+            self._file.seek(offset)
+            self._file.write(body)
+            self.size += len(body)
+        return SpooledBody(self, offset, len(body))
+    
+    def spool_file(self, f, chunk_size=65536):
+        """Copies the rest of an open file into the spool, returns the 
+        SpooledBody."""
+        with self._lock:
+            if self._file is None:
+                self._file = tempfile.TemporaryFile(prefix='stubo-spool-',
+                                                    dir=self.dir)
+            offset = self.size
+            self._file.seek(offset)
+            for chunk in iter(lambda: f.read(chunk_size), ''):
+                self._file.write(chunk)
+                self.size += len(chunk)
+        return SpooledBody(self, offset, self.size - offset)
+    
+    def read(self, offset, length):
+        with self._lock:
+            if self._file is None:
+                raise IOError('body spool is closed')
+            self._file.seek(offset)
+            return self._file.read(length)
+        
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                self.size = 0
+
+def unspool(body):
+    """Returns the bytes of a possibly spooled body."""
+    if isinstance(body, SpooledBody):
+        return body.read()
+    return body                
@@ -0,0 +1,186 @@
+"""
+store.py
+~~~~~~~~~~
+
+A local on-disk store for recorded stubs.
+
+Records are appended to a data file as a 4 byte big-endian length followed 
+by the JSON encoded record. The offset of each record is appended to an 
+index file (``<path>.idx``) as an 8 byte big-endian integer so records can 
+be read back in any order from a memory mapped view of the data file. A 
+missing or stale index is rebuilt from the data file on open.
+"""
+import os
+import mmap
+import codec
+import struct
+import threading
+from collections import namedtuple
+from stub import StubData
+
+MAGIC = 'STUBOREC1\n'
+_length = struct.Struct('>I')
+_offset = struct.Struct('>Q')
+
+StoredStub = namedtuple('StoredStub', 'call_number stub query_args')
+
+class RecordingStore(object):
+    """Append-only file of recorded stubs.
+
+    :param path: the data file, the index is kept next to it.
+    :param mode: 'r' to read an existing store, 'a' to create or append.
+    """
+    
+    def __init__(self, path, mode='r'):
+        if mode not in ('r', 'a'):
+            raise ValueError('unknown store mode: {0}'.format(mode))
+        self.path = path
+        self.index_path = path + '.idx'
+        self.mode = mode
+        self._lock = threading.RLock()
+        self._data = self._index = None
+        self._map = None
+        self._mapped_size = 0
+        if mode == 'a' and not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(MAGIC)
+            open(self.index_path, 'wb').close()    
+        self._offsets, self._size = self._load_index()
+        if mode == 'a':
+            self._data = open(path, 'r+b')
+            self._data.truncate(self._size)
+            self._data.seek(self._size)
+            self._index = open(self.index_path, 'ab')
+            
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()    
+        
+    def __len__(self):
+        return len(self._offsets)
+    
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+            
+    def __getitem__(self, i):
+        return self.read(i)           
+            
+    def _load_index(self):
+        """Returns the record offsets and the end of the last whole record."""
+        with open(self.path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError('{0} is not a stubo recording store'.format(
+                                                                self.path))
+            size = os.fstat(f.fileno()).st_size    
+            offsets = []
+            if os.path.exists(self.index_path):
+                with open(self.index_path, 'rb') as idx:
+                    raw = idx.read()
+                count = len(raw) // _offset.size    
+                offsets = [_offset.unpack_from(raw, i * _offset.size)[0] 
+                           for i in xrange(count)]
+            end = len(MAGIC)
+            if offsets:
+                f.seek(offsets[-1])
+                header = f.read(_length.size)
+                if len(header) == _length.size:
+                    end = offsets[-1] + _length.size + \
+                        _length.unpack(header)[0]
+            if end == size and (offsets or size == len(MAGIC)):
+                return offsets, size
+            # the index is stale, rebuild it from the data file
+            return self._scan(f, size)
+        
+    def _scan(self, f, size):
+        offsets = []
+        pos = len(MAGIC)
+        f.seek(pos)
+        while pos + _length.size <= size:
+            length = _length.unpack(f.read(_length.size))[0]
+            if pos + _length.size + length > size:
+                # partially written last record
+                break
+            offsets.append(pos)
+            pos += _length.size + length
+            f.seek(pos)
+        if self.mode == 'a':
+            with open(self.index_path, 'wb') as idx:
+                idx.write(''.join(_offset.pack(o) for o in offsets))
+        return offsets, pos                
+        
+    def append(self, stub, query_args=None, call_number=None):
+        """Appends a stub, returns its position in the store."""
+        if self.mode != 'a':
+            raise IOError('store {0} is read only'.format(self.path))
+        # reuses the stub's encoded json
+        record = codec.dumps(dict(call_number=call_number, 
+                                  query_args=query_args or {}))[:-1] + \
+            ',"stub":' + stub.to_json() + '}'
+        with self._lock:
+            offset = self._size
+            self._data.write(_length.pack(len(record)))
+            self._data.write(record)
+            self._index.write(_offset.pack(offset))
+            self._size += _length.size + len(record)
+            self._offsets.append(offset)
+            return len(self._offsets) - 1
+        
+    def clear(self):
+        """Removes all the records, for a store recorded again."""
+        if self.mode != 'a':
+            raise IOError('store {0} is read only'.format(self.path))
+        with self._lock:
+            if self._map:
+                self._map.close()
+                self._map = None
+                self._mapped_size = 0
+            self._data.truncate(len(MAGIC))
+            self._data.seek(len(MAGIC))
+            self._index.truncate(0)
+            self._offsets = []
+            self._size = len(MAGIC)
+        
+    def _view(self):
+        with self._lock:
+            if self._mapped_size < self._size:
+                if self._data:
+                    self._data.flush()
+                    self._index.flush()
+                if self._map:
+                    self._map.close()
+                with open(self.path, 'rb') as f:
+                    self._map = mmap.mmap(f.fileno(), self._size, 
+                                          access=mmap.ACCESS_READ)
+                self._mapped_size = self._size
+            return self._map     
+        
+    def read(self, i):
+        """Returns the :class:`StoredStub <StoredStub>` at position i."""
+        offset = self._offsets[i]
+        view = self._view()
+        length = _length.unpack_from(view, offset)[0]
+        start = offset + _length.size
+        record = codec.loads(view[start:start + length])
+        return StoredStub(record['call_number'], 
+                          StubData.from_payload(record['stub']),
+                          record['query_args'])
+    
+    def flush(self):
+        with self._lock:
+            if self._data:
+                self._data.flush()
+                self._index.flush()
+                
+    def close(self):
+        with self._lock:
+            if self._map:
+                self._map.close()
+                self._map = None
+                self._mapped_size = 0
+            if self._data:
+                self._data.close()
+                self._index.close()
+                self._data = self._index = None
@@ -1,10 +1,48 @@
+import codec
+
 class StubData(object):
+    """A stub to put to stubo. 
+    
+    The nested payload dict is only built when it is first needed and the 
+    encoded JSON is kept until the stub is changed, so change the payload 
+    through the setters.
+    """
+    __slots__ = ('_fields', '_payload', '_json')
      
     def __init__(self, requestBody, responseBody, method="POST", status=200):
-        self.payload = dict(request=dict(method=method,
+        self._fields = (requestBody, responseBody, method, status)
+        self._payload = None
+        self._json = None
+        
+    @classmethod
+    def from_payload(cls, payload):
+        """Creates a stub from a put/stub style payload dict"""
+        stub = cls.__new__(cls)
+        stub.payload = payload
+        return stub
+    
+    @property
+    def payload(self):
+        if self._payload is None:
+            requestBody, responseBody, method, status = self._fields
+            self._payload = dict(request=dict(method=method,
                                          bodyPatterns=[dict(contains=[requestBody])]),
-                            response=dict(status=status,
-                                          body=responseBody))
+                                 response=dict(status=status,
+                                               body=responseBody))
+            self._fields = None
+        return self._payload
+    
+    @payload.setter
+    def payload(self, payload):
+        self._fields = None
+        self._payload = payload
+        self._json = None
+        
+    def to_json(self):
+        """Returns the payload encoded as JSON bytes."""
+        if self._json is None:
+            self._json = codec.dumps(self.payload)
+        return self._json
         
     def __eq__(self, other):
         if type(other) is type(self):
@@ -21,13 +59,19 @@ class StubData(object):
         return self.payload['response']
     
     def response_status(self):
+        if self._fields is not None:
+            return self._fields[3]
         return self.payload['response']['status']
     
     def set_response_body(self, body):
         self.response()['body'] = body 
+        self._json = None
          
     def response_body(self):
-        response = self.response().get('body')
+        if self._fields is not None:
+            response = self._fields[1]
+        else:
+            response = self.response().get('body')
         if response and isinstance(response, basestring):
             response = [response]
         return response    
@@ -38,8 +82,11 @@ class StubData(object):
              
     def set_delay_policy(self, policy):
          self.response()['delayPolicy'] =  policy      
+         self._json = None
     
     def request_method(self):
+        if self._fields is not None:
+            return self._fields[2]
         return self.payload['request']['method']
         
     def contains_matchers(self):
@@ -47,6 +94,14 @@ class StubData(object):
     
     def set_contains_matchers(self, matchers):
         self.request()['bodyPatterns'][0]['contains'] = matchers
+        self._json = None
+        
+    def matcher_key(self):
+        """Returns a key shared by the stubs stubo plays back in turn for 
+        the same request."""
+        method = self._fields[2] if self._fields is not None else \
+            self.payload['request'].get('method')
+        return (method, tuple(self.contains_matchers()))
         
     def number_of_matchers(self):
         return len(self.contains_matchers())
@@ -59,15 +114,26 @@ class StubData(object):
              
     def set_recorded(self, recorded):
          self.payload['recorded'] = recorded  
+         self._json = None
+         
+    def hits(self):
+        """Returns the number of times the stub was recorded."""
+        return self.payload.get('hits', 1)
+    
+    def set_hits(self, hits):
+        self.payload['hits'] = hits
+        self._json = None
          
     def module(self):
         return self.payload.get('module', {})
     
     def set_module(self, module):
          self.payload['module'] = module
+         self._json = None
          
     def space_used(self):
-        return len(unicode(self.payload)) 
+        """Returns the size of the encoded stub in bytes."""
+        return len(self.to_json()) 
     
     def __str__(self):
        return unicode(self.payload)     
\ No newline at end of file
@@ -4,13 +4,110 @@ stubo_adapter.py
 
 Contains an implementation of an HTTP adapter for Requests that calls
 Stubo get/response URL when in 'playback' mode and 'records' the 
-actual response of a real request when in 'record' mode.
+actual response of a real request when in 'record' mode. When the 
+session plays back offline the response is built from the session's 
+in-process stub matcher instead, a preloading session plays back the 
+requests its matcher finds in-process and the rest from stubo. Playback 
+responses are cached when the session's Stubo client has a response cache.
 """
+import time
 import urlparse
+import httplib
+import json
 from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from cache import CachedResponse
 
-class StuboAdapter(HTTPAdapter):
+NO_MATCH = json.dumps(dict(version='offline', error=dict(code=400, 
+                           message='E017:No matching response found')))
+
+class StuboInterceptor(object):
+    """
+    Rewrites intercepted requests for a Stubo Session, shared by the 
+    transports that intercept http calls.
+    
+    ``request_headers`` set to False leaves the encoded original request 
+    headers (Stubo-Request-Headers) out of playback requests.
+    """
+    
+    request_headers = True
+    _proxy_urls = None
+    
+    def get_stubo_headers(self, request, parts=None):
+        if parts is None:
+            parts = urlparse.urlsplit(request.url)
+        info = {
+          'Stubo-Request-URI'    : request.url,
+          'Stubo-Request-Host'   : parts.netloc,
+          'Stubo-Request-Method' : request.method, 
+        }
+        if self.request_headers:
+            info['Stubo-Request-Headers'] = str(request.headers)
+        if parts.path:
+            info["Stubo-Request-Path"] = parts.path 
+        if parts.query:
+            info["Stubo-Request-Query"] = parts.query          
+        return info
+    
+    def offline_response(self, match):
+        """
+        Returns the (status, headers, body) played back offline for the 
+        (status, body) a request matched, a request without a match (None) 
+        gets the stubo 'no matching response' error.
+        """
+        if match:
+            status, body = match
+            content_type = 'text/plain'
+        else:
+            status, body = 400, NO_MATCH
+            content_type = 'application/json; charset=UTF-8'
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        headers = {
+            'Content-Type' : content_type,
+            'Content-Length' : str(len(body)),
+            'X-Stubo-Version' : 'offline',
+        }
+        return status, headers, body
+        
+    def measure_call(self, metrics, start):
+        """Counts and times an intercepted call for the session."""
+        name = 'session.{0}.{1}'.format(self.session.session_name, 
+                                        self.session.mode)
+        metrics.incr(name + '.calls')
+        metrics.timing(name + '.latency', time.time() - start)
+        
+    def proxify(self, original_url, parts=None):
+        """
+        Take a raw url string and turn it into a valid Stubo get/response URL.
+        
+        Before:
+            http://foo.example.com/path
+        After:
+            http://<stubo_host>/stubo/api/get/response
+        """
+        if parts is None:
+            parts = urlparse.urlsplit(original_url)
+        dc = self.session.stubo.server_for(self.session.session_name)
+        if parts.username or parts.password:
+            new_host = "{0}:{1}@{2}".format(parts.username, parts.password,
+                                            dc)
+            return self._proxy_url(parts.scheme, new_host)
+        key = (parts.scheme, dc, self.session.session_name)
+        if self._proxy_urls is None:
+            self._proxy_urls = {}
+        url = self._proxy_urls.get(key)
+        if url is None:
+            url = self._proxy_urls[key] = self._proxy_url(parts.scheme, 
+                                                          key[1])
+        return url
+    
+    def _proxy_url(self, scheme, host):
+        return urlparse.urlunsplit((scheme, host, 'stubo/api/get/response', 
+            'session={0}'.format(self.session.session_name), ''))
+
+    
+class StuboAdapter(StuboInterceptor, HTTPAdapter):
     """
     A Stubo-aware Transport Adapter for Python Requests. The central
     portion of the API.
@@ -20,72 +117,96 @@ class StuboAdapter(HTTPAdapter):
 
     auth_token = None
 
-    def __init__(self, session, auth_token=None, **kwargs):
+    def __init__(self, session, auth_token=None, request_headers=True, 
+                 **kwargs):
         self.session = session
         self.auth_token = auth_token
+        self.request_headers = request_headers
         super(StuboAdapter, self).__init__(**kwargs)
             
-    def get_stubo_headers(self, request):
-        parts = urlparse.urlsplit(request.url)
-        info = {
-          'Stubo-Request-URI'    : request.url,
-          'Stubo-Request-Host'   : parts.netloc,
-          'Stubo-Request-Method' : request.method, 
-          'Stubo-Request-Headers' : str(request.headers),
-        }
-        if parts.path:
-            info["Stubo-Request-Path"] = parts.path 
-        if parts.query:
-            info["Stubo-Request-Query"] = parts.query          
-        return info      
-            
-        
     def send(self, request, **kwargs):
         """
         Sends a PreparedRequest object.
 
         :param request: The Requests :class:`PreparedRequest <PreparedRequest>` object to send.
         """
-        headers = self.get_stubo_headers(request)
+        metrics = self.session.stubo.metrics
+        if metrics is None:
+            return self._send(request, **kwargs)
+        start = time.time()
+        try:
+            return self._send(request, **kwargs)
+        finally:
+            self.measure_call(metrics, start)
+            
+    def _send(self, request, **kwargs):
+        if self.session.mode != 'record' and self.session.matcher is not None:
+            match = self.session.match(request)
+            if match is not None or self.session.is_local():
+                return self.play_offline(request, match)
+        parts = urlparse.urlsplit(request.url)
+        cache, cache_key = None, None
         if self.session.mode == 'record':
-            self.session.record_request(request, headers)                                 
+            # only the host is needed to record
+            self.session.record_request(request, 
+                                        {'Stubo-Request-Host': parts.netloc})
         else:
-            request.headers.update(headers)
-            request.url = self.proxify(request.url) 
+            cache = self.session.stubo.response_cache
+            if cache is not None:
+                cache_key = cache.key(self.session.session_name, 
+                                      request.method, request.url, 
+                                      request.body)
+                cached = cache.get(cache_key)
+                if cached is not None:
+                    resp = cached.to_response(request)
+                    resp.connection = self
+                    return resp
+            request.headers.update(self.get_stubo_headers(request, parts))
+            request.url = self.proxify(request.url, parts) 
             if self.auth_token:
                 # just basic auth at the moment
                 HTTPBasicAuth(self.auth_token[0], self.auth_token[1])(request)
                          
-        return super(StuboAdapter, self).send(request, **kwargs)
+        try:
+            resp = super(StuboAdapter, self).send(request, **kwargs)
+        except Exception:
+            if self.session.mode == 'record':
+                self.session.discard_request(request)
+            raise
+        if cache_key is not None and resp.status_code == 200:
+            cache.put(cache_key, CachedResponse.from_response(resp))
+        return resp
 
 
+    def play_offline(self, request, match):
+        """
+        Answers a request from the session's stub matcher.
+
+        :param request: The Requests :class:`PreparedRequest <PreparedRequest>` object sent.
+        :param match: The (status, body) matched for the request or None.
+        """
+        status, headers, body = self.offline_response(match)
+        resp = CachedResponse(status, httplib.responses.get(status), headers,
+                              body).to_response(request)
+        resp.connection = self
+        return resp    
+
     def build_response(self, request, response):
         """
-        Builds a Response object from a urllib3 response. 
+        Builds a Response object from a urllib3 response. In 'record' mode 
+        the body is recorded as the application reads it.
 
         :param request: The Requests :class:`PreparedRequest <PreparedRequest>` object sent.
         :param response: The urllib3 response.
         """
         resp = super(StuboAdapter, self).build_response(request, response)
+        metrics = self.session.stubo.metrics
+        if metrics is not None and 'Content-Length' in resp.headers:
+            metrics.incr('session.{0}.{1}.response_bytes'.format(
+                self.session.session_name, self.session.mode),
+                int(resp.headers['Content-Length']))
         if self.session.mode == 'record':
-            self.session.record_response(resp)    
+            call = self.session.record_response_headers(resp, request)
+            resp.raw = self.session.tee_response(resp.raw, call)
         return resp
 
-    def proxify(self, original_url):
-        """
-        Take a raw url string and turn it into a valid Stubo get/response URL.
-        
-        Before:
-            http://foo.example.com/path
-        After:
-            http://<stubo_host>/stubo/api/get/response
-        """
-        parts = urlparse.urlsplit(original_url)
-        new_host = self.session.stubo.dc
-        if parts.username or parts.password:
-            new_host = "{0}:{1}@{2}".format(parts.username, parts.password,
-                                            new_host)
-        return urlparse.urlunsplit((parts.scheme, new_host, 
-            'stubo/api/get/response', 
-            'session={0}'.format(self.session.session_name), 
-            ''))
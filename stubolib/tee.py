@@ -0,0 +1,105 @@
+"""
+tee.py
+~~~~~~~~~~
+
+Records response bodies as the application reads them.
+
+In record mode the raw urllib3 response of each call is wrapped in a 
+:class:`TeeRawResponse <TeeRawResponse>` which copies every chunk read 
+into a :class:`BodyRecorder <BodyRecorder>`, so ``stream=True`` responses 
+are not loaded into memory up front. The call is finished when the body 
+is exhausted, the response is closed or the session stops; unread data is 
+drained then so the recording is complete.
+"""
+import tempfile
+import threading
+
+class BodyRecorder(object):
+    """Collects body chunks in memory, moving to a temporary file once 
+    ``threshold`` bytes have been written.
+    """
+    
+    def __init__(self, threshold=None, dir=None):
+        self.threshold = threshold
+        self.dir = dir
+        self.size = 0
+        self._chunks = []
+        self._file = None
+        
+    def write(self, chunk):
+        if not chunk:
+            return
+        self.size += len(chunk)
+        if self._file is not None:
+            self._file.write(chunk)
+            return
+        self._chunks.append(chunk)
+        if self.threshold is not None and self.size >= self.threshold:
+            self._file = tempfile.TemporaryFile(prefix='stubo-body-',
+                                                dir=self.dir)
+            for buffered in self._chunks:
+                self._file.write(buffered)
+            self._chunks = []
+            
+    def finish(self, spool=None):
+        """Returns the body, a SpooledBody if it was moved to a file."""
+        if self._file is None:
+            return ''.join(self._chunks)
+        try:
+            self._file.seek(0)
+            if spool is not None:
+                return spool.spool_file(self._file)
+            return self._file.read()
+        finally:
+            self._file.close()
+            self._file = None
+            
+
+class TeeRawResponse(object):
+    """Wraps a urllib3 response, copying what is read to a recorder and 
+    calling ``on_complete(recorder)`` once when the body is done.
+    """
+    
+    def __init__(self, raw, recorder, on_complete):
+        self._raw = raw
+        self._recorder = recorder
+        self._on_complete = on_complete
+        self._done = False
+        self._lock = threading.Lock()
+        
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+    
+    def _complete(self):
+        with self._lock:
+            if self._done:
+                return
+            self._done = True
+        self._on_complete(self._recorder)
+        
+    def stream(self, amt=2**16, decode_content=None):
+        for chunk in self._raw.stream(amt, decode_content=decode_content):
+            self._recorder.write(chunk)
+            yield chunk
+        self._complete()
+        
+    def read(self, amt=None, decode_content=None, **kwargs):
+        data = self._raw.read(amt, decode_content=decode_content, **kwargs)
+        self._recorder.write(data)
+        if amt is None or not data:
+            self._complete()
+        return data
+    
+    def _drain(self):
+        if not self._done:
+            for _ in self.stream(decode_content=True):
+                pass
+            self._complete()
+    
+    def release_conn(self):
+        self._drain()
+        return self._raw.release_conn()
+    
+    def close(self):
+        self._drain()
+        return self._raw.close()
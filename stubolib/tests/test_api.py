@@ -1,5 +1,6 @@
 import unittest
 import mock
+from urllib import urlencode
 from stubolib.testing import DummyModel
 
 class TestStubo(unittest.TestCase):
@@ -58,6 +59,298 @@ class TestStubo(unittest.TestCase):
         with self.assertRaises(StuboError):
             response = stubo.get_response(session='bar', data='hello') 
             print 'response=', response 
+            
+    def test_reuses_http_session(self):
+        stubo = self._get_stubo()
+        stubo.get_status()
+        http_session = stubo.get_http_session()
+        stubo.get_status(scenario='first')
+        self.assertTrue(stubo.get_http_session() is http_session)
+        self.assertEqual(self.requests.sessions_created, 1)
+        
+    def test_close(self):
+        stubo = self._get_stubo()
+        stubo.get_status()
+        stubo.close()
+        self.assertEqual(self.requests.sessions_closed, 1)
+        stubo.get_status()
+        self.assertEqual(self.requests.sessions_created, 2)
+        
+    def test_context_manager(self):
+        with self._get_stubo() as stubo:
+            stubo.get_status()
+        self.assertEqual(self.requests.sessions_closed, 1)    
+        
+    def test_share_pool(self):
+        stubo1 = self._get_stubo(share_pool=True)
+        stubo2 = self._get_stubo(share_pool=True)
+        stubo3 = self._get_stubo(dc='www.stubo.com', share_pool=True)
+        self.assertTrue(stubo1.get_http_session() is 
+                        stubo2.get_http_session())
+        self.assertFalse(stubo1.get_http_session() is 
+                         stubo3.get_http_session())
+        stubo1.close()
+        self.assertEqual(self.requests.sessions_closed, 0)
+        stubo2.close()
+        stubo3.close()
+        self.assertEqual(self.requests.sessions_closed, 2)     
+
+    def test_http_session_created_once(self):
+        import threading
+        import time
+        create = self.requests.Session
+        def slow_session():
+            time.sleep(0.01)
+            return create()
+        self.requests.Session = slow_session
+        stubo = self._get_stubo(share_pool=True)
+        threads = [threading.Thread(target=stubo.get_http_session) for _ in 
+                   range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.requests.sessions_created, 1)
+        stubo.close()
+        self.assertEqual(self.requests.sessions_closed, 1)
+
+    def test_method_is_cached(self):
+        from stubolib.api import Stubo
+        stubo = self._get_stubo()
+        method = stubo.get_status
+        self.assertTrue(Stubo.__dict__['get_status'] is method.__func__)
+        self.assertTrue(stubo.get_status.__func__ is method.__func__)
+        
+    def test_called_stubo_is_not_in_a_cycle(self):
+        import gc
+        import weakref
+        stubo = self._get_stubo()
+        stubo.get_status()
+        ref = weakref.ref(stubo)
+        gc.disable()
+        try:
+            del stubo
+            self.assertEqual(ref(), None)
+        finally:
+            gc.enable()
+        
+    def test_url(self):
+        stubo = self._get_stubo()
+        self.assertEqual(stubo._url('get_status', {}), 
+                         'http://localhost:8001/stubo/api/get/status')
+        for params in ({'scenario': 'a b&c=d/e'}, {'force': True}, 
+                       {'x': ['1', '2']}, {'a': '1', 'b': '2'}, 
+                       {'session': u'caf\xe9'}):
+            self.assertEqual(stubo._url('get_status', params), 
+                'http://localhost:8001/stubo/api/get/status?' + 
+                urlencode(params, True))
+            
+    def test_url_follows_dc(self):
+        stubo = self._get_stubo()
+        stubo.get_status()
+        stubo.dc = 'www.stubo.com'
+        stubo.ssl = True
+        stubo.get_status()
+        self.assertEqual([url for url, _ in self.requests.posts], [
+            'http://localhost:8001/stubo/api/get/status',
+            'https://www.stubo.com/stubo/api/get/status'])    
+    
+    def test_metrics(self):
+        from stubolib.api import StuboError
+        from stubolib.metrics import Metrics, MemorySink
+        sink = MemorySink()
+        stubo = self._get_stubo(metrics=Metrics(sink))
+        stubo.get_status()
+        with self.assertRaises(StuboError):
+            stubo.get_response(session='foo', data='hello')
+        snapshot = sink.snapshot()
+        self.assertEqual(snapshot['counters']['api.errors.400'], 1)
+        self.assertTrue(snapshot['counters']['api.get_status.response_bytes'] 
+                        > 0)
+        self.assertEqual(snapshot['timings']['api.get_status.latency']
+                         ['count'], 1)
+        self.assertEqual(snapshot['timings']['api.get_response.latency']
+                         ['count'], 1)
+        
+    def test_get_response_cache(self):
+        stubo = self._get_stubo(cache_size=10)
+        response = stubo.get_response(session='baz', data='hello')
+        self.assertEqual(response.content, 'hello')
+        response = stubo.get_response(session='baz', data='hello')
+        self.assertEqual(response.content, 'hello')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.requests.posts), 1)
+        stubo.get_response(session='baz', data='world')
+        self.assertEqual(len(self.requests.posts), 2)
+        self.assertEqual(stubo.response_cache.stats(), dict(hits=1, misses=2,
+                         evictions=0, size=2))
+        
+    def test_get_response_cache_invalidation(self):
+        stubo = self._get_stubo(cache_size=10)
+        stubo.get_response(session='baz', data='hello')
+        stubo.end_session(session='baz')
+        self.assertEqual(len(stubo.response_cache), 0)
+        stubo.get_response(session='baz', data='hello')
+        stubo.delete_stubs(scenario='first')
+        self.assertEqual(len(stubo.response_cache), 0)
+        
+    def test_get_response_errors_not_cached(self):
+        from stubolib.api import StuboError
+        stubo = self._get_stubo(cache_size=10)
+        with self.assertRaises(StuboError):
+            stubo.get_response(session='bar', data='hello')
+        self.assertEqual(len(stubo.response_cache), 0)    
+        
+    def _netlocs(self):
+        import urlparse
+        return [urlparse.urlsplit(url).netloc for url, _ in 
+                self.requests.posts]
+        
+    def test_round_robin(self):
+        stubo = self._get_stubo(dc=['s1:8001', 's2:8001', 's3:8001'])
+        for _ in range(6):
+            stubo.get_status()
+        self.assertEqual(self._netlocs(), ['s1:8001', 's2:8001', 's3:8001'] 
+                         * 2)
+        
+    def test_session_affinity(self):
+        stubo = self._get_stubo(dc=['s1:8001', 's2:8001'])
+        stubo.get_status()
+        stubo.begin_session(session='baz', scenario='first', mode='playback')
+        for _ in range(3):
+            stubo.get_response(session='baz', data='hello')
+        stubo.end_session(session='baz')
+        self.assertEqual(self._netlocs(), ['s1:8001'] + ['s2:8001'] * 5)
+        self.assertEqual(stubo.server_for('baz'), 's1:8001')
+        
+    def test_failover(self):
+        stubo = self._get_stubo(dc=['s1:8001', 's2:8001'])
+        self.requests.down.add('s1:8001')
+        stubo.get_status()
+        stubo.get_status()
+        self.assertEqual(self._netlocs(), ['s2:8001', 's2:8001'])
+        self.assertEqual(stubo.balancer.down, set(['s1:8001']))
+        
+    def test_failover_retries_down_server(self):
+        stubo = self._get_stubo(dc=['s1:8001', 's2:8001'], health_retry=10)
+        self.requests.down.add('s1:8001')
+        stubo.get_status()
+        self.requests.down.clear()
+        stubo.get_status()
+        stubo.get_status()
+        self.assertEqual(self._netlocs(), ['s2:8001'] * 3)
+        # a trial call after health_retry brings the server back
+        stubo.balancer._down_since['s1:8001'] -= 10
+        for _ in range(4):
+            stubo.get_status()
+        self.assertEqual(stubo.balancer.down, set())
+        self.assertEqual(self._netlocs()[3], 's1:8001')
+        self.assertEqual(sorted(set(self._netlocs()[4:])), ['s1:8001', 
+                                                             's2:8001'])
+        
+    def test_failover_keeps_session(self):
+        from requests.exceptions import ConnectionError
+        stubo = self._get_stubo(dc=['s1:8001', 's2:8001'])
+        stubo.begin_session(session='baz', scenario='first', mode='playback')
+        self.requests.down.add('s1:8001')
+        with self.assertRaises(ConnectionError):
+            stubo.get_response(session='baz', data='hello')
+        
+    def test_health_check(self):
+        stubo = self._get_stubo(dc=['s1:8001', 's2:8001'])
+        self.requests.down.add('s2:8001')
+        stubo.balancer.check_health()
+        self.assertEqual(stubo.balancer.down, set(['s2:8001']))
+        self.requests.down.clear()
+        stubo.balancer.check_health()
+        self.assertEqual(stubo.balancer.down, set())
+        
+    def test_health_check_status(self):
+        stubo = self._get_stubo(dc=['s1:8001'])
+        self.requests.responses = dict(self.requests.responses)
+        self.requests.responses['/stubo/api/get/status'] = (
+            '{"data": {"cache_server": {"status": "bad"}}}', 200)
+        self.assertFalse(stubo.check_server('s1:8001'))
+
+    def test_timeouts(self):
+        stubo = self._get_stubo(connect_timeout=1, read_timeout=5)
+        self.assertEqual(stubo.defaults['timeout'], (1, 5))
+        
+    def test_circuit_breaker(self):
+        from requests.exceptions import ConnectionError
+        from stubolib.api import CircuitOpenError
+        stubo = self._get_stubo(breaker_failures=2, breaker_reset=10)
+        self.requests.down.add('localhost:8001')
+        for _ in range(2):
+            with self.assertRaises(ConnectionError):
+                stubo.get_status()
+        with self.assertRaises(CircuitOpenError):
+            stubo.get_status()
+        self.assertEqual(len(self.requests.posts), 0)
+        # half open after the reset timeout, probed with get/status
+        breaker = stubo.get_breaker('localhost:8001')
+        breaker.opened_at -= 10
+        self.requests.down.clear()
+        stubo.get_status()
+        self.assertEqual(breaker.state, 'closed')
+        self.assertEqual(len(self.requests.posts), 2)
+        
+    def test_circuit_breaker_ignores_client_errors(self):
+        from stubolib.api import StuboError
+        stubo = self._get_stubo(breaker_failures=1)
+        with self.assertRaises(StuboError):
+            stubo.get_response(session='bar', data='hello')
+        self.assertEqual(stubo.get_breaker('localhost:8001').state, 'closed')
+        
+    def test_circuit_open_fails_over(self):
+        stubo = self._get_stubo(dc=['s1:8001', 's2:8001'], 
+                                breaker_failures=1, breaker_reset=60)
+        stubo.get_breaker('s1:8001').failed()
+        stubo.get_status()
+        stubo.get_status()
+        self.assertEqual(self._netlocs(), ['s2:8001', 's2:8001'])
+
+    def test_compress_put_stub(self):
+        import zlib
+        import json
+        stubo = self._get_stubo(compress_threshold=100)
+        payload = {'request': 'x' * 200}
+        stubo.put_stub(session='first_1', json=payload)
+        url, data = self.requests.posts[-1]
+        self.assertEqual(json.loads(zlib.decompress(data, 16 + zlib.MAX_WBITS)),
+                         payload)
+        self.assertEqual(self.requests.options[-1]['headers'], {
+            'Content-Encoding': 'gzip', 
+            'Content-Type': 'application/json'})
+        
+    def test_compress_threshold(self):
+        stubo = self._get_stubo(compress_threshold=100)
+        stubo.put_stub(session='first_1', json={'request': 'small'})
+        stubo.exec_cmds(cmdfile='first.commands', data='small')
+        stubo.get_response(session='baz', data='y' * 200)
+        self.assertEqual([data for _, data in self.requests.posts], 
+                         ['{"request":"small"}', 'small', 'y' * 200])
+        self.assertEqual(self.requests.options, [
+            {'headers': {'Content-Type': 'application/json'}}, {}, {}])
+
+    def test_put_stub_data(self):
+        from stubolib.stub import StubData
+        stubo = self._get_stubo()
+        stub = StubData('hello', 'goodbye')
+        stubo.put_stub(session='first_1', json=stub)
+        url, data = self.requests.posts[-1]
+        self.assertTrue(data is not None and data == stub.to_json())
+        self.assertEqual(self.requests.options[-1]['headers'], 
+                         {'Content-Type': 'application/json'})
+
+    def test_json_decoded_once(self):
+        from stubolib.codec import JSONResponse, json_response
+        from requests.models import Response
+        response = Response()
+        response._content = '{"data": {"a": 1}}'
+        self.assertTrue(type(json_response(response)) is JSONResponse)
+        self.assertEqual(response.json(), {'data': {'a': 1}})
+        self.assertTrue(response.json() is response.json())
              
         
 class DummyRequests(object):
@@ -72,6 +365,7 @@ class DummyRequests(object):
          '/stubo/api/get/response?session=foo' : ("""
          {"version": "5.6.4", "error" : {"code" : 400, "message" : "session not found - localhost:foo"} }
          """, 400),   
+        '/stubo/api/get/response?session=baz' : ("hello", 200),
         '/stubo/api/get/response?session=bar' : ("""
          {"version": "5.6.4", "error" : {"code" : 400, "message" : "E017:No matching response found"} }
          """, 400),                 
@@ -79,15 +373,26 @@ class DummyRequests(object):
     
     def __init__(self):
         self.posts = []
+        self.sessions_created = 0
+        self.sessions_closed = 0
+        self.down = set()
+        self.options = []
+        
+    def Session(self):
+        self.sessions_created += 1
+        return DummySession(self)
     
     def get(self, url):
         return self.post(url, method='GET')     
     
-    def post(self, url, data=None, json=None, method='POST'):
+    def post(self, url, data=None, json=None, method='POST', **kwargs):
         import urlparse
         import json
         parts = urlparse.urlparse(url)
-        response = DummyModel(headers={}, content="")
+        if parts.netloc in self.down:
+            from requests.exceptions import ConnectionError
+            raise ConnectionError(parts.netloc)
+        response = DummyModel(headers={}, content="", reason="")
         response.headers["Content-Type"] = 'application/json; charset=UTF-8'
         response.headers["X-Stubo-Version"] = '5.6.4'
         response.json = lambda: json.loads(response.content) 
@@ -101,4 +406,20 @@ class DummyRequests(object):
             response.headers["Content-Type"] = 'text/plain'
             response.content = 'HTTP 404: Not Found'
         self.posts.append((url, data))    
-        return response 
\ No newline at end of file
+        self.options.append(kwargs)
+        return response
+    
+
+class DummySession(object):
+    
+    def __init__(self, requests):
+        self.requests = requests
+        
+    def mount(self, prefix, adapter):
+        pass    
+    
+    def post(self, url, **kwargs):
+        return self.requests.post(url, **kwargs)
+    
+    def close(self):
+        self.requests.sessions_closed += 1
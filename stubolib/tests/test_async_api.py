@@ -0,0 +1,115 @@
+import unittest
+import json
+
+try:
+    from tornado.testing import AsyncHTTPTestCase, gen_test
+    from tornado.web import Application, RequestHandler
+except ImportError:
+    AsyncHTTPTestCase = unittest.TestCase
+    gen_test = lambda f: f
+    Application = RequestHandler = object
+    
+class DummyStuboHandler(RequestHandler):
+    
+    responses = 0
+    
+    def post(self, method):
+        self.set_header('X-Stubo-Version', '5.6.4')
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        if method == 'get/status':
+            self.write(dict(version='5.6.4', data=dict(
+                args=dict((k, self.get_argument(k)) for k in 
+                          self.request.arguments))))
+        elif method == 'get/fail':
+            self.set_status(503)
+            self.write(dict(version='5.6.4', error=dict(code=503, 
+                            message='database unavailable')))
+        elif method == 'get/response' and \
+            self.get_argument('session') == 'first_1':
+            DummyStuboHandler.responses += 1
+            self.set_header('Content-Type', 'text/plain')
+            self.write('response {0}'.format(DummyStuboHandler.responses))
+        elif method == 'end/session':
+            self.write(dict(version='5.6.4', data={}))
+        elif method == 'put/stub':
+            self.write(dict(version='5.6.4', data=json.loads(
+                                                    self.request.body)))
+        else:
+            self.set_status(400)
+            self.write(dict(version='5.6.4', error=dict(code=400, 
+                            message='E017:No matching response found')))    
+    
+@unittest.skipIf(AsyncHTTPTestCase is unittest.TestCase, 
+                 'tornado is not installed')
+class TestAsyncStubo(AsyncHTTPTestCase):
+    
+    def get_app(self):
+        return Application([(r'/stubo/api/(.*)', DummyStuboHandler)])
+    
+    def _get_stubo(self, **kwargs):
+        from stubolib.async_api import AsyncStubo
+        dc = kwargs.pop('dc', 'localhost:{0}'.format(self.get_http_port()))
+        stubo = AsyncStubo(dc, use_curl=False, **kwargs)
+        self.addCleanup(stubo.close)
+        return stubo
+    
+    @gen_test
+    def test_method_with_arg(self):
+        stubo = self._get_stubo()
+        response = yield stubo.get_status(scenario='first')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data'], 
+                         {'args': {'scenario': 'first'}})
+        
+    @gen_test
+    def test_json(self):
+        stubo = self._get_stubo()
+        response = yield stubo.put_stub(session='first_1', json={'a': 1})
+        self.assertEqual(response.json()['data'], {'a': 1})
+    
+    @gen_test
+    def test_stubo_error(self):
+        from stubolib.api import StuboError
+        stubo = self._get_stubo()
+        with self.assertRaises(StuboError):
+            yield stubo.get_response(session='foo', data='hello')
+            
+    @gen_test
+    def test_concurrent(self):
+        stubo = self._get_stubo(max_clients=5)
+        responses = yield [stubo.get_status(scenario=str(i)) for i in 
+                           range(20)]
+        self.assertEqual([r.json()['data']['args']['scenario'] for r in 
+                          responses], [str(i) for i in range(20)])
+        
+    @gen_test
+    def test_circuit_breaker(self):
+        from stubolib.api import StuboError, CircuitOpenError
+        stubo = self._get_stubo(breaker_failures=2, breaker_reset=60)
+        for _ in range(2):
+            with self.assertRaises(StuboError) as cm:
+                yield stubo.get_fail()
+            self.assertFalse(isinstance(cm.exception, CircuitOpenError))
+        with self.assertRaises(CircuitOpenError):
+            yield stubo.get_status()
+            
+    @gen_test
+    def test_response_cache(self):
+        stubo = self._get_stubo(cache_size=10)
+        first = yield stubo.get_response(session='first_1', data='hello')
+        again = yield stubo.get_response(session='first_1', data='hello')
+        self.assertEqual(again.content, first.content)
+        yield stubo.end_session(session='first_1')
+        after_end = yield stubo.get_response(session='first_1', 
+                                             data='hello')
+        self.assertNotEqual(after_end.content, first.content)
+        
+    @gen_test
+    def test_least_outstanding(self):
+        port = self.get_http_port()
+        servers = ['localhost:{0}'.format(port), '127.0.0.1:{0}'.format(port)]
+        stubo = self._get_stubo(dc=servers, balance='least_outstanding')
+        futures = [stubo.get_status(scenario=str(i)) for i in range(4)]
+        self.assertEqual(sorted(stubo.balancer.outstanding.values()), [2, 2])
+        yield futures
+        self.assertEqual(sorted(stubo.balancer.outstanding.values()), [0, 0])
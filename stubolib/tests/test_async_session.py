@@ -0,0 +1,147 @@
+import unittest
+import json
+
+try:
+    from tornado.testing import AsyncHTTPTestCase, gen_test
+    from tornado.web import Application, RequestHandler
+except ImportError:
+    AsyncHTTPTestCase = unittest.TestCase
+    gen_test = lambda f: f
+    Application = RequestHandler = object
+    
+
+class EchoHandler(RequestHandler):
+    
+    def post(self):
+        self.write(self.request.body.upper())
+        
+
+class DummyStuboHandler(RequestHandler):
+    
+    def initialize(self, stubo):
+        self.stubo = stubo
+    
+    def post(self, method):
+        self.stubo.calls.append((method, dict((k, self.get_argument(k)) for 
+                                              k in self.request.arguments)))
+        self.set_header('X-Stubo-Version', '5.6.4')
+        if method == 'put/stub':
+            self.stubo.stubs.append(json.loads(self.request.body))
+        elif method == 'get/response':
+            for stub in self.stubo.stubs:
+                if stub['request']['bodyPatterns'][0]['contains'][0] == \
+                    self.request.body:
+                    self.write(stub['response']['body'])
+                    return
+            self.set_status(400)
+            self.set_header('Content-Type', 
+                            'application/json; charset=UTF-8')
+            self.write(dict(version='5.6.4', error=dict(code=400, 
+                            message='E017:No matching response found')))
+        else:
+            self.write(dict(version='5.6.4', data={}))    
+            
+        
+class DummyStubo(object):
+    
+    def __init__(self):
+        self.calls = []
+        self.stubs = []            
+
+    
+@unittest.skipIf(AsyncHTTPTestCase is unittest.TestCase, 
+                 'tornado is not installed')
+class TestAsyncSession(AsyncHTTPTestCase):
+    
+    def get_app(self):
+        self.stubo = DummyStubo()
+        return Application([(r'/echo', EchoHandler),
+                            (r'/stubo/api/(.*)', DummyStuboHandler, 
+                             dict(stubo=self.stubo))])
+    
+    def _get_session(self, **kwargs):
+        from stubolib.async_session import AsyncSession
+        session = AsyncSession('localhost:{0}'.format(self.get_http_port()), 
+                               'first', 'first_1', use_curl=False, **kwargs)
+        self.addCleanup(session.stubo.close)
+        return session
+    
+    @gen_test
+    def test_record_and_play(self):
+        session = self._get_session()
+        session.mode = 'record'
+        yield session.start()
+        try:
+            client = session.get_http_client()
+            responses = yield [client.fetch(self.get_url('/echo?a=b'), 
+                               method='POST', body=body) for body in 
+                               ('hello', 'world')]
+        finally:
+            yield session.stop()
+        self.assertEqual([r.body for r in responses], ['HELLO', 'WORLD'])
+        self.assertEqual(sorted(s['response']['body'] for s in 
+                                self.stubo.stubs), ['HELLO', 'WORLD'])
+        self.assertEqual([c for c in self.stubo.calls if c[0] == 'put/stub']
+            [0][1], dict(session='first_1', a='b'))
+        
+        session.mode = 'playback'
+        yield session.start()
+        try:
+            response = yield session.get_http_client().fetch(
+                self.get_url('/elsewhere'), method='POST', body='world')
+        finally:
+            yield session.stop()
+        self.assertEqual(response.body, 'WORLD')
+        self.assertEqual(self.stubo.calls[-1], ('end/session', dict(
+                         scenario='first', session='first_1', 
+                         mode='playback')))
+        
+    @gen_test
+    def test_play_offline(self):
+        from stubolib.stub import StubData
+        session = self._get_session(offline=True)
+        session.load_stubs([StubData('hello', 'HELLO')])
+        session.mode = 'playback'
+        yield session.start()
+        response = yield session.get_http_client().fetch(
+                self.get_url('/elsewhere'), method='POST', body='hello')
+        yield session.stop()
+        self.assertEqual(response.body, 'HELLO')
+        self.assertEqual(self.stubo.calls, [])
+        
+    @gen_test
+    def test_record_store_only(self):
+        import os
+        import shutil
+        import tempfile
+        from stubolib.store import RecordingStore
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'first.stubo')
+        session = self._get_session(store=path, store_only=True)
+        session.mode = 'record'
+        yield session.start()
+        try:
+            response = yield session.get_http_client().fetch(
+                self.get_url('/echo'), method='POST', body='hello')
+        finally:
+            yield session.stop()
+        self.assertEqual(response.body, 'HELLO')
+        with RecordingStore(path) as store:
+            self.assertEqual([r.stub.response_body() for r in store], 
+                             [['HELLO']])
+        self.assertEqual(self.stubo.calls, [])
+        
+    @gen_test
+    def test_begin_discovers_mode(self):
+        session = self._get_session()
+        yield session.record_or_play().begin()
+        try:
+            response = yield session.get_http_client().fetch(
+                self.get_url('/echo'), method='POST', body='hello')
+        finally:
+            yield session.stop()
+        self.assertEqual(session.mode, 'record')
+        self.assertEqual(response.body, 'HELLO')
+        self.assertEqual([s['response']['body'] for s in self.stubo.stubs],
+                         ['HELLO'])
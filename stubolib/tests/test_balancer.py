@@ -0,0 +1,68 @@
+import unittest
+import time
+
+class TestBalancer(unittest.TestCase):
+    
+    def _get_balancer(self, servers=('s1', 's2', 's3'), **kwargs):
+        from stubolib.balancer import Balancer
+        return Balancer(servers, **kwargs)
+    
+    def test_round_robin_skips_down(self):
+        balancer = self._get_balancer()
+        balancer.mark_down('s2')
+        self.assertEqual([balancer.choose() for _ in range(4)], 
+                         ['s1', 's3', 's1', 's3'])
+        balancer.mark_up('s2')
+        self.assertEqual(set(balancer.choose() for _ in range(3)), 
+                         set(['s1', 's2', 's3']))
+        
+    def test_retry_after(self):
+        now = [100]
+        balancer = self._get_balancer(retry_after=30, clock=lambda: now[0])
+        balancer.mark_down('s2')
+        now[0] += 29
+        self.assertFalse('s2' in [balancer.choose() for _ in range(4)])
+        now[0] += 1
+        # one trial call, the server stays down until it succeeds
+        self.assertEqual(balancer.choose(), 's2')
+        self.assertFalse('s2' in [balancer.choose() for _ in range(4)])
+        now[0] += 30
+        self.assertEqual(balancer.choose(), 's2')
+        balancer.mark_up('s2')
+        self.assertEqual(balancer.down, set())
+        
+    def test_all_down(self):
+        balancer = self._get_balancer()
+        for server in balancer.servers:
+            balancer.mark_down(server)
+        self.assertTrue(balancer.choose() in balancer.servers)
+        self.assertEqual(balancer.choose(exclude=['s1', 's2']), 's3')
+        
+    def test_least_outstanding(self):
+        balancer = self._get_balancer(policy='least_outstanding')
+        balancer.acquire('s1')
+        balancer.acquire('s1')
+        balancer.acquire('s2')
+        self.assertEqual(balancer.choose(), 's3')
+        balancer.acquire('s3')
+        balancer.acquire('s3')
+        self.assertEqual(balancer.choose(), 's2')
+        balancer.release('s1')
+        balancer.release('s1')
+        self.assertEqual(balancer.choose(), 's1')
+        
+    def test_bad_policy(self):
+        with self.assertRaises(ValueError):
+            self._get_balancer(policy='random')
+            
+    def test_periodic_health_check(self):
+        healthy = set(['s1'])
+        balancer = self._get_balancer(servers=['s1', 's2'],  
+                                      probe=lambda s: s in healthy,
+                                      health_interval=0.01)
+        balancer.choose()
+        deadline = time.time() + 5
+        while balancer.down != set(['s2']) and time.time() < deadline:
+            time.sleep(0.01)
+        balancer.stop()
+        self.assertEqual(balancer.down, set(['s2']))
@@ -0,0 +1,58 @@
+import unittest
+
+class TestCircuitBreaker(unittest.TestCase):
+    
+    def setUp(self):
+        self.now = 0
+        
+    def _get_breaker(self, **kwargs):
+        from stubolib.breaker import CircuitBreaker
+        return CircuitBreaker('s1', clock=lambda: self.now, **kwargs)
+    
+    def test_opens_after_consecutive_failures(self):
+        breaker = self._get_breaker(failure_threshold=3)
+        breaker.failed()
+        breaker.failed()
+        breaker.succeeded()
+        breaker.failed()
+        breaker.failed()
+        self.assertTrue(breaker.allow())
+        breaker.failed()
+        self.assertEqual(breaker.state, 'open')
+        self.assertFalse(breaker.allow())
+        
+    def test_slow_calls_fail(self):
+        breaker = self._get_breaker(failure_threshold=2, slow_call=1)
+        breaker.succeeded(0.5)
+        breaker.succeeded(2)
+        breaker.succeeded(3)
+        self.assertEqual(breaker.state, 'open')
+        
+    def test_half_open_trial_call(self):
+        breaker = self._get_breaker(failure_threshold=1, reset_timeout=10)
+        breaker.failed()
+        self.now = 5
+        self.assertFalse(breaker.allow())
+        self.now = 10
+        self.assertTrue(breaker.allow())
+        # only one trial at a time
+        self.assertFalse(breaker.allow())
+        breaker.failed()
+        self.assertEqual(breaker.state, 'open')
+        self.now = 20
+        self.assertTrue(breaker.allow())
+        breaker.succeeded()
+        self.assertEqual(breaker.state, 'closed')
+        
+    def test_half_open_probe(self):
+        healthy = []
+        breaker = self._get_breaker(failure_threshold=1, reset_timeout=10,
+                                    probe=lambda: bool(healthy))
+        breaker.failed()
+        self.now = 10
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.opened_at, 10)
+        healthy.append(True)
+        self.now = 20
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, 'closed')
@@ -0,0 +1,72 @@
+import unittest
+
+class TestResponseCache(unittest.TestCase):
+    
+    def setUp(self):
+        self.now = 1000.0
+    
+    def _get_cache(self, **kwargs):
+        from stubolib.cache import ResponseCache
+        return ResponseCache(clock=lambda: self.now, **kwargs)
+    
+    def test_key(self):
+        from stubolib.cache import ResponseCache
+        key = ResponseCache.key('first_1', 'POST', 'http://foo.com', 'hello')
+        self.assertEqual(key, ResponseCache.key('first_1', 'POST', 
+                                                'http://foo.com', u'hello'))
+        self.assertNotEqual(key, ResponseCache.key('first_2', 'POST', 
+                                                   'http://foo.com', 'hello'))
+        self.assertNotEqual(key, ResponseCache.key('first_1', 'GET', 
+                                                   'http://foo.com', 'hello'))
+        self.assertNotEqual(key, ResponseCache.key('first_1', 'POST', 
+                                                   'http://foo.com', None))
+    
+    def test_get_put(self):
+        cache = self._get_cache()
+        self.assertEqual(cache.get('a'), None)
+        cache.put('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.stats(), dict(hits=1, misses=1, evictions=0, 
+                                             size=1))
+        
+    def test_lru(self):
+        cache = self._get_cache(maxsize=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.evictions, 1)
+        
+    def test_ttl(self):
+        cache = self._get_cache(ttl=10)
+        cache.put('a', 1)
+        self.now += 9
+        self.assertEqual(cache.get('a'), 1)
+        self.now += 1
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(len(cache), 0)
+        
+    def test_invalidate(self):
+        cache = self._get_cache()
+        cache.put(('s1', 'x'), 1)
+        cache.put(('s2', 'x'), 2)
+        cache.invalidate('s1')
+        self.assertEqual(cache.get(('s1', 'x')), None)
+        self.assertEqual(cache.get(('s2', 'x')), 2)
+        cache.invalidate()
+        self.assertEqual(len(cache), 0)
+        
+    def test_cached_response(self):
+        from stubolib.cache import CachedResponse
+        cached = CachedResponse(200, 'OK', {'Content-Type': 
+            'text/plain; charset=utf-8'}, 'hello')
+        response = cached.to_response(url='http://foo.com')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['content-type'], 
+                         'text/plain; charset=utf-8')
+        self.assertEqual(response.text, u'hello')
+        self.assertEqual(response.url, 'http://foo.com')
+        self.assertEqual(CachedResponse.from_response(response), cached)
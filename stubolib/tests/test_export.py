@@ -0,0 +1,60 @@
+import unittest
+import os
+import shutil
+import tempfile
+from stubolib.testing import DummyModel
+
+class TestExport(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.gets = []
+        
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        
+    def _get_stubo(self, data):
+        files = {
+            'http://stubo/exports/first.json': 
+                '{"request": {"bodyPatterns": [{"contains": ["hello"]}]}, '
+                '"response": {"body": "HELLO", "status": 200}}',
+            'http://stubo/exports/first.commands': 'put/stub?session=x,a.json',
+        }
+        def get(url, **kwargs):
+            self.gets.append((url, kwargs.get('stream')))
+            body = files[url]
+            return DummyModel(content=body, 
+                raise_for_status=lambda: None, close=lambda: None,
+                iter_content=lambda size: (body[i:i + size] for i in 
+                                           range(0, len(body), size)))
+        export = DummyModel(json=lambda: dict(data=data))
+        return DummyModel(defaults={}, 
+                          get_export=lambda scenario: export,
+                          get_http_session=lambda: DummyHTTPSession(get))
+    
+    def test_export_stubs(self):
+        from stubolib.export import export_stubs
+        stubo = self._get_stubo(dict(links=[
+            ['first.json', 'http://stubo/exports/first.json'],
+            ['first.commands', 'http://stubo/exports/first.commands']]))
+        stubs = export_stubs(stubo, 'first')
+        self.assertEqual([s.contains_matchers() for s in stubs], [['hello']])
+        
+    def test_download_export(self):
+        from stubolib.export import download_export
+        stubo = self._get_stubo(dict(links=[
+            ['first.json', 'http://stubo/exports/first.json'],
+            ['../first.commands', 'http://stubo/exports/first.commands']]))
+        directory = os.path.join(self.tmpdir, 'first')
+        paths = download_export(stubo, 'first', directory, chunk_size=7)
+        self.assertEqual(paths, [os.path.join(directory, 'first.json'),
+                                 os.path.join(directory, 'first.commands')])
+        with open(paths[1]) as f:
+            self.assertEqual(f.read(), 'put/stub?session=x,a.json')
+        self.assertEqual([stream for _, stream in self.gets], [True, True])
+            
+
+class DummyHTTPSession(object):
+    
+    def __init__(self, get):
+        self.get = get
@@ -0,0 +1,107 @@
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import time
+import mock
+
+class TestLoadGenerator(unittest.TestCase):
+    
+    def _get_generator(self, stubo, **kwargs):
+        from stubolib.loadgen import LoadGenerator
+        return LoadGenerator(stubo, 'first_1', ['hello', 'bad', 'world'], 
+                             **kwargs)
+    
+    def test_requests(self):
+        stubo = DummyStubo()
+        result = self._get_generator(stubo, concurrency=4, requests=30).run()
+        self.assertEqual(len(stubo.bodies), 30)
+        self.assertEqual(sorted(set(stubo.bodies)), ['bad', 'hello', 'world'])
+        report = result.report()
+        self.assertEqual(report['calls'], 30)
+        self.assertEqual(report['errors'], 10)
+        self.assertEqual(report['errors_by_code'], {'400': 10})
+        self.assertAlmostEqual(report['error_rate'], 1 / 3.0)
+        for key in ('p50_ms', 'p90_ms', 'p95_ms', 'p99_ms', 'max_ms'):
+            self.assertTrue(report[key] >= 0)
+            
+    def test_rps(self):
+        stubo = DummyStubo()
+        result = self._get_generator(stubo, concurrency=2, rps=200, 
+                                     requests=21).run()
+        self.assertEqual(len(stubo.bodies), 21)
+        self.assertTrue(result.elapsed >= 0.1)
+        
+    def test_duration(self):
+        stubo = DummyStubo(delay=0.01)
+        result = self._get_generator(stubo, duration=0.05).run()
+        self.assertTrue(0 < len(stubo.bodies) <= 6)
+        self.assertTrue(result.elapsed < 1)
+        
+    def test_no_bodies(self):
+        from stubolib.loadgen import LoadGenerator
+        with self.assertRaises(ValueError):
+            LoadGenerator(DummyStubo(), 'first_1', [], requests=1)
+            
+    def test_request_bodies(self):
+        from stubolib.loadgen import request_bodies
+        from stubolib.stub import StubData
+        stub = StubData('a', 'A')
+        stub.set_contains_matchers(['x', 'y'])
+        self.assertEqual(request_bodies([StubData('hello', 'H'), stub]),
+                         ['hello', 'xy'])
+        
+        
+class TestMain(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        
+    def test_main_from_store(self):
+        from stubolib.loadgen import main
+        from stubolib.store import RecordingStore
+        from stubolib.stub import StubData
+        path = os.path.join(self.tmpdir, 'first.stubo')
+        with RecordingStore(path, mode='a') as store:
+            store.append(StubData('hello', 'HELLO'))
+        stubo = DummyStubo()
+        with mock.patch('stubolib.loadgen.Stubo', lambda *a, **kw: stubo):
+            with mock.patch('sys.stdout'):
+                status = main(['--scenario', 'first', '--store', path, 
+                               '--session', 'first_1', '-n', '5', '--json'])
+        self.assertEqual(status, 0)
+        self.assertEqual(stubo.bodies, ['hello'] * 5)
+        self.assertEqual([name for name, _ in stubo.calls], 
+                         ['begin_session', 'end_session'])
+        
+        
+class DummyStubo(object):
+    
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.bodies = []
+        self.calls = []
+        self.lock = threading.Lock()
+        
+    def get_response(self, session, data):
+        from stubolib.api import StuboError
+        if self.delay:
+            time.sleep(self.delay)
+        with self.lock:
+            self.bodies.append(data)
+        if data == 'bad':
+            raise StuboError(400, 'E017:No matching response found')
+        return data.upper()
+    
+    def begin_session(self, **kwargs):
+        self.calls.append(('begin_session', kwargs))
+        
+    def end_session(self, **kwargs):
+        self.calls.append(('end_session', kwargs))
+        
+    def close(self):
+        pass
@@ -0,0 +1,103 @@
+import unittest
+import threading
+from stubolib.testing import DummyModel
+
+class TestSessionManager(unittest.TestCase):
+    
+    def _get_manager(self, statuses=None, **kwargs):
+        from stubolib.manager import SessionManager
+        manager = SessionManager('localhost:8001', **kwargs)
+        manager.stubo = DummyStubo(statuses or {})
+        return manager
+    
+    def test_sessions_share_stubo(self):
+        manager = self._get_manager()
+        first = manager.session('first', 'first_1')
+        second = manager.session('first', 'first_2')
+        self.assertTrue(first.stubo is manager.stubo)
+        self.assertTrue(second.stubo is manager.stubo)
+        self.assertEqual(manager.sessions, [first, second])
+        
+    def test_resolve_modes_once_per_scenario(self):
+        manager = self._get_manager({'first': [['first_1', 'dormant']],
+                                     'second': []})
+        sessions = [manager.session('first', 'first_1'),
+                    manager.session('first', 'first_2'),
+                    manager.session('second', 'second_1'),
+                    manager.session('second', 'second_2', mode='playback')]
+        manager.resolve_modes()
+        self.assertEqual([s.mode for s in sessions], 
+                         ['playback', 'record', 'record', 'playback'])
+        self.assertEqual(sorted(args['scenario'] for name, args in 
+                                manager.stubo.calls if name == 'get_status'),
+                         ['first', 'second'])
+        
+    def test_resolve_modes_active_session(self):
+        from stubolib.api import StuboError
+        manager = self._get_manager({'first': [['first_1', 'playback']]})
+        manager.session('first', 'first_1')
+        with self.assertRaises(StuboError):
+            manager.resolve_modes()
+        
+    def test_start_and_stop(self):
+        manager = self._get_manager({'first': []}, concurrency=4)
+        sessions = [manager.session('first', 'first_{0}'.format(i), 
+                                    mode='playback') for i in range(10)]
+        with manager:
+            manager.start()
+            self.assertTrue(all(s.started_ok for s in sessions))
+        begun = [args['session'] for name, args in manager.stubo.calls if 
+                 name == 'begin_session']
+        ended = [args['session'] for name, args in manager.stubo.calls if 
+                 name == 'end_session']
+        names = ['first_{0}'.format(i) for i in range(10)]
+        self.assertEqual(sorted(begun), sorted(names))
+        self.assertEqual(sorted(ended), sorted(names))
+        self.assertEqual(manager.stubo.closed, 1)
+        
+    def test_start_failures(self):
+        from stubolib.manager import SessionError
+        manager = self._get_manager()
+        manager.stubo.fail = set(['first_2'])
+        for i in range(3):
+            manager.session('first', 'first_{0}'.format(i), mode='playback')
+        with self.assertRaises(SessionError) as cm:
+            manager.start()
+        self.assertEqual([n for n, _ in cm.exception.failures], ['first_2'])
+        
+    def test_cached_requests_session(self):
+        manager = self._get_manager()
+        session = manager.session('first', 'first_1')
+        self.assertTrue(session.get_requests_session() is 
+                        session.get_requests_session())
+        
+        
+class DummyStubo(object):
+    
+    metrics = None
+    response_cache = None
+    
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.calls = []
+        self.fail = set()
+        self.closed = 0
+        self.lock = threading.Lock()
+        
+    def get_auth(self):
+        return None
+    
+    def close(self):
+        self.closed += 1
+        
+    def _call(self, name, kwargs):
+        from stubolib.api import StuboError
+        with self.lock:
+            self.calls.append((name, kwargs))
+        if kwargs.get('session') in self.fail:
+            raise StuboError(500, 'failed')
+        data = dict(sessions=self.statuses.get(kwargs.get('scenario'), []))
+        return DummyModel(json=lambda: dict(data=data))
+        
+    def __getattr__(self, name):
+        return lambda **kwargs: self._call(name, kwargs)
@@ -0,0 +1,77 @@
+import unittest
+
+class TestAhoCorasick(unittest.TestCase):
+    
+    def _get_index(self, *patterns):
+        from stubolib.matcher import AhoCorasick
+        index = AhoCorasick()
+        ids = [index.add(p) for p in patterns]
+        return index, ids
+    
+    def test_search(self):
+        index, ids = self._get_index('he', 'she', 'his', 'hers')
+        self.assertEqual(index.search('ushers'), set([ids[0], ids[1], ids[3]]))
+        self.assertEqual(index.search('ahis'), set([ids[2]]))
+        self.assertEqual(index.search('xyz'), set())
+        
+    def test_duplicate_pattern(self):
+        index, ids = self._get_index('abc', 'abc')
+        self.assertEqual(ids[0], ids[1])
+        self.assertEqual(len(index), 1)
+        
+    def test_unicode(self):
+        index, ids = self._get_index(u'caf\xe9')
+        self.assertEqual(index.search(u'un caf\xe9'), set(ids))
+        self.assertEqual(index.search(u'un caf\xe9'.encode('utf-8')), 
+                         set(ids))
+        
+    def test_add_after_search(self):
+        index, ids = self._get_index('abc')
+        self.assertEqual(index.search('xabcd'), set(ids))
+        cd = index.add('bcd')
+        self.assertEqual(index.search('xabcd'), set(ids + [cd]))
+        
+
+class TestStubMatcher(unittest.TestCase):
+    
+    def _stub(self, matchers, response, method='POST'):
+        from stubolib.stub import StubData
+        stub = StubData(None, response, method)
+        stub.set_contains_matchers(matchers)
+        return stub
+    
+    def _get_matcher(self, stubs):
+        from stubolib.matcher import StubMatcher
+        return StubMatcher(stubs)
+    
+    def test_all_matchers_required(self):
+        stub = self._stub(['<a>', '<b>'], 'ab')
+        matcher = self._get_matcher([stub])
+        self.assertTrue(matcher.find('<b><a>') is stub)
+        self.assertEqual(matcher.find('<a>'), None)
+        
+    def test_most_matchers_wins(self):
+        one = self._stub(['<a>'], 'a')
+        two = self._stub(['<a>', '<b>'], 'ab')
+        matcher = self._get_matcher([one, two])
+        self.assertTrue(matcher.find('<a><b>') is two)
+        self.assertTrue(matcher.find('<a>') is one)
+        
+    def test_method(self):
+        get = self._stub(['x'], 'get', method='GET')
+        post = self._stub(['x'], 'post')
+        matcher = self._get_matcher([get, post])
+        self.assertTrue(matcher.find('x', 'get') is get)
+        self.assertTrue(matcher.find('x', 'POST') is post)
+        self.assertEqual(matcher.find('x', 'PUT'), None)
+        
+    def test_empty_matcher(self):
+        stub = self._stub([''], 'any')
+        matcher = self._get_matcher([stub])
+        self.assertTrue(matcher.find(None) is stub)
+        
+    def test_next_response(self):
+        stub = self._stub(['x'], ['one', 'two'])
+        matcher = self._get_matcher([stub])
+        self.assertEqual([matcher.next_response(stub) for _ in range(3)],
+                         ['one', 'two', 'two'])
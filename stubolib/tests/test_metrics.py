@@ -0,0 +1,61 @@
+import unittest
+import logging
+
+class TestMemorySink(unittest.TestCase):
+    
+    def _get_sink(self):
+        from stubolib.metrics import MemorySink
+        return MemorySink()
+    
+    def test_counters(self):
+        sink = self._get_sink()
+        sink.incr('a')
+        sink.incr('a', 4)
+        self.assertEqual(sink.snapshot()['counters'], {'a': 5})
+        sink.reset()
+        self.assertEqual(sink.snapshot(), dict(counters={}, timings={}))
+        
+    def test_timings(self):
+        sink = self._get_sink()
+        for seconds in (0.0005, 0.003, 0.003, 20):
+            sink.timing('t', seconds)
+        timing = sink.snapshot()['timings']['t']
+        self.assertEqual(timing['count'], 4)
+        self.assertEqual(timing['min_ms'], 0.5)
+        self.assertEqual(timing['max_ms'], 20000)
+        self.assertEqual(timing['buckets']['le_1'], 1)
+        self.assertEqual(timing['buckets']['le_5'], 2)
+        self.assertEqual(timing['buckets']['inf'], 1)
+        
+
+class TestStatsdSink(unittest.TestCase):
+    
+    def test_lines(self):
+        from stubolib.metrics import StatsdSink
+        sink = StatsdSink(prefix='ci')
+        self.addCleanup(sink.close)
+        lines = []
+        sink.send = lines.append
+        sink.incr('api.get_status.response_bytes', 10)
+        sink.timing('api.get_status.latency', 0.0125)
+        self.assertEqual(lines, ['ci.api.get_status.response_bytes:10|c',
+                                 'ci.api.get_status.latency:12.500|ms'])
+        
+
+class TestMetrics(unittest.TestCase):
+    
+    def test_sinks(self):
+        from stubolib.metrics import Metrics, MemorySink, LoggingSink
+        memory = MemorySink()
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger('stubolib.tests.metrics')
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        metrics = Metrics(memory, LoggingSink(logger))
+        metrics.incr('a')
+        metrics.timing('b', 0.001)
+        self.assertEqual(memory.snapshot()['counters'], {'a': 1})
+        self.assertEqual([r.getMessage() for r in records], 
+                         ['a +1', 'b 1.000ms'])
@@ -0,0 +1,222 @@
+import unittest
+import os
+import json
+import shutil
+import tempfile
+import threading
+import mock
+from stubolib.testing import DummyModel
+
+class TestExportScenarios(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_export_scenarios(self):
+        from stubolib.migrate import export_scenarios
+        from stubolib.store import RecordingStore
+        stubo = DummyStubo(exports=dict(first=['hello', 'world'],
+                                        second=['bye']))
+        directory = os.path.join(self.tmpdir, 'out')
+        results = export_scenarios(stubo, ['first', 'second'], directory,
+                                   concurrency=2)
+        self.assertEqual([(r.scenario, r.stubs) for r in results],
+                         [('first', 2), ('second', 1)])
+        self.assertTrue(results[0].bytes > 0)
+        self.assertEqual(sorted(os.listdir(directory)), ['first.stubo',
+            'first.stubo.idx', 'second.stubo', 'second.stubo.idx'])
+        with RecordingStore(os.path.join(directory, 'first.stubo')) as store:
+            self.assertEqual([(r.call_number, r.stub.contains_matchers())
+                              for r in store], [(0, ['hello']),
+                                                (1, ['world'])])
+            self.assertEqual(store[0].query_args, dict(delay_policy='slow'))
+
+    def test_export_then_import(self):
+        from stubolib.migrate import export_scenarios, import_scenario
+        stubo = DummyStubo(exports=dict(first=['hello', 'world']))
+        export_scenarios(stubo, ['first'], self.tmpdir)
+        import_scenario(stubo, os.path.join(self.tmpdir, 'first.stubo'))
+        self.assertEqual(sorted(stubo.puts), ['hello', 'world'])
+        self.assertEqual(stubo.put_args, set([('first_import', 'slow')]))
+
+    def test_export_failure(self):
+        from stubolib.migrate import export_scenarios, ExportError
+        stubo = DummyStubo(exports=dict(first=['hello']))
+        with self.assertRaises(ExportError) as e:
+            export_scenarios(stubo, ['first', 'missing'], self.tmpdir)
+        self.assertEqual([n for n, _ in e.exception.failures], ['missing'])
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ['first.stubo',
+                                                           'first.stubo.idx'])
+
+
+class TestImportScenario(unittest.TestCase):
+
+    def setUp(self):
+        from stubolib.store import RecordingStore
+        from stubolib.stub import StubData
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'first.stubo')
+        with RecordingStore(self.path, mode='a') as store:
+            for i in range(10):
+                store.append(StubData('req{0}'.format(i), 'res'),
+                             query_args=dict(delay_policy='slow'),
+                             call_number=i)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_import(self):
+        from stubolib.migrate import import_scenario
+        stubo = DummyStubo()
+        stats = import_scenario(stubo, self.path, concurrency=3)
+        self.assertEqual(stats.scenario, 'first')
+        self.assertEqual(stats.stubs, 10)
+        self.assertEqual(sorted(stubo.puts), ['req{0}'.format(i) for i in
+                                              range(10)])
+        self.assertEqual(stubo.put_args, set([('first_import', 'slow')]))
+        self.assertEqual([name for name, _ in stubo.calls],
+                         ['delete_stubs', 'begin_session', 'end_session'])
+        self.assertFalse(os.path.exists(self.path + '.checkpoint'))
+
+    def test_resume(self):
+        from stubolib.migrate import import_scenario
+        from stubolib.uploader import UploadError
+        stubo = DummyStubo(fail=set(['req3', 'req7']))
+        with self.assertRaises(UploadError) as e:
+            import_scenario(stubo, self.path, concurrency=2,
+                            checkpoint_every=1)
+        self.assertEqual([n for n, _ in e.exception.failures], [3, 7])
+        with open(self.path + '.checkpoint') as f:
+            saved = json.load(f)
+        self.assertEqual((saved['done'], saved['extra']),
+                         (3, [4, 5, 6, 8, 9]))
+
+        stubo.fail.clear()
+        stubo.status = 'record'
+        stubo.puts = []
+        stats = import_scenario(stubo, self.path, concurrency=2)
+        self.assertEqual(sorted(stubo.puts), ['req3', 'req7'])
+        self.assertEqual((stats.stubs, stats.skipped), (2, 8))
+        self.assertEqual([name for name, _ in stubo.calls],
+                         ['delete_stubs', 'begin_session', 'get_status',
+                          'end_session'])
+        self.assertFalse(os.path.exists(self.path + '.checkpoint'))
+
+    def test_checkpoint_saved_after_each_stub(self):
+        from stubolib.migrate import import_scenario
+        stubo = DummyStubo()
+        saved = []
+        def on_put(body):
+            if body == 'req6':
+                with open(self.path + '.checkpoint') as f:
+                    saved.append(json.load(f)['done'])
+        stubo.on_put = on_put
+        import_scenario(stubo, self.path, concurrency=1)
+        self.assertEqual(saved, [6])
+
+    def test_resume_ended_session(self):
+        from stubolib.migrate import import_scenario, Checkpoint
+        checkpoint = Checkpoint(self.path + '.checkpoint', 'first',
+                                'first_import')
+        for position in range(4):
+            checkpoint.mark(position)
+        checkpoint.save()
+        stubo = DummyStubo(status='dormant')
+        stats = import_scenario(stubo, self.path)
+        self.assertEqual((stats.stubs, stats.skipped), (6, 4))
+        self.assertEqual([name for name, _ in stubo.calls],
+                         ['get_status', 'begin_session', 'end_session'])
+
+    def test_checkpoint_of_other_session(self):
+        from stubolib.migrate import Checkpoint
+        checkpoint = Checkpoint(self.path + '.checkpoint', 'first',
+                                'first_import')
+        checkpoint.mark(1)
+        checkpoint.mark(0)
+        checkpoint.save()
+        self.assertEqual(len(Checkpoint.load(checkpoint.path, 'first',
+                                             'first_import')), 2)
+        self.assertFalse(Checkpoint.load(checkpoint.path, 'first',
+                                         'other').started)
+
+    def test_main_import(self):
+        from stubolib.migrate import main
+        stubo = DummyStubo()
+        with mock.patch('stubolib.migrate.Stubo', lambda *a, **kw: stubo):
+            with mock.patch('sys.stdout'):
+                status = main(['import', '--keep-stubs', '-c', '2',
+                               self.path])
+        self.assertEqual(status, 0)
+        self.assertEqual(len(stubo.puts), 10)
+        self.assertEqual([name for name, _ in stubo.calls],
+                         ['begin_session', 'end_session'])
+
+    def test_main_connection_error(self):
+        from requests.exceptions import ConnectionError
+        from stubolib.migrate import main
+        stubo = DummyStubo()
+        stubo.begin_session = mock.Mock(side_effect=ConnectionError('down'))
+        with mock.patch('stubolib.migrate.Stubo', lambda *a, **kw: stubo):
+            with mock.patch('sys.stderr') as stderr:
+                status = main(['import', self.path])
+        self.assertEqual(status, 1)
+        self.assertTrue('run the import again' in ''.join(
+            str(c) for c in stderr.mock_calls))
+
+
+class DummyStubo(object):
+
+    def __init__(self, exports=None, fail=None, status='notfound'):
+        self.exports = exports or {}
+        self.fail = fail or set()
+        self.status = status
+        self.defaults = {}
+        self.puts = []
+        self.put_args = set()
+        self.calls = []
+        self.lock = threading.Lock()
+        self.on_put = lambda body: None
+
+    def get_export(self, scenario):
+        from stubolib.api import StuboError
+        if scenario not in self.exports:
+            raise StuboError(400, 'scenario not found')
+        stubs = [{'request': {'bodyPatterns': [{'contains': [body]}]},
+                  'response': {'body': body.upper(), 'status': 200},
+                  'args': {'delay_policy': 'slow', 'session': 'old_1'}}
+                 for body in self.exports[scenario]]
+        return DummyModel(json=lambda: dict(data=dict(stubs=stubs)))
+
+    def get_http_session(self):
+        return None
+
+    def put_stub(self, session, json, **kwargs):
+        from stubolib.api import StuboError
+        body = json.contains_matchers()[0]
+        self.on_put(body)
+        if body in self.fail:
+            raise StuboError(500, 'put failed')
+        with self.lock:
+            self.puts.append(body)
+            self.put_args.add((session, kwargs.get('delay_policy')))
+
+    def get_status(self, **kwargs):
+        self.calls.append(('get_status', kwargs))
+        status = self.status
+        return DummyModel(json=lambda: dict(data=dict(
+            session=dict(status=status) if status != 'notfound' else {})))
+
+    def delete_stubs(self, **kwargs):
+        self.calls.append(('delete_stubs', kwargs))
+
+    def begin_session(self, **kwargs):
+        self.calls.append(('begin_session', kwargs))
+
+    def end_session(self, **kwargs):
+        self.calls.append(('end_session', kwargs))
+
+    def close(self):
+        pass
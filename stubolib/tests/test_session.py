@@ -0,0 +1,297 @@
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from stubolib.testing import DummyModel
+
+class TestSession(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'recording.stubo')
+        
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        
+    def _get_session(self, **kwargs):
+        from stubolib.session import Session
+        return Session('localhost:8001', 'first', 'first_1', **kwargs)
+    
+    def _call(self, session, body):
+        request = DummyModel(method='POST', url='http://foo.com/x?a=b', 
+                             body=body, headers={})
+        session.record_request(request, {'Stubo-Request-Host': 'foo.com'})
+        session.record_response(DummyModel(status_code=200, reason='OK', 
+                                           headers={}, 
+                                           content=body.upper()))
+        
+    def test_record_store_only(self):
+        from stubolib.store import RecordingStore
+        session = self._get_session(store=self.path, store_only=True)
+        with session.record():
+            self._call(session, 'hello')
+            self._call(session, 'world')
+        self.assertEqual(session._calls, [])    
+        with RecordingStore(self.path) as store:
+            self.assertEqual([r.stub.response_body() for r in store],
+                             [['HELLO'], ['WORLD']])
+            self.assertEqual(store[1].call_number, 1)
+            self.assertEqual(store[1].query_args, {'a': ['b']})
+
+    def test_record_twice_replaces_store(self):
+        from stubolib.store import RecordingStore
+        session = self._get_session(store=self.path, store_only=True)
+        with session.record():
+            self._call(session, 'hello')
+        with session.record():
+            self._call(session, 'world')
+        with RecordingStore(self.path) as store:
+            self.assertEqual([(r.call_number, r.stub.response_body()) for 
+                              r in store], [(0, ['WORLD'])])
+        session = self._get_session(store=self.path, store_only=True,
+                                    delete_stubs=False)
+        with session.record():
+            self._call(session, 'again')
+        with RecordingStore(self.path) as store:
+            self.assertEqual(len(store), 2)
+
+    def test_stop_closes_own_stubo(self):
+        from stubolib.api import Stubo
+        session = self._get_session(store=self.path, store_only=True)
+        with session.record():
+            session.stubo.get_http_session()
+        self.assertEqual(session.stubo._http_session, None)
+        stubo = Stubo('localhost:8001')
+        self.addCleanup(stubo.close)
+        session = self._get_session(store=self.path, store_only=True, 
+                                    stubo=stubo)
+        with session.record():
+            http_session = stubo.get_http_session()
+        self.assertTrue(stubo.get_http_session() is http_session)
+
+    def test_play_offline(self):
+        from stubolib.store import RecordingStore
+        from stubolib.stub import StubData
+        with RecordingStore(self.path, mode='a') as store:
+            store.append(StubData('hello', 'HELLO'))
+            store.append(StubData('world', 'WORLD'))
+        session = self._get_session(store=self.path, offline=True)
+        with session.play():
+            http = session.get_requests_session()
+            response = http.post('http://foo.com/x', data='say world')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, 'WORLD')
+            response = http.post('http://foo.com/x', data='nothing')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()['error']['code'], 400)
+
+    def test_play_offline_reloads_stubs(self):
+        from stubolib.store import RecordingStore
+        from stubolib.stub import StubData
+        with RecordingStore(self.path, mode='a') as store:
+            store.append(StubData('hello', 'HELLO V1'))
+        session = self._get_session(store=self.path, offline=True)
+        with session.play():
+            response = session.get_requests_session().post(
+                'http://foo.com/x', data='hello')
+            self.assertEqual(response.content, 'HELLO V1')
+        # recorded again
+        os.remove(self.path)
+        os.remove(self.path + '.idx')
+        with RecordingStore(self.path, mode='a') as store:
+            store.append(StubData('hello', 'HELLO V2'))
+        with session.play():
+            response = session.get_requests_session().post(
+                'http://foo.com/x', data='hello')
+            self.assertEqual(response.content, 'HELLO V2')
+        
+    def test_play_loaded_stubs(self):
+        from stubolib.stub import StubData
+        session = self._get_session(offline=True)
+        session.load_stubs([StubData('hello', ['ONE', 'TWO'])])
+        for _ in range(2):
+            with session.play():
+                response = session.get_requests_session().post(
+                    'http://foo.com/x', data='hello')
+                self.assertEqual(response.content, 'ONE')
+
+    def test_play_preload(self):
+        from stubolib.session import Session
+        from stubolib.store import RecordingStore
+        from stubolib.stub import StubData
+        with RecordingStore(self.path, mode='a') as store:
+            store.append(StubData('hello', 'HELLO'))
+        # the echo server stands in for stubo
+        dc = self._serve(EchoHandler).split('/')[2]
+        session = Session(dc, 'first', 'first_1', store=self.path)
+        with session.play(preload=True):
+            http = session.get_requests_session()
+            response = http.post('http://foo.com/x', data='say hello')
+            self.assertEqual(response.content, 'HELLO')
+            self.assertEqual(response.headers['X-Stubo-Version'], 'offline')
+            response = http.post('http://foo.com/x', data='a miss')
+            self.assertEqual(response.content, 'A MISS')
+            self.assertEqual(response.url, 'http://{0}/stubo/api/get/'
+                             'response?session=first_1'.format(dc))
+        self.assertEqual(len(session.matcher), 1)
+
+    def test_play_preload_one_run(self):
+        from stubolib.session import Session
+        from stubolib.store import RecordingStore
+        from stubolib.stub import StubData
+        with RecordingStore(self.path, mode='a') as store:
+            store.append(StubData('hello', 'STALE'))
+            exit_stub = StubData('exit', 'FROM MEMORY')
+            exit_stub.set_module(dict(name='exit', system_date='2015-01-01'))
+            store.append(exit_stub)
+        dc = self._serve(EchoHandler).split('/')[2]
+        session = Session(dc, 'first', 'first_1', store=self.path)
+        with session.play(preload=True):
+            http = session.get_requests_session()
+            self.assertEqual(http.post('http://foo.com/x', 
+                                       data='hello').content, 'STALE')
+            # played by stubo to run the user exit
+            self.assertEqual(http.post('http://foo.com/x', 
+                                       data='exit').content, 'EXIT')
+        with session.play():
+            self.assertEqual(session.matcher, None)
+            response = session.get_requests_session().post(
+                'http://foo.com/x', data='hello')
+            self.assertEqual(response.content, 'HELLO')
+
+    def test_record_dedupe(self):
+        session = self._get_session(dedupe=True, dedupe_hits=True, 
+                                    spool_threshold=10, spool_dir=self.tmpdir)
+        session.mode = 'record'
+        session._start_local()
+        for body in ('poll', 'hello', 'poll', 'a large request body', 'poll',
+                     'a large request body'):
+            self._call(session, body)
+        self.assertEqual([c.request_body for c in session._calls], 
+                         ['poll', 'hello', 'a large request body'])
+        self.assertEqual([session.make_stub(c).hits() for c in 
+                          session._calls], [3, 1, 2])
+        
+    def test_record_dedupe_keeps_distinct_responses(self):
+        session = self._get_session(dedupe=True)
+        session.mode = 'record'
+        session._start_local()
+        self._call(session, 'hello')
+        request = DummyModel(method='POST', url='http://foo.com/x?a=b', 
+                             body='hello', headers={})
+        session.record_request(request, {'Stubo-Request-Host': 'foo.com'})
+        session.record_response(DummyModel(status_code=200, reason='OK', 
+                                           headers={}, content='BYE'))
+        self.assertEqual(len(session._calls), 2)
+        self.assertFalse('hits' in session.make_stub(session._calls[0]).payload)
+
+    def test_record_spools_large_bodies(self):
+        from stubolib.spool import SpooledBody
+        session = self._get_session(spool_threshold=10, spool_dir=self.tmpdir)
+        session.mode = 'record'
+        session._start_local()
+        self._call(session, 'hi')
+        self._call(session, 'a large request body')
+        self.assertFalse(isinstance(session._calls[0]._response_body, 
+                                    SpooledBody))
+        self.assertTrue(isinstance(session._calls[1]._response_body, 
+                                   SpooledBody))
+        self.assertEqual(session._calls[1].response_body, 
+                         'A LARGE REQUEST BODY')
+        self.assertEqual(session.make_stub(session._calls[1]).response_body(),
+                         ['A LARGE REQUEST BODY'])
+
+    def _serve(self, handler):
+        server = ThreadingHTTPServer(('localhost', 0), handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return 'http://localhost:{0}/'.format(server.server_port)
+        
+    def test_record_streamed_response(self):
+        from stubolib.store import RecordingStore
+        url = self._serve(BigBodyHandler)
+        session = self._get_session(store=self.path, store_only=True,
+                                    spool_threshold=1024)
+        with session.record():
+            http = session.get_requests_session()
+            response = http.post(url, data='one')
+            self.assertEqual(len(response.content), BigBodyHandler.size)
+            response = http.post(url, data='two', stream=True)
+            chunks = list(response.iter_content(4096))
+            self.assertEqual(len(''.join(chunks)), BigBodyHandler.size)
+            response = http.post(url, data='three', stream=True)
+            response.close()
+            # partly read and left open
+            response = http.post(url, data='four', stream=True)
+            next(response.iter_content(4096))
+        with RecordingStore(self.path) as store:
+            self.assertEqual([r.stub.contains_matchers() for r in store], 
+                             [['one'], ['two'], ['three'], ['four']])
+            self.assertEqual([len(r.stub.response_body()[0]) for r in store],
+                             [BigBodyHandler.size] * 4)
+            
+                             
+    def test_record_concurrent_calls(self):
+        url = self._serve(EchoHandler)
+        session = self._get_session()
+        session.mode = 'record'
+        session._start_local()
+        http = session.get_requests_session()
+        errors = []
+        def worker(n):
+            try:
+                for i in range(20):
+                    body = 'thread {0} call {1}'.format(n, i)
+                    http.post(url, data=body)
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=worker, args=(n,)) for n in 
+                   range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])    
+        self.assertEqual(len(session._calls), 160)
+        self.assertEqual(sorted(c.call_number for c in session._calls), 
+                         range(160))
+        for call in session._calls:
+            self.assertEqual(call.response_body, call.request_body.upper())
+            
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    
+    
+class EchoHandler(BaseHTTPRequestHandler):
+    
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).upper()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        
+    def log_message(self, *args):
+        pass
+                                    
+            
+class BigBodyHandler(BaseHTTPRequestHandler):
+    
+    size = 100000
+    
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Content-Length', str(self.size))
+        self.end_headers()
+        self.wfile.write('x' * self.size)
+        
+    def log_message(self, *args):
+        pass
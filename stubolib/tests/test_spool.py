@@ -0,0 +1,56 @@
+import unittest
+
+class TestBodySpool(unittest.TestCase):
+    
+    def _get_spool(self, threshold=10):
+        from stubolib.spool import BodySpool
+        spool = BodySpool(threshold)
+        self.addCleanup(spool.close)
+        return spool
+    
+    def test_small_bodies_kept(self):
+        spool = self._get_spool()
+        self.assertEqual(spool.spool('small'), 'small')
+        self.assertEqual(spool.spool(None), None)
+        self.assertEqual(spool.size, 0)
+        
+    def test_spool(self):
+        from stubolib.spool import unspool
+        spool = self._get_spool()
+        one = spool.spool('a' * 10)
+        two = spool.spool('b' * 25)
+        self.assertEqual(len(two), 25)
+        self.assertEqual(unspool(two), 'b' * 25)
+        self.assertEqual(unspool(one), 'a' * 10)
+        self.assertEqual(spool.size, 35)
+        self.assertEqual(list(two.iter_chunks(10)), ['b' * 10, 'b' * 10, 
+                                                     'b' * 5])
+        
+    def test_closed(self):
+        spool = self._get_spool()
+        body = spool.spool('a' * 10)
+        spool.close()
+        with self.assertRaises(IOError):
+            body.read()
+            
+
+class TestHTTPCall(unittest.TestCase):
+    
+    def test_spool_bodies(self):
+        from stubolib.session import HTTPCall
+        from stubolib.spool import BodySpool
+        spool = BodySpool(10)
+        call = HTTPCall('foo.com')
+        call.request_body = 'hello'
+        call.response_body = 'x' * 100
+        call.spool_bodies(spool)
+        self.assertEqual(call.request_body, 'hello')
+        self.assertEqual(call.response_body, 'x' * 100)
+        self.assertEqual(spool.size, 100)
+        spool.close()
+        
+    def test_slots(self):
+        from stubolib.session import HTTPCall
+        call = HTTPCall('foo.com')
+        with self.assertRaises(AttributeError):
+            call.foo = 1
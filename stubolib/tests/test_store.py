@@ -0,0 +1,89 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+class TestRecordingStore(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'recording.stubo')
+        
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)    
+        
+    def _get_store(self, mode='r'):
+        from stubolib.store import RecordingStore
+        return RecordingStore(self.path, mode=mode)
+    
+    def _stub(self, i):
+        from stubolib.stub import StubData
+        return StubData('req{0}'.format(i), 'resp{0}'.format(i))
+    
+    def _fill(self, n):
+        with self._get_store('a') as store:
+            for i in range(n):
+                store.append(self._stub(i), {'x': [str(i)]}, call_number=i)
+    
+    def test_append_and_read(self):
+        with self._get_store('a') as store:
+            self.assertEqual(store.append(self._stub(0), call_number=0), 0)
+            self.assertEqual(store.append(self._stub(1), {'x': ['y']}, 
+                                          call_number=1), 1)
+            self.assertEqual(len(store), 2)
+            record = store[1]
+            self.assertEqual(record.call_number, 1)
+            self.assertEqual(record.stub, self._stub(1))
+            self.assertEqual(record.query_args, {'x': ['y']})
+            # reads see later appends
+            store.append(self._stub(2))
+            self.assertEqual(store[2].stub, self._stub(2))
+            
+    def test_reopen(self):
+        self._fill(3)
+        with self._get_store() as store:
+            self.assertEqual([r.stub for r in store], 
+                             [self._stub(i) for i in range(3)])
+        with self._get_store('a') as store:
+            store.append(self._stub(3))
+            self.assertEqual(len(store), 4)    
+            
+    def test_clear(self):
+        self._fill(3)
+        with self._get_store('a') as store:
+            store[0]
+            store.clear()
+            self.assertEqual(len(store), 0)
+            store.append(self._stub(5), call_number=0)
+            self.assertEqual(store[0].stub, self._stub(5))
+        with self._get_store() as store:
+            self.assertEqual([r.stub for r in store], [self._stub(5)])
+            
+    def test_read_only(self):
+        self._fill(1)
+        with self._get_store() as store:
+            with self.assertRaises(IOError):
+                store.append(self._stub(1))
+                
+    def test_not_a_store(self):
+        with open(self.path, 'wb') as f:
+            f.write('hello')
+        with self.assertRaises(ValueError):
+            self._get_store()            
+            
+    def test_rebuilds_missing_index(self):
+        self._fill(3)
+        os.remove(self.path + '.idx')
+        with self._get_store() as store:
+            self.assertEqual(store[2].stub, self._stub(2))
+            
+    def test_drops_partial_record(self):
+        self._fill(2)
+        with open(self.path, 'ab') as f:
+            f.write('\x00\x00\x01\x00{"trunc')
+        with self._get_store('a') as store:
+            self.assertEqual(len(store), 2)
+            store.append(self._stub(2))
+        with self._get_store() as store:
+            self.assertEqual([r.stub for r in store], 
+                             [self._stub(i) for i in range(3)])
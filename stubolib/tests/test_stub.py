@@ -0,0 +1,57 @@
+import unittest
+import json
+
+class TestStubData(unittest.TestCase):
+    
+    def _get_stub(self, *args):
+        from stubolib.stub import StubData
+        return StubData(*(args or ('hello', 'goodbye')))
+    
+    def test_lazy_payload(self):
+        stub = self._get_stub('hello', 'goodbye', 'GET', 201)
+        self.assertEqual(stub.request_method(), 'GET')
+        self.assertEqual(stub.response_status(), 201)
+        self.assertEqual(stub.response_body(), ['goodbye'])
+        self.assertEqual(stub._payload, None)
+        self.assertEqual(stub.contains_matchers(), ['hello'])
+        self.assertEqual(stub.payload, {
+            'request': {'method': 'GET', 
+                        'bodyPatterns': [{'contains': ['hello']}]},
+            'response': {'status': 201, 'body': 'goodbye'}})
+        
+    def test_to_json_is_cached(self):
+        stub = self._get_stub()
+        encoded = stub.to_json()
+        self.assertTrue(stub.to_json() is encoded)
+        self.assertEqual(json.loads(encoded), stub.payload)
+        self.assertEqual(stub.space_used(), len(encoded))
+        
+    def test_setters_invalidate_json(self):
+        stub = self._get_stub()
+        for set_value, get in [
+            (lambda: stub.set_response_body('bye'), 
+             lambda p: p['response']['body']),
+            (lambda: stub.set_contains_matchers(['hi']), 
+             lambda p: p['request']['bodyPatterns'][0]['contains']),
+            (lambda: stub.set_delay_policy('slow'), 
+             lambda p: p['response']['delayPolicy']),
+            (lambda: stub.set_module({'name': 'exit'}), 
+             lambda p: p['module']),
+            (lambda: stub.set_recorded('2014-01-01'), 
+             lambda p: p['recorded'])]:
+            stub.to_json()
+            set_value()
+            self.assertEqual(get(json.loads(stub.to_json())), 
+                             get(stub.payload))
+            
+    def test_from_payload(self):
+        from stubolib.stub import StubData
+        stub = self._get_stub()
+        copy = StubData.from_payload(json.loads(stub.to_json()))
+        self.assertEqual(copy, stub)
+        self.assertEqual(copy.response_body(), ['goodbye'])
+        
+    def test_slots(self):
+        stub = self._get_stub()
+        with self.assertRaises(AttributeError):
+            stub.extra = 1
@@ -0,0 +1,76 @@
+import unittest
+import mock
+from stubolib.testing import DummyModel
+
+class TestStuboAdapter(unittest.TestCase):
+    
+    def _get_adapter(self, mode='playback', **kwargs):
+        from stubolib.stubo_adapter import StuboAdapter
+        self.session = DummyModel(mode=mode, session_name='first_1', 
+                                  matcher=None, 
+                                  stubo=DummyModel(dc='stubo:8001', 
+                                                   response_cache=None,
+                                                   metrics=None))
+        self.session.stubo.server_for = lambda session: 'stubo:8001'
+        return StuboAdapter(self.session, **kwargs)
+    
+    def _request(self, url='http://foo.com/path?a=b', method='POST'):
+        import requests
+        return requests.Request(method, url, data='hello', 
+                                headers={'X-Foo': 'bar'}).prepare()
+    
+    def test_proxify(self):
+        adapter = self._get_adapter()
+        self.assertEqual(adapter.proxify('http://foo.com/path?a=b'),
+            'http://stubo:8001/stubo/api/get/response?session=first_1')
+        self.assertEqual(adapter.proxify('https://u:p@foo.com/path'),
+            'https://u:p@stubo:8001/stubo/api/get/response?session=first_1')
+        
+    def test_proxify_follows_session(self):
+        adapter = self._get_adapter()
+        adapter.proxify('http://foo.com/path')
+        self.session.session_name = 'first_2'
+        self.assertEqual(adapter.proxify('http://foo.com/path'),
+            'http://stubo:8001/stubo/api/get/response?session=first_2')
+        
+    def test_stubo_headers(self):
+        adapter = self._get_adapter()
+        request = self._request()
+        headers = adapter.get_stubo_headers(request)
+        self.assertEqual(headers['Stubo-Request-Host'], 'foo.com')
+        self.assertEqual(headers['Stubo-Request-Path'], '/path')
+        self.assertEqual(headers['Stubo-Request-Query'], 'a=b')
+        self.assertTrue('X-Foo' in headers['Stubo-Request-Headers'])
+        
+    def test_stubo_headers_without_request_headers(self):
+        adapter = self._get_adapter(request_headers=False)
+        headers = adapter.get_stubo_headers(self._request())
+        self.assertFalse('Stubo-Request-Headers' in headers)
+        
+    def test_send_playback(self):
+        adapter = self._get_adapter()
+        request = self._request()
+        with mock.patch('requests.adapters.HTTPAdapter.send') as send:
+            send.return_value = DummyModel(status_code=200)
+            adapter.send(request)
+        sent = send.call_args[0][0]
+        self.assertEqual(sent.url, 
+            'http://stubo:8001/stubo/api/get/response?session=first_1')
+        self.assertEqual(sent.headers['Stubo-Request-URI'], 
+                         'http://foo.com/path?a=b')
+        self.assertEqual(sent.body, 'hello')
+
+    def test_send_metrics(self):
+        from stubolib.metrics import Metrics, MemorySink
+        sink = MemorySink()
+        adapter = self._get_adapter()
+        self.session.stubo.metrics = Metrics(sink)
+        with mock.patch('requests.adapters.HTTPAdapter.send') as send:
+            send.return_value = DummyModel(status_code=200)
+            adapter.send(self._request())
+            adapter.send(self._request())
+        snapshot = sink.snapshot()
+        self.assertEqual(snapshot['counters'], 
+                         {'session.first_1.playback.calls': 2})
+        self.assertEqual(snapshot['timings']
+            ['session.first_1.playback.latency']['count'], 2)
@@ -0,0 +1,101 @@
+import unittest
+
+class TestBodyRecorder(unittest.TestCase):
+    
+    def _get_recorder(self, threshold=None):
+        from stubolib.tee import BodyRecorder
+        return BodyRecorder(threshold)
+    
+    def test_memory(self):
+        recorder = self._get_recorder()
+        recorder.write('hello ')
+        recorder.write('world')
+        self.assertEqual(recorder.finish(), 'hello world')
+        
+    def test_file(self):
+        recorder = self._get_recorder(threshold=8)
+        for chunk in ('hello ', 'world', '!'):
+            recorder.write(chunk)
+        self.assertEqual(recorder.size, 12)    
+        self.assertEqual(recorder.finish(), 'hello world!')
+        
+    def test_file_to_spool(self):
+        from stubolib.spool import BodySpool, SpooledBody
+        recorder = self._get_recorder(threshold=8)
+        recorder.write('hello world')
+        with BodySpool(8) as spool:
+            body = recorder.finish(spool)
+            self.assertTrue(isinstance(body, SpooledBody))
+            self.assertEqual(body.read(), 'hello world')
+            
+
+class TestTeeRawResponse(unittest.TestCase):
+    
+    def setUp(self):
+        self.completed = []
+        
+    def _get_tee(self, chunks):
+        from stubolib.tee import TeeRawResponse, BodyRecorder
+        self.raw = DummyRaw(chunks)
+        return TeeRawResponse(self.raw, BodyRecorder(), 
+            lambda recorder: self.completed.append(recorder.finish()))
+    
+    def test_stream(self):
+        tee = self._get_tee(['ab', 'cd'])
+        self.assertEqual(list(tee.stream(2)), ['ab', 'cd'])
+        self.assertEqual(self.completed, ['abcd'])
+        tee.release_conn()
+        self.assertEqual(self.completed, ['abcd'])
+        self.assertTrue(self.raw.released)
+        
+    def test_read_all(self):
+        tee = self._get_tee(['ab', 'cd'])
+        self.assertEqual(tee.read(), 'abcd')
+        self.assertEqual(self.completed, ['abcd'])
+        
+    def test_read_chunks(self):
+        tee = self._get_tee(['ab', 'cd'])
+        self.assertEqual(tee.read(2), 'ab')
+        self.assertEqual(self.completed, [])
+        self.assertEqual(tee.read(2), 'cd')
+        self.assertEqual(tee.read(2), '')
+        self.assertEqual(self.completed, ['abcd'])
+        
+    def test_close_drains(self):
+        tee = self._get_tee(['ab', 'cd', 'ef'])
+        next(tee.stream(2))
+        tee.close()
+        self.assertEqual(self.completed, ['abcdef'])
+        
+    def test_delegates(self):
+        tee = self._get_tee([])
+        self.assertEqual(tee.status, 200)
+        
+
+class DummyRaw(object):
+    
+    status = 200
+    
+    def __init__(self, chunks):
+        self.data = ''.join(chunks)
+        self.pos = 0
+        self.released = False
+        
+    def read(self, amt=None, decode_content=None):
+        end = len(self.data) if amt is None else self.pos + amt
+        data = self.data[self.pos:end]
+        self.pos += len(data)
+        return data
+    
+    def stream(self, amt=2**16, decode_content=None):
+        while True:
+            data = self.read(amt)
+            if not data:
+                return
+            yield data
+            
+    def release_conn(self):
+        self.released = True
+    
+    def close(self):
+        pass
@@ -0,0 +1,148 @@
+import unittest
+import threading
+
+class TestStubUploader(unittest.TestCase):
+    
+    def _get_uploader(self, stubo, concurrency=1):
+        from stubolib.uploader import StubUploader
+        return StubUploader(stubo, 'first_1', concurrency=concurrency)
+    
+    def _stubs(self, n):
+        from stubolib.stub import StubData
+        return [(i, StubData('req{0}'.format(i), 'resp{0}'.format(i)), 
+                {'x': str(i)}) for i in range(n)]
+    
+    def test_upload(self):
+        stubo = DummyStubo()
+        responses = self._get_uploader(stubo).upload(self._stubs(3))
+        self.assertEqual(responses, ['resp0', 'resp1', 'resp2'])
+        self.assertEqual(stubo.puts[0], dict(session='first_1', x='0', 
+            json={'request': {'method': 'POST', 
+                              'bodyPatterns': [{'contains': ['req0']}]},
+                  'response': {'status': 200, 'body': 'resp0'}}))
+        
+    def test_upload_concurrent_keeps_order(self):
+        stubo = DummyStubo()
+        responses = self._get_uploader(stubo, concurrency=4).upload(
+                                                        self._stubs(20))
+        self.assertEqual(responses, ['resp{0}'.format(i) for i in range(20)])
+        self.assertEqual(len(stubo.puts), 20)
+        
+    def test_upload_concurrent_makes_stubs_lazily(self):
+        stubo = DummyStubo()
+        puts_before_make = []
+        def stubs():
+            for item in self._stubs(8):
+                puts_before_make.append(len(stubo.puts))
+                yield item
+        self._get_uploader(stubo, concurrency=2).upload(stubs())
+        self.assertEqual(len(stubo.puts), 8)
+        # at most 2 stubs are being put and 2 wait for a worker
+        for i, puts in enumerate(puts_before_make):
+            self.assertTrue(puts >= i - 4, puts_before_make)
+        
+    def test_upload_concurrent_keeps_order_of_same_request(self):
+        from stubolib.stub import StubData
+        stubo = DummyStubo(delay=True)
+        # polling the same two requests, stubo plays them back in put order
+        stubs = [(i, StubData('req{0}'.format(i % 2), 'resp{0}'.format(i)), 
+                  {}) for i in range(12)]
+        self._get_uploader(stubo, concurrency=4).upload(stubs)
+        for req in ('req0', 'req1'):
+            bodies = [int(p['json']['response']['body'][4:]) for p in 
+                      stubo.puts if p['json']['request']['bodyPatterns']
+                      [0]['contains'] == [req]]
+            self.assertEqual(bodies, sorted(bodies))
+            self.assertEqual(len(bodies), 6)
+        
+    def test_upload_errors(self):
+        from stubolib.uploader import UploadError
+        stubo = DummyStubo(fail=set(['req1', 'req3']))
+        with self.assertRaises(UploadError) as cm:
+            self._get_uploader(stubo, concurrency=2).upload(self._stubs(5))
+        self.assertEqual([n for n, _ in cm.exception.failures], [1, 3])    
+        self.assertEqual(len(stubo.puts), 5)
+        
+        
+class TestBackgroundUploader(unittest.TestCase):
+    
+    def _get_uploader(self, stubo, concurrency=1, **kwargs):
+        from stubolib.uploader import StubUploader, BackgroundUploader
+        return BackgroundUploader(StubUploader(stubo, 'first_1', 
+                                               concurrency=concurrency),
+                                  **kwargs)
+        
+    def _stub(self, i):
+        from stubolib.stub import StubData
+        return StubData('req{0}'.format(i), 'resp{0}'.format(i))
+    
+    def test_submit_and_join(self):
+        stubo = DummyStubo()
+        uploader = self._get_uploader(stubo, concurrency=3, maxsize=2)
+        for i in range(10):
+            self.assertTrue(uploader.submit(i, self._stub(i)))
+        uploader.join()
+        self.assertEqual(sorted(p['json']['response']['body'] for p in 
+                                stubo.puts), 
+                         sorted('resp{0}'.format(i) for i in range(10)))
+        
+    def test_join_raises_failures(self):
+        from stubolib.uploader import UploadError
+        stubo = DummyStubo(fail=set(['req2']))
+        uploader = self._get_uploader(stubo)
+        for i in range(4):
+            uploader.submit(i, self._stub(i))
+        with self.assertRaises(UploadError) as cm:
+            uploader.join()
+        self.assertEqual([n for n, _ in cm.exception.failures], [2])  
+        
+    def test_buffer_backpressure(self):
+        stubo = DummyStubo()
+        stubo.lock.acquire() # stall the worker
+        uploader = self._get_uploader(stubo, maxsize=1, backpressure='buffer')
+        results = [uploader.submit(i, self._stub(i)) for i in range(3)]
+        self.assertFalse(results[-1])
+        stubo.lock.release()
+        uploader.join()
+        
+    def test_buffer_backpressure_keeps_order(self):
+        from stubolib.stub import StubData
+        stubo = DummyStubo()
+        stubo.lock.acquire() # stall the worker
+        uploader = self._get_uploader(stubo, maxsize=1, backpressure='buffer')
+        results = [uploader.submit(i, StubData('req', 'resp{0}'.format(i))) 
+                   for i in range(3)]
+        stubo.lock.release()
+        # a refused request refuses the same request while there is room
+        self.assertEqual(results[-1], False)
+        self.assertFalse(uploader.submit(3, StubData('req', 'resp3')))
+        uploader.join()
+        
+    def test_bad_backpressure(self):
+        with self.assertRaises(ValueError):
+            self._get_uploader(DummyStubo(), backpressure='drop')
+        
+        
+class DummyStubo(object):
+    
+    def __init__(self, fail=None, delay=False):
+        self.puts = []
+        self.fail = fail or set()
+        self.delay = delay
+        self.lock = threading.Lock()
+        
+    def put_stub(self, **kwargs):
+        import json
+        import random
+        import time
+        from stubolib.api import StuboError
+        if self.delay:
+            time.sleep(random.random() / 500)
+        # the stub is sent as the json it encodes to
+        kwargs['json'] = json.loads(kwargs['json'].to_json())
+        with self.lock:
+            self.puts.append(kwargs)
+        payload = kwargs['json']
+        if payload['request']['bodyPatterns'][0]['contains'][0] in self.fail:
+            raise StuboError(400, 'bad stub')
+        return payload['response']['body']
@@ -0,0 +1,79 @@
+import unittest
+import threading
+
+class TestWorkers(unittest.TestCase):
+    
+    def test_map_concurrently_keeps_order(self):
+        from stubolib.workers import map_concurrently
+        self.assertEqual(map_concurrently(lambda x: x * 2, iter(range(20)), 
+                                          4), range(0, 40, 2))
+        
+    def test_map_concurrently_raises(self):
+        from stubolib.workers import map_concurrently
+        def func(x):
+            if x in (3, 5):
+                raise ValueError(x)
+            return x
+        with self.assertRaises(ValueError) as cm:
+            map_concurrently(func, range(8), 3)
+        self.assertEqual(cm.exception.args, (3,))
+        
+    def test_run_concurrently_failures(self):
+        from stubolib.workers import run_concurrently
+        done = []
+        lock = threading.Lock()
+        def func(x):
+            if x == 2:
+                raise ValueError(x)
+            with lock:
+                done.append(x)
+        failures = run_concurrently(func, range(5), 2)
+        self.assertEqual(sorted(done), [0, 1, 3, 4])
+        self.assertEqual([(item, e.args) for item, e in failures], 
+                         [(2, (2,))])
+        
+    def test_pool_submit_without_blocking(self):
+        from stubolib.workers import WorkerPool
+        release = threading.Event()
+        pool = WorkerPool(lambda x: release.wait(), concurrency=1, maxsize=1)
+        results = [pool.submit(i, block=False) for i in range(4)]
+        release.set()
+        pool.join()
+        # one item taken by the worker, one queued
+        self.assertTrue(results[:1] == [True] and results[-1] is False)
+        
+    def test_key_keeps_order(self):
+        import random
+        import time
+        from stubolib.workers import run_concurrently
+        done = []
+        def func(item):
+            time.sleep(random.random() / 500)
+            done.append(item)
+        run_concurrently(func, [(i % 3, i) for i in range(30)], 4, 
+                         key=lambda item: item[0])
+        for key in range(3):
+            self.assertEqual([i for k, i in done if k == key], 
+                             range(key, 30, 3))
+        
+    def test_free_workers_take_other_keys(self):
+        from stubolib.workers import WorkerPool
+        release = threading.Event()
+        done = []
+        others_done = threading.Event()
+        def func(item):
+            if item == 'a0':
+                release.wait()
+            done.append(item)
+            if len(done) == 6:
+                others_done.set()
+        pool = WorkerPool(func, concurrency=2, maxsize=4, 
+                          key=lambda item: item[0])
+        for item in ['a0', 'a1', 'b0', 'c0', 'd0', 'e0', 'f0', 'g0']:
+            pool.submit(item)
+        # one worker is stuck on a0, the other does the rest but a1
+        others_done.wait(5)
+        self.assertEqual(sorted(done), ['b0', 'c0', 'd0', 'e0', 'f0', 'g0'])
+        release.set()
+        pool.join()
+        self.assertEqual(done[-2:], ['a0', 'a1'])
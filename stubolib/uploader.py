@@ -0,0 +1,143 @@
+"""
+uploader.py
+~~~~~~~~~~
+
+Uploads recorded stubs to stubo with put/stub, optionally using a pool of 
+worker threads so that many stubs can be in flight at once, or in the 
+background while recording continues.
+
+Stubo plays the stubs recorded for the same request back in the order they
+were put, so stubs with the same matchers are always put one at a time in 
+call order, whatever the concurrency.
+"""
+import logging
+import threading
+from api import StuboError
+from workers import WorkerPool, map_concurrently
+
+log = logging.getLogger(__name__)
+
+def stub_key(item):
+    """Returns the matcher key of a (call_number, stub, query_args) 
+    item."""
+    return item[1].matcher_key()
+
+class UploadError(StuboError):
+    """Raised once all uploads have been attempted if any of them failed.
+    
+    ``failures`` is a list of (call_number, exception) tuples in call order.
+    """
+    def __init__(self, failures):
+        self.failures = failures
+        message = "{0} stub upload(s) failed: {1}".format(len(failures),
+            ', '.join('call {0}: {1}'.format(n, e) for n, e in failures))
+        super(UploadError, self).__init__(400, message)
+        
+
+class StubUploader(object):
+    """Puts stubs into a stubo session.
+
+    :param stubo: the :class:`Stubo <Stubo>` api client to use.
+    :param session_name: the stubo session to put the stubs in.
+    :param concurrency: number of concurrent put/stub calls, 1 uploads in 
+                        the calling thread.
+    """
+    
+    def __init__(self, stubo, session_name, concurrency=1):
+        self.stubo = stubo
+        self.session_name = session_name
+        self.concurrency = max(1, concurrency)
+        
+    def put(self, stub, query_args=None):
+        """Puts a single stub, returns the response."""
+        return self.stubo.put_stub(session=self.session_name, 
+                                   json=stub, **(query_args or {}))
+        
+    def _put(self, item):
+        call_number, stub, query_args = item
+        try:
+            return call_number, self.put(stub, query_args), None
+        except Exception as e:
+            log.warn('put/stub failed for call {0}: {1}'.format(call_number, 
+                                                                  e))
+            return call_number, None, e   
+        
+    def upload(self, stubs):
+        """Puts (call_number, stub, query_args) items, returns the responses
+        in the order given.
+        
+        :raises UploadError: after all stubs are tried if any failed.
+        """
+        if self.concurrency == 1:
+            results = map(self._put, stubs)
+        else:
+            # stubs are made as workers become free, not all up front
+            results = map_concurrently(self._put, stubs, self.concurrency,
+                                       key=stub_key)
+        failures = [(n, error) for n, _, error in results if error]
+        if failures:
+            raise UploadError(failures)
+        return [response for _, response, _ in results]
+
+
+class BackgroundUploader(object):
+    """Uploads stubs from a bounded queue with worker threads while the 
+    recording continues.
+    
+    :param uploader: the :class:`StubUploader <StubUploader>` to put stubs 
+                     with, its concurrency is the number of worker threads.
+    :param maxsize: maximum number of stubs waiting to be uploaded.
+    :param backpressure: what ``submit`` does when the queue is full, 
+                         'block' waits for space, 'buffer' returns False 
+                         so the caller can keep the stub for later. Once a 
+                         stub is refused later stubs with the same matchers
+                         are refused too, so they are put after it.
+    """
+    
+    BLOCK = 'block'
+    BUFFER = 'buffer'
+    
+    def __init__(self, uploader, maxsize=100, backpressure=BLOCK):
+        if backpressure not in (self.BLOCK, self.BUFFER):
+            raise ValueError('unknown backpressure policy: {0}'.format(
+                                                            backpressure))
+        self.uploader = uploader
+        self.backpressure = backpressure
+        self._pool = WorkerPool(self._put, uploader.concurrency, maxsize,
+                                key=stub_key, name='stubo-uploader')
+        # matcher keys of refused stubs
+        self._refused = set()
+        self._lock = threading.Lock()
+            
+    def _put(self, item):
+        call_number, _, error = self.uploader._put(item)
+        if error:
+            raise error
+            
+    @property
+    def failures(self):
+        return [(item[0], e) for item, e in self._pool.failures]
+            
+    def submit(self, call_number, stub, query_args=None):
+        """Queues a stub for upload, returns False if it was not queued."""
+        item = (call_number, stub, query_args)
+        if self.backpressure == self.BLOCK:
+            return self._pool.submit(item)
+        key = stub_key(item)
+        with self._lock:
+            if key in self._refused:
+                return False
+            if self._pool.submit(item, block=False):
+                return True
+            self._refused.add(key)
+            return False
+        
+    def join(self):
+        """Waits for the queue to drain and stops the workers.
+        
+        :raises UploadError: if any of the queued stubs failed.
+        """
+        self._pool.join()
+        failures = self.failures
+        if failures:
+            raise UploadError(sorted(failures))    
@@ -0,0 +1,156 @@
+"""
+workers.py
+~~~~~~~~~~
+
+Worker threads for the concurrent parts of the client: stub uploads,
+starting and stopping sessions, exports and imports.
+"""
+import threading
+import itertools
+from collections import deque
+
+class WorkerPool(object):
+    """Calls func on the items submitted from ``concurrency`` worker
+    threads.
+
+    Calls that raise are listed in ``failures`` as (item, exception) tuples.
+    Items with the same ``key`` are done one at a time in the order 
+    submitted: while one is in flight the later ones wait and free workers 
+    take items of other keys.
+
+    :param func: called with each item.
+    :param concurrency: number of worker threads.
+    :param maxsize: maximum number of items waiting for a worker, 0 for no
+                    limit.
+    :param key: optional function of an item, items with equal keys keep 
+                their order.
+    :param name: prefix of the worker thread names.
+    """
+
+    def __init__(self, func, concurrency=1, maxsize=0, key=None,
+                 name='stubo-worker'):
+        self.func = func
+        self.key = key
+        self.maxsize = maxsize
+        self.failures = []
+        # key => waiting items, keys in flight and the keys whose first 
+        # waiting item can be taken
+        self._waiting = {}
+        self._busy = set()
+        self._ready = deque()
+        self._size = 0
+        self._closed = False
+        self._unique = itertools.count()
+        self._cond = threading.Condition()
+        self._workers = []
+        for i in range(max(1, concurrency)):
+            worker = threading.Thread(target=self._work,
+                                      name='{0}-{1}'.format(name, i))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def _take(self):
+        """Returns the (key, item) to do next, None once the pool is 
+        joined and no item is left."""
+        with self._cond:
+            while not self._ready:
+                if self._closed and not self._size:
+                    return None
+                self._cond.wait()
+            key = self._ready.popleft()
+            items = self._waiting[key]
+            item = items.popleft()
+            if not items:
+                del self._waiting[key]
+            self._busy.add(key)
+            self._size -= 1
+            self._cond.notify_all()
+            return key, item
+
+    def _done(self, key):
+        with self._cond:
+            self._busy.discard(key)
+            if key in self._waiting:
+                self._ready.append(key)
+                self._cond.notify_all()
+
+    def _work(self):
+        while True:
+            taken = self._take()
+            if taken is None:
+                return
+            key, item = taken
+            try:
+                self.func(item)
+            except Exception as e:
+                with self._cond:
+                    self.failures.append((item, e))
+            finally:
+                self._done(key)
+
+    def submit(self, item, block=True):
+        """Queues an item, returns False if the queue is full and block is
+        False."""
+        key = self.key(item) if self.key else next(self._unique)
+        with self._cond:
+            while self.maxsize and self._size >= self.maxsize:
+                if not block:
+                    return False
+                self._cond.wait()
+            if key in self._waiting:
+                self._waiting[key].append(item)
+            else:
+                self._waiting[key] = deque([item])
+                if key not in self._busy:
+                    self._ready.append(key)
+            self._size += 1
+            self._cond.notify_all()
+            return True
+
+    def join(self):
+        """Waits for the queued items to be done and stops the workers,
+        returns the failures."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+        return self.failures
+
+
+def map_concurrently(func, items, concurrency, key=None):
+    """Returns func of each item in order, calling it from up to
+    ``concurrency`` threads, items with equal keys one at a time in order.
+
+    Items are taken from the iterable as workers become free, so a
+    generator is not read far ahead of the calls. Raises the first
+    exception of func or of the iterable once the workers are done.
+    """
+    results = {}
+    def call(indexed):
+        i, item = indexed
+        results[i] = func(item)
+    pool = WorkerPool(call, concurrency, maxsize=concurrency, 
+                      key=key and (lambda indexed: key(indexed[1])))
+    try:
+        for indexed in enumerate(items):
+            pool.submit(indexed)
+    finally:
+        failures = pool.join()
+    if failures:
+        raise min(failures)[1]
+    return [results[i] for i in xrange(len(results))]
+
+def run_concurrently(func, items, concurrency, key=None):
+    """Calls func on each item from up to concurrency threads, items with
+    equal keys one at a time in order. Returns the (item, exception) of the
+    calls that failed."""
+    pool = WorkerPool(func, concurrency, maxsize=concurrency, key=key)
+    try:
+        for item in items:
+            pool.submit(item)
+    finally:
+        failures = pool.join()
+    return failures